@@ -30,15 +30,36 @@ import bcrypt, sourcetypes
 
 # Imports for database
 import sqlite3
+import itertools
+import contextlib
+import pathlib
 
 # Imports for chart plotting
 import random, datetime, datetime, io, base64
 import matplotlib.pyplot as plt
 
+# Imports for statistics
+import math
+import numpy as np
+
+# Imports for export
+import zlib
+
+# Imports for metrics and profiling
+import bisect
+import cProfile
+import threading
+
 # General imports
-from threading import Thread
+from threading import Thread, Lock
 import asyncio
+import time
+import copy
 import logging
+import logging.handlers
+import atexit
+import queue
+import functools
 import json
 
 
@@ -53,24 +74,18 @@ from cryptography.hazmat.backends import default_backend
 
 # MQTT
 from amqtt.broker import Broker
+from amqtt.plugins.manager import Plugin
 from amqtt.client import MQTTClient, ConnectException, ClientException
 from amqtt.mqtt.constants import QOS_1, QOS_2
 
 ####################################################################################################
 # Configuration
 
-logger = logging.getLogger(__name__)
-mqtt_client = MQTTClient()  # Opretter klienten
-
 script_dir = os.path.dirname(os.path.abspath(__file__))
-print(f"[System] script_dir={script_dir}")
 
 PUBLIC_KEY_PATH = os.path.join(script_dir, "certs", "public_key.pem")
 PRIVATE_KEY_PATH = os.path.join(script_dir, "certs", "private_key.pem")
 
-print(f"[System] PUBLIC_KEY_PATH={PUBLIC_KEY_PATH}")
-print(f"[System] PRIVATE_KEY_PATH={PRIVATE_KEY_PATH}")
-
 USE_HTTPS = False
 GENERATE_TEST_DATA = False
 START_MQTT_BROKER = True
@@ -84,11 +99,33 @@ HOST_PORT = 8080
 REFRESH_DELAY = 10 # Hvor ofte siden skal refreshes
 
 DATABASE_PATH = os.path.join(script_dir, "sensordata.db")
+SCHEMA_VERSION = 4 # 4: månedspartitioner, SensorData kun som TEMP view (connect_compatibility_view). 3: device kolonne. 2: SensorReadings med ts_ms (millisekunder siden epoch). 0/1: SensorData med tekst-timestamps
+DEFAULT_DEVICE = "default" # Enhed der bruges når en måling ikke angiver hvilken sensor den kommer fra
+READING_MIN_TS_MS = 946684800000 # Målinger med ts_ms før 2000-01-01 afvises (sensorens ur er ikke sat)
+READING_MAX_FUTURE_MS = 86400000 # ... og målinger mere end et døgn ud i fremtiden
+DATABASE_WRITE_TIMEOUT = 0.2 # Sekunder der ventes på en låst database når data indsættes, før målingen lægges i spool
+MIGRATION_BATCH_SIZE = 10000 # Rækker pr. transaktion når en gammel database migreres
+MIGRATION_BATCH_PAUSE = 0.05 # Pause (sekunder) mellem batches, så indsættelse ikke bliver blokeret
+DASHBOARD_READINGS = 100 # Antal målinger siderne viser
+HOT_TIER_SIZE = 1000 # Nyeste målinger der holdes i hukommelsen, så siderne ikke behøver spørge databasen
+PARTITION_RETENTION_MONTHS = 0 # Afsluttede partitioner slettes når deres nyeste måling er så mange måneder gammel (0 = behold alt)
+PARTITION_ATTACH_LIMIT = 9 # SQLite kan højst ATTACHe 10 databaser til én forbindelse; én plads holdes fri
+PARTITION_ROLLOVER_DELAY = 60 # Sekunder mellem tjek af om måneden er skiftet (og gamle partitioner skal afsluttes)
 
 MQTT_BROKER_HOST_ADDRESS = "0.0.0.0" # Adresse som MQTT brokeren bliver hostet på (0.0.0.0 binder sig til alle eksterne adresser)
 MQTT_BROKER_HOST_PORT = "1883"
 MQTT_BROKER_CONNECT_ADDRESS = "mqtt://localhost"  # Adresse som MQTT klienten skal forbinde til (Brug "mqtt://localhost" hvis lokal)
 MQTT_TOPIC_SENSORDATA = 'mqtt_sensordata'
+MQTT_BROKER_INGEST_PLUGIN = True # Kører brokeren i samme proces, modtages sensordata direkte i brokeren i stedet for via MQTT-klienten
+MQTT_CLIENT_ID = "iot4-website" # Fast klient-id, så brokeren kan genkende sessionen når klienten forbinder igen
+MQTT_CLEAN_SESSION = False # False: brokeren gemmer abonnement og beskeder (QoS 1/2) mens klienten er væk
+MQTT_QOS = QOS_1 # QoS for abonnementet og testdata (QOS_1 eller QOS_2). QoS 0 bliver ikke gemt hos brokeren
+MQTT_RECONNECT_MIN_DELAY = 1 # Første ventetid (sekunder) før klienten prøver at forbinde igen
+MQTT_RECONNECT_MAX_DELAY = 60 # Ventetiden fordobles for hvert mislykket forsøg, men aldrig over dette
+MQTT_CONNECTION_CHECK_INTERVAL = 1 # Sekunder uden beskeder før klienten tjekker om forbindelsen stadig er der
+
+# Klienten forbinder selv igen (start_mqtt_client), så amqtt's egen auto_reconnect er slået fra
+mqtt_client = MQTTClient(client_id=MQTT_CLIENT_ID, config={"auto_reconnect": False})  # Opretter klienten
 
 
 MIN_TEMPERATURE, MAX_TEMPERATURE = 17, 19
@@ -96,6 +133,29 @@ MIN_HUMIDITY, MAX_HUMIDITY = 40, 60
 MIN_LIGHT_LEVEL, MAX_LIGHT_LEVEL = 0.1, 10
 MIN_LOUDNESS, MAX_LOUDNESS = 0.1, 30
 
+NIGHT_SPLIT_HOUR = 12 # En "nat" går fra kl. 12 middag til kl. 12 næste dag
+
+
+# Spool constants (målinger der venter på databasen)
+SPOOL_PATH = os.path.join(script_dir, "ingest_spool.log")
+SPOOL_MAX_BYTES = 50 * 1024 * 1024 # Når spool-filen er så stor, bliver nye målinger smidt væk
+SPOOL_FSYNC_INTERVAL = 0.5 # Skrivninger til spool-filen fsync'es samlet mindst så ofte (sekunder)
+SPOOL_FSYNC_BATCH = 100 # ... eller når så mange målinger er skrevet
+SPOOL_REPLAY_BATCH = 500 # Målinger pr. transaktion når spool-filen tømmes
+SPOOL_REPLAY_DELAY = 1 # Sekunder mellem forsøg på at tømme spool-filen
+
+
+# Statistik constants
+STATS_PERSIST_DELAY = 30 # Hvor ofte (sekunder) den løbende statistik gemmes i databasen
+STATS_MAX_GAP = 300 # En måling tæller højst for så mange sekunder i "tid inden for interval" (huller i data tælles ikke med)
+STATS_SKETCH_ACCURACY = 0.01 # Relativ fejl på percentiler (1%)
+REPORT_WORST_INTERVALS = 3 # Antal værste perioder uden for interval der vises pr. metric i søvnrapporten
+REPORT_CURRENT_NIGHT_TTL = 10 # Sekunder rapporten for den igangværende nat genbruges før den beregnes igen
+
+
+# Eksport constants
+EXPORT_CHUNK_SIZE = 5000 # Rækker der hentes og sendes ad gangen når data eksporteres
+
 
 # Backup constants
 FTP_HOST = "localhost"
@@ -106,42 +166,997 @@ REMOTE_DIR = "/backups"
 DATABASE_BACKUP_DELAY = 60
 
 
+# Metrics constants
+METRICS_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # Sekunder
+METRICS_SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300) # Sekunder, til backup og FTP
+PROFILE_DIR = os.path.join(script_dir, "profiles") # Hvor cProfile-dumps af udvalgte requests gemmes
+PROFILE_SAMPLE_RATE = 0.0 # Andel af requests der profileres (0 = slået fra). Kan ændres mens programmet kører via /api/profiling
+
+
+# Logging constants
+LOG_NAMESPACE = "iot4" # Alle app'ens loggere hedder iot4.<komponent>, fx iot4.Database
+LOG_LEVEL = "INFO" # DEBUG logger også hver modtaget/sendt besked (højst LOG_DEBUG_RATE_LIMIT pr. sekund)
+LOG_JSON = False # True: én JSON-linje pr. log, til en log-collector. False: læsbar tekst
+LOG_DEBUG_RATE_LIMIT = 20 # Logs pr. sekund for hver slags besked-log. Resten tælles og nævnes som suppressed=N (0 = ingen grænse)
+
+
+
+
+####################################################################################################
+# Logging
+
+# Al logging (også fra amqtt og asyncio) lægges i en kø af en QueueHandler, og en QueueListener i en baggrundstråd
+# skriver den ud. Så venter event loopet (og dermed MQTT-indtaget) aldrig på stdout, heller ikke når outputtet
+# bliver sendt videre til en langsom log-collector. Ekstra felter gives med extra={...} og skrives som key=value
+# (eller som felter i JSON), fx log_database.info("Migrering færdig", extra={"rows": 1000}).
+
+class StructuredFormatter(logging.Formatter):
+    """Formaterer en log som tekst ('tid NIVEAU [Komponent] besked key=value') eller som én JSON-linje."""
+
+    # Felter der altid findes på en LogRecord; alt andet er kommet med via extra={...}
+    RESERVED_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+    def __init__(self, as_json=False):
+        super().__init__()
+        self.as_json = as_json
+
+    def format(self, record):
+        prefix = LOG_NAMESPACE + "."
+        component = record.name[len(prefix):] if record.name.startswith(prefix) else record.name
+        fields = {key: value for key, value in vars(record).items() if key not in self.RESERVED_FIELDS}
+        message = record.getMessage()
+
+        if self.as_json:
+            entry = {
+                "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+                "level": record.levelname,
+                "component": component,
+                "message": message,
+                **fields,
+            }
+            if record.exc_info:
+                entry["exception"] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str, ensure_ascii=False)
+
+        text = f"{self.formatTime(record)} {record.levelname:<7} [{component}] {message}"
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            text += "\n" + self.formatException(record.exc_info)
+        return text
+
+
+class LogRateLimiter:
+    """Token bucket: højst `per_second` logs pr. sekund (med kortvarige udsving op til det samme antal).
+    Logs der bliver holdt tilbage tælles, så den næste der kommer igennem kan fortælle hvor mange der blev sprunget over."""
+
+    def __init__(self, per_second=LOG_DEBUG_RATE_LIMIT):
+        self.per_second = per_second
+        self.tokens = per_second
+        self.updated = time.monotonic()
+        self.suppressed = 0
+
+    def allow(self):
+        if self.per_second <= 0:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.per_second, self.tokens + (now - self.updated) * self.per_second)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.suppressed += 1
+        return False
+
+    def take_suppressed(self):
+        suppressed, self.suppressed = self.suppressed, 0
+        return suppressed
+
+
+def log_rate_limited(limiter, logger, level, message, fields):
+    """Logger kun hvis niveauet er slået til og limiter'en tillader det. Kald den efter en isEnabledFor-check i de varme stier."""
+    if logger.isEnabledFor(level) and limiter.allow():
+        suppressed = limiter.take_suppressed()
+        if suppressed:
+            fields["suppressed"] = suppressed
+        logger.log(level, message, extra=fields)
+
+
+@functools.lru_cache(maxsize=None)
+def get_logger(component):
+    return logging.getLogger(f"{LOG_NAMESPACE}.{component}")
+
+
+logging_state = {"handler": None, "listener": None}
+
+def setup_logging(level=LOG_LEVEL, stream=None, as_json=LOG_JSON, use_queue=True):
+    """
+    Sender al logging til `stream` (standard stdout). Med use_queue skrives der fra en baggrundstråd,
+    ellers direkte fra den tråd der logger. Kan kaldes igen for at ændre opsætningen.
+    """
+    root = logging.getLogger()
+    if logging_state["handler"] is not None:
+        root.removeHandler(logging_state["handler"])
+    if logging_state["listener"] is not None:
+        logging_state["listener"].stop() # Skriver det der ligger i køen færdigt
+
+    stream_handler = logging.StreamHandler(stream or sys.stdout)
+    stream_handler.setFormatter(StructuredFormatter(as_json))
+
+    listener = None
+    handler = stream_handler
+    if use_queue:
+        handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+        listener = logging.handlers.QueueListener(handler.queue, stream_handler)
+        listener.start()
+
+    root.addHandler(handler)
+    root.setLevel(logging.WARNING) # Biblioteker (amqtt, asyncio) logger kun advarsler og fejl
+    logging.getLogger(LOG_NAMESPACE).setLevel(level)
+    logging_state.update(handler=handler, listener=listener)
+
+
+def stop_logging():
+    """Skriver de sidste logs i køen ud. Kaldes automatisk når programmet stopper."""
+    if logging_state["listener"] is not None:
+        logging_state["listener"].stop()
+        logging_state["listener"] = None
+
+
+setup_logging()
+atexit.register(stop_logging)
+
+log_system = get_logger("System")
+log_database = get_logger("Database")
+log_spool = get_logger("Spool")
+log_statistics = get_logger("Statistik")
+log_report = get_logger("Søvnrapport")
+log_export = get_logger("Eksport")
+log_backup = get_logger("Backup")
+log_ftp = get_logger("FTP")
+log_crypto = get_logger("Crypto")
+log_mqtt_client = get_logger("MQTT Client")
+log_mqtt_broker = get_logger("MQTT Broker")
+log_profiling = get_logger("Profiling")
+
+# Begrænsning af logs der ellers ville komme for hver eneste besked
+message_log_limiter = LogRateLimiter()
+publish_log_limiter = LogRateLimiter()
+ingest_warning_limiter = LogRateLimiter()
+after_insert_error_limiter = LogRateLimiter()
+
+log_system.debug("Stier", extra={"script_dir": script_dir, "public_key": PUBLIC_KEY_PATH, "private_key": PRIVATE_KEY_PATH})
+
+
+
+
+####################################################################################################
+# Metrics
+
+# Tællere og histogrammer der vises på /metrics i Prometheus' tekstformat.
+# Målingerne bliver registreret direkte i de varme stier (MQTT, database, sider), så de skal være billige:
+# et histogram har faste buckets der tælles op, så der gemmes ingen enkeltmålinger, og hver serie har sin egen
+# lille lås der kun holdes mens tallene lægges til. Serier med labels oprettes første gang de bruges.
+
+class Counter:
+    """Tæller der kun kan gå op. Med labels: brug .labels(værdi, ...) for at få serien for de værdier."""
+    metric_type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.children = {}
+        self.lock = Lock()
+        self.value = 0
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        return Counter(self.name, self.help)
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def _series(self):
+        """Returnerer (labels, serie) for alle serier. Uden labels er metricen selv den eneste serie."""
+        if not self.label_names:
+            return [((), self)]
+        return [(tuple(zip(self.label_names, values)), child) for values, child in list(self.children.items())]
+
+    def _samples(self, labels):
+        yield self.name, labels, self.value
+
+
+class Gauge(Counter):
+    """Værdi der kan gå op og ned. Med `function` hentes værdien først når /metrics bliver kaldt."""
+    metric_type = "gauge"
+
+    def __init__(self, name, help, labels=(), function=None, metric_type=None):
+        super().__init__(name, help, labels)
+        self.function = function
+        if metric_type:
+            self.metric_type = metric_type # Fx "counter" for totaler der allerede tælles et andet sted
+
+    def _new_child(self):
+        return Gauge(self.name, self.help)
+
+    def set(self, value):
+        self.value = value
+
+    def _samples(self, labels):
+        yield self.name, labels, self.function() if self.function else self.value
+
+
+class Histogram(Counter):
+    """Fordeling af målinger (fx sekunder) i faste buckets, plus sum og antal."""
+    metric_type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=METRICS_LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # Sidste plads er over den største bucket (+Inf)
+        self.sum = 0.0
+
+    def _new_child(self):
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def _samples(self, labels):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            yield self.name + "_bucket", labels + (("le", "+Inf" if bound == float("inf") else repr(bound)),), cumulative
+        yield self.name + "_sum", labels, total
+        yield self.name + "_count", labels, cumulative
+
+
+# Faser i den igangværende request (auth, db, plot, render), som RequestTimingPlugin sender i Server-Timing headeren.
+# Tråd-lokal, så målinger fra andre tråde (fx MQTT) ikke havner i en request.
+request_timing = threading.local()
+
+def record_phase(phase, seconds):
+    """Lægger tid til en fase i den igangværende request. Gør ingenting uden for en request."""
+    phases = getattr(request_timing, "phases", None)
+    if phases is not None:
+        total, count = phases.get(phase, (0.0, 0))
+        phases[phase] = (total + seconds, count + 1)
+
+
+def record_timing(histogram, phase, started):
+    """Registrerer tiden siden `started` (perf_counter) i histogrammet og som fase i den igangværende request."""
+    elapsed = time.perf_counter() - started
+    histogram.observe(elapsed)
+    record_phase(phase, elapsed)
+
+
+metrics_registry = []
+
+def register_metric(metric):
+    metrics_registry.append(metric)
+    return metric
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics():
+    """Alle metrics i Prometheus' tekstformat (version 0.0.4)."""
+    lines = []
+    for metric in metrics_registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+        for labels, series in metric._series():
+            for name, sample_labels, value in series._samples(labels):
+                if sample_labels:
+                    label_text = ",".join(f'{key}="{_escape_label(label_value)}"' for key, label_value in sample_labels)
+                    lines.append(f"{name}{{{label_text}}} {value}")
+                else:
+                    lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# MQTT og indtag
+MQTT_MESSAGES_RECEIVED = register_metric(Counter("mqtt_messages_received_total", "Sensordata-beskeder modtaget", ("source",)))
+MQTT_MESSAGES_DECODED = register_metric(Counter("mqtt_messages_decoded_total", "Sensordata-beskeder dekodet uden fejl", ("source",)))
+MQTT_MESSAGES_FAILED = register_metric(Counter("mqtt_messages_failed_total", "Sensordata-beskeder der ikke kunne behandles", ("source",)))
+READINGS_INGESTED = register_metric(Counter("sensordata_readings_ingested_total", "Målinger gemt, efter hvor de endte (database, spool, dropped)", ("destination",)))
+
+# Database
+DATABASE_INSERT_DURATION = register_metric(Histogram("database_insert_duration_seconds", "Tid for at indsætte målinger (single: én måling, batch: spool-afspilning)", ("operation",)))
+DATABASE_INSERT_ERRORS = register_metric(Counter("database_insert_errors_total", "Indsættelser der fejlede (fx låst database)"))
+DATABASE_QUERY_DURATION = register_metric(Histogram("database_query_duration_seconds", "Tid for læsninger fra databasen", ("query",)))
+HOT_TIER_READS = register_metric(Counter("hot_tier_reads_total", "Læsninger af de nyeste målinger (hit: fra hukommelsen, miss: fra databasen)", ("result",)))
+register_metric(Gauge("hot_tier_readings", "Målinger i hukommelsen", function=lambda: hot_tier.count))
+
+# Sider
+PLOT_RENDER_DURATION = register_metric(Histogram("plot_render_duration_seconds", "Tid for at tegne en graf med matplotlib"))
+HTTP_REQUEST_DURATION = register_metric(Histogram("http_request_duration_seconds", "Tid for at svare på en request, pr. route", ("route",)))
+HTTP_REQUESTS = register_metric(Counter("http_requests_total", "Requests pr. route og statuskode", ("route", "status")))
+AUTH_CHECKS = register_metric(Counter("auth_checks_total", "Login-tjek (bcrypt), efter resultat", ("result",)))
+AUTH_CHECK_DURATION = register_metric(Histogram("auth_check_duration_seconds", "Tid for et login-tjek (bcrypt)"))
+
+# Backup og FTP
+BACKUP_DURATION = register_metric(Histogram("backup_duration_seconds", "Tid for at lave en backup af databasen", buckets=METRICS_SLOW_BUCKETS))
+BACKUP_BYTES = register_metric(Gauge("backup_last_size_bytes", "Størrelsen på den seneste backup"))
+BACKUP_FAILURES = register_metric(Counter("backup_failures_total", "Backups der fejlede"))
+FTP_UPLOAD_DURATION = register_metric(Histogram("ftp_upload_duration_seconds", "Tid for at uploade en backup til FTP", buckets=METRICS_SLOW_BUCKETS))
+FTP_UPLOAD_BYTES = register_metric(Counter("ftp_upload_bytes_total", "Bytes uploadet til FTP"))
+FTP_UPLOAD_FAILURES = register_metric(Counter("ftp_upload_failures_total", "Uploads til FTP der fejlede"))
+
+# Spool (hentes fra ingest_spool.status() når /metrics bliver kaldt)
+for _key, _metric_type, _help in (
+    ("depth", "gauge", "Målinger der venter i spool-filen"),
+    ("bytes", "gauge", "Bytes i spool-filen der venter på at blive afspillet"),
+    ("replay_lag_seconds", "gauge", "Alderen på den ældste ventende måling i spool-filen"),
+    ("spooled_total", "counter", "Målinger lagt i spool-filen"),
+    ("replayed_total", "counter", "Målinger afspillet fra spool-filen til databasen"),
+    ("dropped_total", "counter", "Målinger smidt væk fordi spool-filen var fuld"),
+    ("dead_letter_total", "counter", "Målinger fra spool-filen der aldrig kan indsættes og er flyttet til dead-letter filen"),
+):
+    register_metric(Gauge(f"spool_{_key}", _help, function=lambda key=_key: ingest_spool.status()[key], metric_type=_metric_type))
+
+# Faste serier til de varme stier, så der ikke slås op i .labels() for hver besked
+DB_INSERT_SINGLE = DATABASE_INSERT_DURATION.labels("single")
+DB_INSERT_BATCH = DATABASE_INSERT_DURATION.labels("batch")
+DB_QUERY_LATEST_READINGS = DATABASE_QUERY_DURATION.labels("latest_readings")
+DB_QUERY_LATEST_TIMESTAMP = DATABASE_QUERY_DURATION.labels("latest_timestamp")
+DB_QUERY_NIGHT_READINGS = DATABASE_QUERY_DURATION.labels("night_readings")
+HOT_TIER_HITS = HOT_TIER_READS.labels("hit")
+HOT_TIER_MISSES = HOT_TIER_READS.labels("miss")
+READINGS_INGESTED_BY_DESTINATION = {destination: READINGS_INGESTED.labels(destination) for destination in ("database", "spool", "dropped")}
+AUTH_CHECKS_OK = AUTH_CHECKS.labels("ok")
+AUTH_CHECKS_WRONG_PASSWORD = AUTH_CHECKS.labels("wrong_password")
+AUTH_CHECKS_UNKNOWN_USER = AUTH_CHECKS.labels("unknown_user")
+INGEST_SOURCE_METRICS = {}
+
+def ingest_source_metrics(source):
+    """(logger, modtaget, dekodet, fejlet) for en kilde. MQTT-kilderne er bundet på forhånd; andre oprettes ved første brug."""
+    metrics = INGEST_SOURCE_METRICS.get(source)
+    if metrics is None:
+        metrics = INGEST_SOURCE_METRICS.setdefault(source, (
+            get_logger(source), MQTT_MESSAGES_RECEIVED.labels(source), MQTT_MESSAGES_DECODED.labels(source), MQTT_MESSAGES_FAILED.labels(source)
+        ))
+    return metrics
+
+for _source in ("MQTT Broker", "MQTT Client"):
+    ingest_source_metrics(_source)
+
+
 
 
 ####################################################################################################
 # Database
 
-try:
-    # Forbind til SQLite-databasen (vil oprette databasefilen, hvis den ikke findes)
-    db = sqlite3.connect(DATABASE_PATH)
+schema_state = {"migrating": False} # Sættes mens en gammel database bliver migreret i baggrunden
 
-    # Opret et cursor-objekt til at interagere med databasen
-    cursor = db.cursor()
+def init_database(db_path=None):
+    """Opretter databasefilen og tabellerne, hvis de ikke findes."""
+    if db_path is None:
+        db_path = DATABASE_PATH
 
-    # Opret en tabel til at gemme sensor data i
-    sql_table_creation: sourcetypes.sql = """
-        CREATE TABLE IF NOT EXISTS SensorData (
+    try:
+        # Forbind til SQLite-databasen (vil oprette databasefilen, hvis den ikke findes)
+        db = sqlite3.connect(db_path)
+
+        # Opret et cursor-objekt til at interagere med databasen
+        cursor = db.cursor()
+
+        # Målingerne ligger i partitionerne (se "Partitioner" nedenfor). Hoveddatabasens egen SensorReadings tabel
+        # bruges til rækker der skal fordeles ud i dem.
+        create_readings_table(cursor)
+
+        # Skema 2 -> 3: tilføj device kolonnen (ADD COLUMN med en konstant standardværdi omskriver ikke tabellen)
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(SensorReadings)")]
+        if "device" not in columns:
+            cursor.execute(f"ALTER TABLE SensorReadings ADD COLUMN device TEXT NOT NULL DEFAULT '{DEFAULT_DEVICE}'")
+
+        # Findes den gamle SensorData tabel (tekst-timestamps), skal den migreres (se migrate_database).
+        # Nye rækker får id'er efter de gamle, så de gamle kan kopieres over med deres oprindelige id.
+        legacy = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'SensorData'").fetchone()
+        if legacy:
+            legacy_max_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM SensorData").fetchone()[0]
+            if cursor.execute("SELECT 1 FROM sqlite_sequence WHERE name = 'SensorReadings'").fetchone():
+                cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'SensorReadings'", (legacy_max_id,))
+            else:
+                cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('SensorReadings', ?)", (legacy_max_id,))
+        else:
+            drop_compatibility_view(cursor)
+
+        # Opret tabeller til den løbende statistik (se "Statistik" længere nede)
+        sql_stats_table_creation: sourcetypes.sql = """
+            CREATE TABLE IF NOT EXISTS SensorStats (
+                window TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                state TEXT NOT NULL,
+                PRIMARY KEY (window, metric)
+            )
+        """
+        cursor.execute(sql_stats_table_creation)
+
+        sql_stats_checkpoint_creation: sourcetypes.sql = """
+            CREATE TABLE IF NOT EXISTS SensorStatsCheckpoint (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                last_id INTEGER NOT NULL
+            )
+        """
+        cursor.execute(sql_stats_checkpoint_creation)
+
+
+        # Cache til færdige søvnrapporter (se "Søvnrapport" længere nede)
+        sql_report_table_creation: sourcetypes.sql = """
+            CREATE TABLE IF NOT EXISTS NightlyReport (
+                night TEXT PRIMARY KEY,
+                report TEXT NOT NULL
+            )
+        """
+        cursor.execute(sql_report_table_creation)
+
+        # Oversigt over partitionerne. Intervallerne (tidspunkter og id'er) gemmes når en partition bliver afsluttet.
+        sql_partitions_table_creation: sourcetypes.sql = """
+            CREATE TABLE IF NOT EXISTS Partitions (
+                month TEXT PRIMARY KEY,
+                sealed INTEGER NOT NULL DEFAULT 0,
+                first_ts_ms INTEGER,
+                last_ts_ms INTEGER,
+                first_id INTEGER,
+                last_id INTEGER,
+                rows INTEGER,
+                uploaded INTEGER NOT NULL DEFAULT 0
+            )
+        """
+        cursor.execute(sql_partitions_table_creation)
+
+        # Gem ændringerne og luk databasen
+        db.commit()
+
+        log_database.info("Database og tabel er oprettet succesfuldt!")
+
+        if legacy:
+            schema_state["migrating"] = True
+            log_database.warning("Databasen bruger det gamle skema og bliver migreret i baggrunden.")
+
+    except Exception as ex:
+        log_database.error("Kunne ikke oprette databasen", extra={"error": ex})
+        return
+
+    finally:
+        # Kører altid efter try eller except, for at sikre at databasen bliver lukket.
+        if "db" in locals(): db.close()
+
+    # Under en migrering fordeles rækkerne først når den er færdig
+    if not legacy:
+        distribute_readings(db_path)
+
+
+def create_readings_table(cursor):
+    """Opretter SensorReadings tabellen og dens index. Bruges både i hoveddatabasen og i hver partition."""
+    # Tidspunktet gemmes som millisekunder siden epoch (UTC)
+    sql_table_creation: sourcetypes.sql = f"""
+        CREATE TABLE IF NOT EXISTS SensorReadings (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            ts_ms INTEGER NOT NULL,
             temperature REAL,
             humidity REAL,
             loudness REAL,
-            light_level REAL
+            light_level REAL,
+            device TEXT NOT NULL DEFAULT '{DEFAULT_DEVICE}'
         )
     """
     cursor.execute(sql_table_creation)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sensorreadings_ts ON SensorReadings (ts_ms)")
+
+
+def drop_compatibility_view(cursor):
+    """
+    Fjerner SensorData viewet og dets INSERT-trigger fra skema 2 og 3, og sætter skemaversionen.
+    Et view i hoveddatabasen kan ikke se ind i partitionerne, så det ville kun vise de rækker der venter på at blive
+    fordelt. I stedet oprettes SensorData pr. forbindelse af connect_compatibility_view (eller sensordata_view.py
+    for værktøjer uden for Python), hvor partitionerne er ATTACHet.
+    """
+    cursor.execute("DROP TRIGGER IF EXISTS SensorData_insert")
+    cursor.execute("DROP VIEW IF EXISTS SensorData")
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def migrate_database(db_path=None, batch_size=MIGRATION_BATCH_SIZE, pause=MIGRATION_BATCH_PAUSE):
+    """
+    Flytter rækkerne fra den gamle SensorData tabel over i SensorReadings i små transaktioner,
+    så indsættelse og læsning kan fortsætte imens. De nyeste rækker flyttes først, da det er dem siderne viser.
+    Kan afbrydes og startes igen. Til sidst fjernes den gamle tabel.
+    """
+    if db_path is None:
+        db_path = DATABASE_PATH
+
+    try:
+        db = sqlite3.connect(db_path)
+        cursor = db.cursor()
+
+        if not cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'SensorData'").fetchone():
+            schema_state["migrating"] = False
+            return
+
+        legacy_max_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM SensorData").fetchone()[0]
+        started = datetime.datetime.now()
+        migrated = 0
+
+        sql_migrate_batch: sourcetypes.sql = """
+            INSERT INTO SensorReadings (id, ts_ms, temperature, humidity, loudness, light_level)
+            SELECT id, CAST(strftime('%s', timestamp, 'utc') AS INTEGER) * 1000, temperature, humidity, loudness, light_level
+            FROM SensorData WHERE id < ? ORDER BY id DESC LIMIT ?
+        """
+
+        while True:
+            # Den laveste id der allerede er flyttet (eller første nye række) er grænsen for næste batch
+            lowest_id = cursor.execute(
+                "SELECT MIN(id) FROM SensorReadings WHERE id <= ?", (legacy_max_id,)
+            ).fetchone()[0]
+            if lowest_id is None:
+                lowest_id = legacy_max_id + 1
+
+            with db:
+                cursor.execute(sql_migrate_batch, (lowest_id, batch_size))
+                copied = cursor.rowcount
+            migrated += copied
+
+            if copied < batch_size:
+                break
+            time.sleep(pause) # Giv andre skrivere en chance for at få låsen
+
+        # Fjern den gamle tabel og sæt skemaversionen i én transaktion
+        with db:
+            cursor.execute("DROP TABLE SensorData")
+            drop_compatibility_view(cursor)
+
+        schema_state["migrating"] = False
+        seconds = (datetime.datetime.now() - started).total_seconds()
+        log_database.info("Migrering færdig", extra={"rows": migrated, "seconds": round(seconds, 1)})
+
+    except Exception as ex:
+        log_database.error("Der opstod en fejl under migrering", extra={"error": ex})
+
+    finally:
+        if "db" in locals():
+            db.close()
+
+
+####################################################################################################
+# Partitioner
+
+# Målingerne gemmes i én SQLite-fil pr. måned (lokal tid) i en mappe ved siden af hoveddatabasen, fx
+# sensordata_partitions/sensordata_2024-12.db. Kun den aktuelle måneds partition bliver skrevet i. Når måneden
+# skifter, skifter partition_rollover_loop til en ny partition og afslutter den forrige i en baggrundstråd: dens
+# intervaller (tidspunkter og id'er) gemmes i Partitions tabellen, filen gøres skrivebeskyttet, og den åbnes
+# derefter kun read-only. Så vokser backup, vacuum og sletning af gamle data ikke med
+# hele historikken: sletning er at fjerne en fil, og backup sender kun den aktive partition og de afsluttede der
+# ikke er sendt endnu.
+#
+# En forespørgsel deles op i måneder (eller id-intervaller), og for hver del ATTACHes kun de partitioner hvis
+# interval rører den. Hoveddatabasens egen SensorReadings tabel er altid med. Rækker der havner der (fra en ældre
+# version, migreringen, import_data.py eller generate_history.py) flyttes ud i partitionerne af distribute_readings.
+# En afsluttet måned ændres aldrig. Kommer der målinger til den bagefter (import, eller en sensor med forkert ur),
+# lægges de i den aktive partition, hvis interval så bliver bredere.
+# Id'er er fælles for alle partitioner (nye partitioner starter efter det højeste id), så statistikkens checkpoint
+# og hot_tier kan blive ved med at bruge dem.
+
+partition_state = {"active": (None, None, None)} # (hoveddatabase, måned, sti) for den partition der skrives i
+partition_lock = Lock() # Skift af måned og fordeling af rækker sker kun én ad gangen
+
+
+def get_month(ts_ms):
+    """Måneden ('YYYY-MM', lokal tid) et tidspunkt i millisekunder siden epoch hører til."""
+    return datetime.datetime.fromtimestamp(ts_ms / 1000).strftime('%Y-%m')
+
+
+def get_month_bounds(month):
+    """Returnerer (start, slut) i millisekunder siden epoch for en måned 'YYYY-MM' i lokal tid."""
+    start = datetime.datetime.strptime(month, '%Y-%m')
+    end = (start + datetime.timedelta(days=32)).replace(day=1)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+
+
+def get_partition_path(month, db_path=None):
+    base = os.path.splitext(db_path or DATABASE_PATH)[0]
+    return os.path.join(f"{base}_partitions", f"{os.path.basename(base)}_{month}.db")
+
+
+def get_highest_id(db, db_path):
+    """Det højeste id der er brugt i hoveddatabasen eller en partition. `db` er forbundet til hoveddatabasen."""
+    highest = db.execute("""
+        SELECT MAX(
+            (SELECT COALESCE(MAX(last_id), 0) FROM Partitions WHERE sealed = 1),
+            (SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'SensorReadings')
+        )
+    """).fetchone()[0]
+    for (month,) in db.execute("SELECT month FROM Partitions WHERE sealed = 0").fetchall():
+        with contextlib.closing(sqlite3.connect(get_partition_path(month, db_path))) as partition:
+            sequence = partition.execute("SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'SensorReadings'").fetchone()[0]
+        highest = max(highest, sequence)
+    return highest
+
+
+def open_partition(db, month, db_path):
+    """Opretter partitionen for en måned, hvis den ikke findes. Returnerer stien til den."""
+    path = get_partition_path(month, db_path)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        first_id = get_highest_id(db, db_path)
+        with contextlib.closing(sqlite3.connect(path)) as partition:
+            with partition:
+                create_readings_table(partition.cursor())
+                partition.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('SensorReadings', ?)", (first_id,))
+    with db:
+        db.execute("INSERT OR IGNORE INTO Partitions (month) VALUES (?)", (month,))
+    return path
+
+
+def seal_partition(db, month, db_path):
+    """Afslutter en partition: gemmer dens intervaller og gør filen skrivebeskyttet. En tom partition slettes."""
+    path = get_partition_path(month, db_path)
+    with contextlib.closing(sqlite3.connect(path)) as partition:
+        # Hver for sig, så MIN/MAX kan slås op i index i stedet for at læse hele tabellen
+        first_ts_ms = partition.execute("SELECT MIN(ts_ms) FROM SensorReadings").fetchone()[0]
+        last_ts_ms = partition.execute("SELECT MAX(ts_ms) FROM SensorReadings").fetchone()[0]
+        first_id = partition.execute("SELECT MIN(id) FROM SensorReadings").fetchone()[0]
+        last_id = partition.execute("SELECT MAX(id) FROM SensorReadings").fetchone()[0]
+        rows = partition.execute("SELECT COUNT(*) FROM SensorReadings").fetchone()[0]
+
+    with db:
+        if rows == 0:
+            db.execute("DELETE FROM Partitions WHERE month = ?", (month,))
+        else:
+            db.execute(
+                "UPDATE Partitions SET sealed = 1, first_ts_ms = ?, last_ts_ms = ?, first_id = ?, last_id = ?, rows = ? WHERE month = ?",
+                (first_ts_ms, last_ts_ms, first_id, last_id, rows, month)
+            )
+
+    if rows == 0:
+        os.remove(path)
+    else:
+        os.chmod(path, 0o444)
+        log_database.info("Partition afsluttet", extra={"month": month, "rows": rows})
+
+
+def delete_expired_partitions(db, db_path):
+    """Sletter afsluttede partitioner hvis nyeste måling er ældre end PARTITION_RETENTION_MONTHS."""
+    if PARTITION_RETENTION_MONTHS <= 0:
+        return
+
+    cutoff = datetime.datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    for _ in range(PARTITION_RETENTION_MONTHS):
+        cutoff = (cutoff - datetime.timedelta(days=1)).replace(day=1)
+    cutoff_ms = int(cutoff.timestamp() * 1000)
+
+    expired = db.execute(
+        "SELECT month, uploaded FROM Partitions WHERE sealed = 1 AND last_ts_ms < ? ORDER BY month", (cutoff_ms,)
+    ).fetchall()
+    for month, uploaded in expired:
+        if DATABASE_BACKUP and not uploaded:
+            log_database.warning("Partitionen er ikke sendt til backup endnu og bliver ikke slettet", extra={"month": month})
+            continue
+        path = get_partition_path(month, db_path)
+        with db:
+            db.execute("DELETE FROM Partitions WHERE month = ?", (month,))
+        if os.path.exists(path):
+            os.chmod(path, 0o644) # Skrivebeskyttede filer kan ikke slettes på Windows
+            os.remove(path)
+        log_database.info("Partition slettet", extra={"month": month})
+
+
+def get_active_partition(db_path=None):
+    """
+    Returnerer stien til den partition der skrives i. Første gang åbnes den aktuelle måneds partition; derefter
+    skiftes der kun når partition_rollover_loop har set at måneden er skiftet. Indsættelserne laver så aldrig
+    det tunge arbejde med at afslutte og slette partitioner.
+    """
+    db_path = db_path or DATABASE_PATH
+    active_db_path, active_month, path = partition_state["active"]
+    if active_db_path == db_path:
+        return path
+    return switch_active_partition(db_path)
+
+
+def switch_active_partition(db_path=None):
+    """Åbner den aktuelle måneds partition og skriver i den fremover. Returnerer stien til den."""
+    db_path = db_path or DATABASE_PATH
+    month = datetime.datetime.now().strftime('%Y-%m')
+    with partition_lock:
+        with contextlib.closing(sqlite3.connect(db_path)) as db:
+            path = open_partition(db, month, db_path)
+            # Er filen oprettet tidligere (fx af import_data.py), kan den gamle partition have fået højere id'er siden
+            highest_id = get_highest_id(db, db_path)
+        with contextlib.closing(sqlite3.connect(path)) as partition:
+            with partition:
+                partition.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'SensorReadings'", (highest_id,))
+        partition_state["active"] = (db_path, month, path)
+        return path
+
+
+def rollover_partitions(db_path=None):
+    """
+    Afslutter partitionerne fra før den aktive og sletter dem der er ældre end PARTITION_RETENTION_MONTHS.
+    Læser hele måneder (MIN/MAX/COUNT) og sletter filer, så den køres i en baggrundstråd.
+    """
+    db_path = db_path or DATABASE_PATH
+    get_active_partition(db_path)
+    with partition_lock:
+        active_month = partition_state["active"][1]
+        with contextlib.closing(sqlite3.connect(db_path)) as db:
+            for (old_month,) in db.execute("SELECT month FROM Partitions WHERE sealed = 0 AND month != ?", (active_month,)).fetchall():
+                seal_partition(db, old_month, db_path)
+            delete_expired_partitions(db, db_path)
+
+
+async def partition_rollover_loop(delay=PARTITION_ROLLOVER_DELAY):
+    """
+    Skifter til en ny partition når måneden skifter, og afslutter de gamle i en baggrundstråd.
+    Skiftet sker i event loopet mellem to indsættelser, så ingen indsættelse er i gang i den gamle partition
+    når den bliver afsluttet. Målinger fra de første sekunder af en ny måned kan havne i den gamle partition;
+    dens interval bliver så bare bredere.
+    """
+    while True:
+        try:
+            if partition_state["active"][1] != datetime.datetime.now().strftime('%Y-%m'):
+                switch_active_partition()
+            await asyncio.to_thread(rollover_partitions)
+        except Exception as ex:
+            log_database.error("Kunne ikke skifte partition", extra={"error": ex})
+        await asyncio.sleep(delay)
+
+
+def distribute_readings(db_path=None):
+    """
+    Flytter rækkerne i hoveddatabasens SensorReadings ud i partitionerne, én måned ad gangen i hver sin transaktion.
+    Rækkerne beholder deres id, medmindre id'erne allerede er brugt i en partition (fx rækker fra import_data.py);
+    så får de nye id'er efter de højeste, i samme rækkefølge.
+    """
+    db_path = db_path or DATABASE_PATH
+    active_path = get_active_partition(db_path)
+    active_month = partition_state["active"][1]
+
+    with partition_lock, contextlib.closing(sqlite3.connect(db_path)) as db:
+        first_ts_ms, last_ts_ms, low_id, high_id = db.execute(
+            "SELECT MIN(ts_ms), MAX(ts_ms), MIN(id), MAX(id) FROM SensorReadings"
+        ).fetchone()
+        if first_ts_ms is None:
+            return 0
+
+        started = time.perf_counter()
+        lowest_used, highest_used = get_id_bounds(db, db_path, include_main=False)
+        renumber = lowest_used is not None and low_id <= highest_used and high_id >= lowest_used
+        next_id = get_highest_id(db, db_path)
+        sealed = {month for (month,) in db.execute("SELECT month FROM Partitions WHERE sealed = 1")}
+
+        id_expression = ":next_id + ROW_NUMBER() OVER (ORDER BY id)" if renumber else "id"
+        sql_move_month: sourcetypes.sql = f"""
+            INSERT INTO target.SensorReadings (id, ts_ms, device, temperature, humidity, loudness, light_level)
+            SELECT {id_expression}, ts_ms, device, temperature, humidity, loudness, light_level
+            FROM main.SensorReadings WHERE ts_ms >= :start AND ts_ms < :end ORDER BY id
+        """
+
+        moved = 0
+        month = get_month(first_ts_ms)
+        while True:
+            start_ms, end_ms = get_month_bounds(month)
+            # Afsluttede måneder ændres ikke, og måneder efter den aktuelle (forkert ur) har ingen partition endnu
+            new_month = month < active_month and month not in sealed
+            target_path = open_partition(db, month, db_path) if new_month else active_path
+            if month >= get_month(last_ts_ms):
+                end_ms = last_ts_ms + 1
+
+            db.execute("ATTACH DATABASE ? AS target", (target_path,))
+            try:
+                # Kopiering og sletning i samme transaktion (på tværs af filerne), så ingen rækker bliver dobbelte eller tabt
+                with db:
+                    copied = db.execute(sql_move_month, {"start": start_ms, "end": end_ms, "next_id": next_id}).rowcount
+                    db.execute("DELETE FROM main.SensorReadings WHERE ts_ms >= ? AND ts_ms < ?", (start_ms, end_ms))
+            finally:
+                db.execute("DETACH DATABASE target")
+
+            if renumber:
+                next_id += copied
+            moved += copied
+            if new_month:
+                seal_partition(db, month, db_path)
+            if end_ms > last_ts_ms:
+                break
+            month = get_month(end_ms)
+
+        # Nye id'er i den aktive partition (og hoveddatabasen) skal starte efter dem der er brugt nu
+        with contextlib.closing(sqlite3.connect(active_path)) as partition:
+            with partition:
+                partition.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'SensorReadings'", (next_id,))
+        with db:
+            db.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'SensorReadings'", (next_id,))
+        # Giv pladsen fra de flyttede rækker tilbage; hoveddatabasen er lille uden dem
+        db.execute("VACUUM")
+
+    log_database.info("Rækker fordelt i partitioner", extra={
+        "rows": moved, "renumbered": renumber, "seconds": round(time.perf_counter() - started, 1)
+    })
+    return moved
+
+
+def get_key_bounds(db, key, db_path, include_main=True):
+    """
+    Laveste og højeste værdi af `key` ("ts_ms" eller "id") i alle partitioner (og hoveddatabasen),
+    eller (None, None) hvis der ikke er nogen rækker. `db` er forbundet til hoveddatabasen.
+    """
+    bounds = [db.execute(f"SELECT MIN(first_{key}), MAX(last_{key}) FROM Partitions WHERE sealed = 1").fetchone()]
+    if include_main:
+        bounds.append(db.execute(f"SELECT MIN({key}), MAX({key}) FROM SensorReadings").fetchone())
+    for (month,) in db.execute("SELECT month FROM Partitions WHERE sealed = 0").fetchall():
+        with contextlib.closing(sqlite3.connect(get_partition_path(month, db_path))) as partition:
+            # Hver for sig, så de kan slås op i index
+            low = partition.execute(f"SELECT MIN({key}) FROM SensorReadings").fetchone()[0]
+            high = partition.execute(f"SELECT MAX({key}) FROM SensorReadings").fetchone()[0]
+            bounds.append((low, high))
+
+    lows = [low for low, high in bounds if low is not None]
+    highs = [high for low, high in bounds if high is not None]
+    return (min(lows), max(highs)) if lows else (None, None)
+
+
+def get_id_bounds(db, db_path, include_main=True):
+    return get_key_bounds(db, "id", db_path, include_main)
+
+
+def get_windows(db, key, start, end, db_path):
+    """
+    Deler [start, end) op i dele der hver kun rører få partitioner: kalendermåneder for ts_ms, og for id
+    intervaller der starter ved hver afsluttet partitions første id. Dele uden data springes over.
+    """
+    low, high = get_key_bounds(db, key, db_path)
+    if low is None:
+        return []
+    start = low if start is None else max(start, low)
+    end = high + 1 if end is None else min(end, high + 1)
+
+    windows = []
+    if key == "ts_ms":
+        while start < end:
+            month_end = get_month_bounds(get_month(start))[1]
+            windows.append((start, min(month_end, end)))
+            start = month_end
+    else:
+        boundaries = sorted({first_id for (first_id,) in db.execute(
+            "SELECT first_id FROM Partitions WHERE sealed = 1 AND first_id > ? AND first_id < ?", (start, end)
+        )})
+        for boundary in boundaries + [end]:
+            windows.append((start, boundary))
+            start = boundary
+    return windows
+
+
+def attach_partitions(db, key, start, end, db_path):
+    """
+    ATTACHer de partitioner der kan indeholde rækker med `key` i [start, end): afsluttede hvis interval rører det
+    (read-only), og altid den aktive. Returnerer tabellerne der skal spørges i, inklusive hoveddatabasens.
+    """
+    partitions = db.execute(
+        f"SELECT month, sealed FROM Partitions WHERE sealed = 0 OR (last_{key} >= ? AND first_{key} < ?) ORDER BY month",
+        (start, end)
+    ).fetchall()
+    if len(partitions) > PARTITION_ATTACH_LIMIT:
+        raise sqlite3.OperationalError(f"{len(partitions)} partitioner overlapper {key} [{start}, {end}), højst {PARTITION_ATTACH_LIMIT} kan ATTACHes")
+
+    tables = ["main.SensorReadings"]
+    for index, (month, sealed) in enumerate(partitions):
+        path = get_partition_path(month, db_path)
+        if sealed:
+            path = pathlib.Path(path).resolve().as_uri() + "?mode=ro"
+        db.execute(f"ATTACH DATABASE ? AS p{index}", (path,))
+        tables.append(f"p{index}.SensorReadings")
+    return tables
+
+
+def iter_reading_chunks(select, key="ts_ms", start=None, end=None, descending=False, chunk_size=EXPORT_CHUNK_SIZE, db_path=None):
+    """
+    Generator der returnerer rækkerne med `key` ("ts_ms" eller "id") i [start, end) fra hoveddatabasen og
+    partitionerne, sorteret efter `key`, i lister af højst chunk_size.
+    `select` er en SELECT ... FROM {table} uden WHERE, hvis resultat har en kolonne med navnet `key`
+    (og `id` med descending=True, så målinger med samme tidspunkt kommer i samme rækkefølge som i hot_tier).
+    """
+    db_path = db_path or DATABASE_PATH
+    order = f"{key} DESC" + (", id DESC" if key != "id" else "") if descending else key
+
+    with contextlib.closing(sqlite3.connect(db_path, uri=True)) as db:
+        windows = get_windows(db, key, start, end, db_path)
+
+    for window_start, window_end in reversed(windows) if descending else windows:
+        # Ny forbindelse for hver del, så der kun er de partitioner ATTACHet som den del rører
+        with contextlib.closing(sqlite3.connect(db_path, uri=True)) as db:
+            tables = attach_partitions(db, key, window_start, window_end, db_path)
+            # Oftest har kun én af tabellerne rækker i delen, og så er der ingen grund til at flette (slås op i index)
+            tables = [table for table in tables if db.execute(
+                f"SELECT EXISTS (SELECT 1 FROM {table} WHERE {key} >= ? AND {key} < ?)", (window_start, window_end)
+            ).fetchone()[0]]
+            if not tables:
+                continue
+            # ORDER BY på hele UNION ALL, så SQLite fletter de sorterede dele via index i stedet for at sortere alt
+            sql = "\nUNION ALL\n".join(f"{select.format(table=table)} WHERE {key} >= :start AND {key} < :end" for table in tables)
+            cursor = db.execute(f"{sql}\nORDER BY {order}", {"start": window_start, "end": window_end})
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+
+
+def connect_compatibility_view(start=None, end=None, db_path=None):
+    """
+    Åbner en forbindelse til hoveddatabasen hvor SensorData er et TEMP view med de gamle kolonner (id, tekst-timestamp
+    i lokal tid, temperature, humidity, loudness, light_level) over hoveddatabasen og de partitioner der rører
+    [start, end) i ts_ms (None = ingen grænse). Til gamle forespørgsler og værktøjer der læser SensorData.
+    Viewet findes kun på den forbindelse og kan ikke skrives i. Rører intervallet flere end PARTITION_ATTACH_LIMIT
+    partitioner, rejses sqlite3.OperationalError; del det så op, fx i måneder.
+    """
+    db_path = db_path or DATABASE_PATH
+    start = -2**63 if start is None else int(start)
+    end = 2**63 - 1 if end is None else int(end)
+
+    db = sqlite3.connect(db_path, uri=True)
+    try:
+        tables = attach_partitions(db, "ts_ms", start, end, db_path)
+        sql_view_creation: sourcetypes.sql = "CREATE TEMP VIEW SensorData AS\n" + "\nUNION ALL\n".join(f"""
+            SELECT
+                id,
+                strftime('%Y-%m-%d %H:%M:%S', ts_ms / 1000, 'unixepoch', 'localtime') AS timestamp,
+                temperature,
+                humidity,
+                loudness,
+                light_level
+            FROM {table} WHERE ts_ms >= {start} AND ts_ms < {end}
+        """ for table in tables)
+        db.execute(sql_view_creation)
+    except Exception:
+        db.close()
+        raise
+    return db
+
+
+def fetch_newest_readings(limit, db_path=None):
+    """Returnerer de `limit` nyeste rækker (id, ts_ms, temperature, humidity, loudness, light_level), nyeste først."""
+    rows = []
+    select = "SELECT id, ts_ms, temperature, humidity, loudness, light_level FROM {table}"
+    with contextlib.closing(iter_reading_chunks(select, descending=True, chunk_size=limit, db_path=db_path)) as chunks:
+        for chunk in chunks:
+            rows += chunk
+            if len(rows) >= limit:
+                break
+    return rows[:limit]
+
 
-    # Gem ændringerne og luk databasen
-    db.commit()
+def get_unuploaded_partitions(db_path=None):
+    """Returnerer (måned, sti) for de afsluttede partitioner der ikke er sendt til backup endnu."""
+    db_path = db_path or DATABASE_PATH
+    with contextlib.closing(sqlite3.connect(db_path)) as db:
+        months = db.execute("SELECT month FROM Partitions WHERE sealed = 1 AND uploaded = 0 ORDER BY month").fetchall()
+    return [(month, get_partition_path(month, db_path)) for (month,) in months]
 
-    print("[Database] Database og tabel er oprettet succesfuldt!")
 
-except Exception as ex:
-    print(ex)
+def mark_partition_uploaded(month, db_path=None):
+    """Noterer at en afsluttet partition er sendt til backup. Den ændres aldrig igen, så den skal ikke sendes igen."""
+    with contextlib.closing(sqlite3.connect(db_path or DATABASE_PATH)) as db:
+        with db:
+            db.execute("UPDATE Partitions SET uploaded = 1 WHERE month = ?", (month,))
 
-finally:
-    # Kører altid efter try eller except, for at sikre at databasen bliver lukket.
-    if "db" in locals(): db.close()
+
+init_database()
 
 
 
@@ -150,35 +1165,109 @@ def get_current_timestamp():
     return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
 
-def insert_data_into_database(data: list):
+def format_timestamp_ms(ts_ms):
+    """Formaterer millisekunder siden epoch som String i lokal tid."""
+    return datetime.datetime.fromtimestamp(ts_ms / 1000).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def insert_data_into_database(data: list, ts_ms=None, device=DEFAULT_DEVICE):
+        """
+        Indsætter en måling i databasen. Returnerer True hvis det lykkedes.
+        Databasen ventes højst DATABASE_WRITE_TIMEOUT sekunder på, så event loopet ikke bliver blokeret.
+        """
+        started = time.perf_counter()
         try:
-            # Forbind til SQLite-databasen
-            db = sqlite3.connect(DATABASE_PATH)
+            # Forbind til den aktuelle måneds partition
+            db = sqlite3.connect(get_active_partition(), timeout=DATABASE_WRITE_TIMEOUT)
             cursor = db.cursor()
-            
-            timestamp = get_current_timestamp() # Aktuel tid
+
+            if ts_ms is None:
+                ts_ms = int(time.time() * 1000) # Aktuel tid
 
             # Udpak data listen til variabler
             temperature, humidity, loudness, light_level = data
 
             # Sæt data ind i tabellen
             sql_insert_into_table: sourcetypes.sql = """
-                INSERT INTO SensorData (timestamp, temperature, humidity, loudness, light_level)
-                VALUES (?, ?, ?, ?, ?)
+                INSERT INTO SensorReadings (ts_ms, device, temperature, humidity, loudness, light_level)
+                VALUES (?, ?, ?, ?, ?, ?)
             """
-            cursor.execute(sql_insert_into_table, (timestamp, temperature, humidity, loudness, light_level))
+            cursor.execute(sql_insert_into_table, (ts_ms, device, temperature, humidity, loudness, light_level))
 
             # Gem ændringer i databasen
             db.commit()
+            DB_INSERT_SINGLE.observe(time.perf_counter() - started)
+            row_id = cursor.lastrowid
 
         except Exception as ex:
-            print(f"[Database] Der opstod en fejl: {ex}")
+            DATABASE_INSERT_ERRORS.inc()
+            # Sker typisk når databasen er låst, så målingen går i spool. Kan ske for hver besked, derfor begrænset.
+            log_rate_limited(ingest_warning_limiter, log_database, logging.WARNING, "Kunne ikke indsætte måling", {"error": ex})
+            return False
 
         finally:
             # Sørg for at databasen bliver lukket
             if "db" in locals():
                 db.close()
 
+        # Opdater den løbende statistik og de nyeste målinger i hukommelsen (udenfor try, målingen er gemt)
+        update_after_insert([(row_id, ts_ms, data)])
+        return True
+
+
+def insert_batch_into_database(records):
+    """Indsætter en liste af (ts_ms, device, data) i én transaktion. Fejl bliver rejst videre."""
+    started = time.perf_counter()
+    try:
+        db = sqlite3.connect(get_active_partition(), timeout=DATABASE_WRITE_TIMEOUT)
+        cursor = db.cursor()
+
+        sql_insert_into_table: sourcetypes.sql = """
+            INSERT INTO SensorReadings (ts_ms, device, temperature, humidity, loudness, light_level)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """
+        inserted = []
+        with db:
+            for ts_ms, device, data in records:
+                cursor.execute(sql_insert_into_table, (ts_ms, device, *data))
+                inserted.append((cursor.lastrowid, ts_ms, data))
+        DB_INSERT_BATCH.observe(time.perf_counter() - started)
+
+    except Exception:
+        DATABASE_INSERT_ERRORS.inc()
+        raise
+
+    finally:
+        if "db" in locals():
+            db.close()
+
+    # Statistikken og hukommelsen opdateres først når transaktionen er gemt
+    update_after_insert(inserted)
+    return len(inserted)
+
+
+def update_after_insert(inserted):
+    """
+    Opdaterer statistikken og de nyeste målinger i hukommelsen med (row_id, ts_ms, data) der netop er gemt.
+    Rækkerne er allerede committed, så en fejl her logges kun: den må ikke få målingen til at gå i spool
+    og blive indsat igen. Fejl fanges pr. række, så én dårlig række ikke stopper resten af transaktionen.
+    """
+    try:
+        invalidate_nightly_reports(inserted)
+    except Exception as ex:
+        log_database.error("Kunne ikke slette gemte søvnrapporter efter indsættelse", extra={"error": ex})
+
+    for record in inserted:
+        row_id, ts_ms, data = record
+        try:
+            update_statistics(row_id, ts_ms / 1000, data)
+        except Exception as ex:
+            log_rate_limited(after_insert_error_limiter, log_database, logging.ERROR, "Kunne ikke opdatere statistik efter indsættelse", {"row_id": row_id, "error": ex})
+        try:
+            hot_tier.extend((record,))
+        except Exception as ex:
+            log_rate_limited(after_insert_error_limiter, log_database, logging.ERROR, "Kunne ikke lægge målingen i hukommelsen efter indsættelse", {"row_id": row_id, "error": ex})
+
 
 
 def generate_test_data():
@@ -200,41 +1289,41 @@ async def publish_testdata_loop(delay: int, client: MQTTClient):
         await asyncio.sleep(delay)
 
 
-def fetch_sensor_data():
-    """Hjælpefunktion til hentning af værdier fra sensordata databasen. Returnerer dem som lister."""
+def fetch_sensor_data(limit=DASHBOARD_READINGS):
+    """
+    Henter de `limit` nyeste målinger, nyeste først. Returnerer dem som lister.
+    Ligger de i hukommelsen (hot_tier), bliver databasen ikke brugt.
+    """
+    newest = hot_tier.newest(limit)
+    if newest is not None:
+        HOT_TIER_HITS.inc()
+        ts_ms, values = newest
+        return [format_timestamp_ms(ts) for ts in ts_ms], *values
+
+    HOT_TIER_MISSES.inc()
+    started = time.perf_counter()
     try:
-        # Forbind til databasen
-        db = sqlite3.connect(DATABASE_PATH)
-        cursor = db.cursor()
-
-        # Hent data fra SensorData tabellen
-        sql_get_sensordata_table: sourcetypes.sql = """
-            SELECT timestamp, temperature, humidity, loudness, light_level FROM SensorData ORDER BY timestamp DESC LIMIT 100
-            """
-        
-        cursor.execute(sql_get_sensordata_table)
-        rows = cursor.fetchall()
-
-        # Luk forbindelsen til databasen
-        db.close()
+        # Hent de nyeste rækker fra partitionerne (nyeste måned først)
+        rows = fetch_newest_readings(limit)
+        record_timing(DB_QUERY_LATEST_READINGS, "db", started)
 
         # Returner data (tidspunkter og sensorværdier)
-        timestamps = [row[0] for row in rows]
-        temperatures = [row[1] for row in rows]
-        humidities = [row[2] for row in rows]
-        loudness = [row[3] for row in rows]
-        light_levels = [row[4] for row in rows]
+        timestamps = [format_timestamp_ms(row[1]) for row in rows]
+        temperatures = [row[2] for row in rows]
+        humidities = [row[3] for row in rows]
+        loudness = [row[4] for row in rows]
+        light_levels = [row[5] for row in rows]
         
         return timestamps, temperatures, humidities, loudness, light_levels
 
     except Exception as ex:
-        print(f"[Database] Der opstår en fejl: {ex}")
+        log_database.error("Der opstod en fejl under læsning", extra={"error": ex})
         return [], [], [], [], []
 
 def get_latest_datapoint(data_type):
     """Finder den nyeste værdi for en valgt datatype fra sensordata."""
-    # Henter sensordata fra databasen
-    timestamps, temperatures, humidities, loudness, light_levels = fetch_sensor_data()
+    # Henter den nyeste måling (fra hukommelsen, eller databasen hvis den ikke er varmet op)
+    timestamps, temperatures, humidities, loudness, light_levels = fetch_sensor_data(1)
 
     # Hvis der ikke er nogen data, så returner bare None
     if not timestamps:
@@ -257,6 +1346,1029 @@ def get_latest_datapoint(data_type):
         raise ValueError(f"Ugyldig datatype: {data_type}. Vælg mellem 'timestamp', 'temperature', 'humidity', 'loudness', eller 'light_level'.")
 
 
+def get_latest_timestamp_ms():
+    """Returnerer tidspunktet for den nyeste måling i millisekunder siden epoch, eller None hvis der ikke er data."""
+    newest = hot_tier.newest(1)
+    if newest is not None:
+        HOT_TIER_HITS.inc()
+        ts_ms, values = newest
+        return ts_ms[0] if ts_ms else None
+
+    HOT_TIER_MISSES.inc()
+    started = time.perf_counter()
+    try:
+        db = sqlite3.connect(DATABASE_PATH)
+        latest_ts_ms = get_key_bounds(db, "ts_ms", DATABASE_PATH)[1]
+        record_timing(DB_QUERY_LATEST_TIMESTAMP, "db", started)
+        return latest_ts_ms
+
+    except Exception as ex:
+        log_database.error("Der opstod en fejl under læsning", extra={"error": ex})
+        return None
+
+    finally:
+        if "db" in locals():
+            db.close()
+
+
+
+####################################################################################################
+# Ingest spool
+
+# Kan en måling ikke indsættes med det samme (databasen er låst, fx under backup eller en lang læsning),
+# skrives den i en append-only spool-fil i stedet for at gå tabt. Så længe der ligger målinger i spool-filen,
+# går nye målinger også derhen, så rækkefølgen bevares. spool_replay_loop tømmer filen i rækkefølge når
+# databasen er tilgængelig igen. Hvor langt den er nået gemmes i en .offset fil ved siden af, lige efter
+# hver batch er gemt i databasen (går programmet ned præcis imellem de to, bliver den batch indsat igen).
+# Kun målinger der kan gemmes kommer i spool-filen (validate_reading). Fejler en batch af en anden grund end at
+# databasen er optaget (OperationalError), afspilles den én måling ad gangen, og dem der fejler flyttes til en
+# dead-letter fil (.dead) ved siden af. Ellers ville én dårlig måling stoppe alt indtag, da nye målinger går i
+# spool-filen så længe den ikke er tom.
+
+class IngestSpool:
+    """Append-only spool-fil med én JSON-linje pr. måling."""
+
+    def __init__(self, path, max_bytes=SPOOL_MAX_BYTES):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.dead_letter_path = path + ".dead"
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.file = None
+        self.size = 0                   # Bytes skrevet til filen
+        self.offset = 0                 # Bytes der er afspillet i databasen
+        self.depth = 0                  # Målinger der venter
+        self.oldest_ts_ms = None        # Tidspunkt for den ældste ventende måling
+        self.unsynced = 0
+        self.last_fsync = time.monotonic()
+        self.spooled_total = 0
+        self.replayed_total = 0
+        self.dropped_total = 0
+        self.dead_letter_total = 0
+
+        # Ligger der målinger fra sidst programmet kørte, fortsættes hvor afspilningen slap
+        if os.path.exists(self.path):
+            self.size = os.path.getsize(self.path)
+            if os.path.exists(self.offset_path):
+                with open(self.offset_path) as offset_file:
+                    self.offset = min(int(offset_file.read() or 0), self.size)
+            records = self._read_records(self.offset, None)
+            self.depth = len(records)
+            self.oldest_ts_ms = self._first_ts_ms(records)
+
+    def is_empty(self):
+        return self.depth == 0
+
+    def append(self, ts_ms, device, data):
+        """
+        Skriver en måling i spool-filen. Returnerer False hvis filen er fuld og målingen er smidt væk.
+        Rejser ValueError hvis målingen aldrig vil kunne indsættes.
+        """
+        data = validate_reading(data, ts_ms)
+        if ts_ms is None or not isinstance(device, str):
+            raise ValueError(f"Målingen mangler ts_ms eller device: {ts_ms!r}, {device!r}")
+        line = (json.dumps([ts_ms, device, data]) + "\n").encode("utf-8")
+        with self.lock:
+            if self.size + len(line) > self.max_bytes:
+                self.dropped_total += 1
+                return False
+
+            if self.file is None:
+                self.file = open(self.path, "ab")
+            self.file.write(line)
+            self.size += len(line)
+            self.depth += 1
+            self.spooled_total += 1
+            if self.oldest_ts_ms is None:
+                self.oldest_ts_ms = ts_ms
+
+            self.unsynced += 1
+            if self.unsynced >= SPOOL_FSYNC_BATCH or time.monotonic() - self.last_fsync >= SPOOL_FSYNC_INTERVAL:
+                self._sync()
+            return True
+
+    def _sync(self):
+        """Flush og fsync de skrivninger der er samlet op. Kaldes med self.lock."""
+        if self.file is not None and self.unsynced:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_fsync = time.monotonic()
+
+    def _read_records(self, offset, limit):
+        """
+        Læser op til `limit` hele linjer fra offset. Returnerer [(slut-offset, linje)], hvor linje er
+        [ts_ms, device, data], eller den rå tekst hvis linjen ikke kan læses som JSON.
+        """
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, "rb") as spool_file:
+            spool_file.seek(offset)
+            while limit is None or len(records) < limit:
+                line = spool_file.readline()
+                if not line.endswith(b"\n"):
+                    break # Slut på filen (eller en halv linje fra et nedbrud)
+                offset += len(line)
+                try:
+                    records.append((offset, json.loads(line)))
+                except ValueError:
+                    records.append((offset, line.decode("utf-8", "replace").rstrip("\n")))
+        return records
+
+    @staticmethod
+    def _first_ts_ms(records):
+        """Tidspunktet for den første måling i records (til replay_lag_seconds), eller None."""
+        if records and isinstance(records[0][1], list) and records[0][1]:
+            return records[0][1][0]
+        return None
+
+    @staticmethod
+    def _check_record(record):
+        """Returnerer (ts_ms, device, data) for en linje fra spool-filen. Rejser ValueError hvis den ikke kan gemmes."""
+        if not isinstance(record, list) or len(record) != 3:
+            raise ValueError(f"Ugyldig linje i spool-filen: {record!r}")
+        ts_ms, device, data = record
+        if ts_ms is None or not isinstance(device, str):
+            raise ValueError(f"Målingen mangler ts_ms eller device: {record!r}")
+        return ts_ms, device, validate_reading(data, ts_ms)
+
+    def _dead_letter(self, record, error):
+        """Flytter en måling der aldrig kan indsættes til dead-letter filen, så afspilningen kan komme videre."""
+        line = json.dumps({"record": record, "error": str(error), "time_ms": int(time.time() * 1000)}, default=str)
+        with open(self.dead_letter_path, "a", encoding="utf-8") as dead_letter_file:
+            dead_letter_file.write(line + "\n")
+        self.dead_letter_total += 1
+        log_spool.error("Måling kan ikke indsættes og er flyttet til dead-letter filen", extra={
+            "path": self.dead_letter_path, "error": error
+        })
+
+    def replay(self, batch_size=SPOOL_REPLAY_BATCH):
+        """
+        Indsætter næste batch i databasen. Returnerer antal behandlede målinger (indsat eller flyttet til
+        dead-letter filen). OperationalError (databasen er optaget) bliver rejst videre, og batchen prøves igen.
+        """
+        with self.lock:
+            self._sync()
+            records = self._read_records(self.offset, batch_size)
+
+        if not records:
+            return 0
+
+        rows = []
+        for _, record in records:
+            try:
+                rows.append(self._check_record(record))
+            except ValueError as ex:
+                rows.append(None)
+                self._dead_letter(record, ex)
+        valid_rows = [row for row in rows if row is not None]
+
+        try:
+            if valid_rows:
+                insert_batch_into_database(valid_rows)
+        except sqlite3.OperationalError:
+            raise
+        except Exception:
+            # Batchen kan aldrig indsættes samlet. Én ad gangen, så kun de målinger der fejler bliver flyttet
+            return self._replay_one_by_one(records, rows)
+
+        self._advance(records[-1][0], len(records), len(valid_rows))
+        return len(records)
+
+    def _replay_one_by_one(self, records, rows):
+        """Indsætter rækkerne enkeltvis og flytter dem der fejler til dead-letter filen. Returnerer antal behandlede."""
+        done = replayed = 0
+        try:
+            for (_, record), row in zip(records, rows):
+                if row is not None:
+                    try:
+                        insert_batch_into_database([row])
+                        replayed += 1
+                    except sqlite3.OperationalError:
+                        raise
+                    except Exception as ex:
+                        self._dead_letter(record, ex)
+                done += 1
+        finally:
+            # Også hvis databasen blev optaget undervejs, så de indsatte ikke bliver indsat igen
+            if done:
+                self._advance(records[done - 1][0], done, replayed)
+        return done
+
+    def _advance(self, offset, count, replayed):
+        """Flytter offset forbi `count` behandlede målinger, hvoraf `replayed` er indsat i databasen."""
+        with self.lock:
+            self.offset = offset
+            self.depth -= count
+            self.replayed_total += replayed
+
+            if self.depth == 0 and self.offset >= self.size:
+                # Alt er afspillet, start forfra med en tom fil
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                open(self.path, "wb").close()
+                self.size = self.offset = 0
+                self.oldest_ts_ms = None
+                if os.path.exists(self.offset_path):
+                    os.remove(self.offset_path)
+            else:
+                self.oldest_ts_ms = self._first_ts_ms(self._read_records(self.offset, 1))
+                with open(self.offset_path + ".tmp", "w") as offset_file:
+                    offset_file.write(str(self.offset))
+                os.replace(self.offset_path + ".tmp", self.offset_path)
+
+    def flush(self):
+        with self.lock:
+            self._sync()
+
+    def status(self):
+        """Målinger til overvågning: dybde, størrelse og hvor gammel den ældste ventende måling er."""
+        with self.lock:
+            lag_seconds = (time.time() * 1000 - self.oldest_ts_ms) / 1000 if self.oldest_ts_ms else 0.0
+            return {
+                "depth": self.depth,
+                "bytes": self.size - self.offset,
+                "max_bytes": self.max_bytes,
+                "replay_lag_seconds": round(lag_seconds, 3),
+                "spooled_total": self.spooled_total,
+                "replayed_total": self.replayed_total,
+                "dropped_total": self.dropped_total,
+                "dead_letter_total": self.dead_letter_total,
+            }
+
+
+ingest_spool = IngestSpool(SPOOL_PATH)
+
+
+def ingest_reading(data, device=DEFAULT_DEVICE, ts_ms=None):
+    """
+    Gemmer en modtaget måling. Den indsættes direkte i databasen, medmindre databasen er optaget
+    eller der allerede ligger målinger i spool-filen; så lægges den i spool-filen.
+    Returnerer "database", "spool" eller "dropped". Rejser ValueError hvis målingen aldrig kan gemmes.
+    """
+    if ts_ms is None:
+        ts_ms = int(time.time() * 1000) # Tidspunktet hvor målingen blev modtaget
+
+    if ingest_spool.is_empty() and insert_data_into_database(data, ts_ms, device):
+        return "database"
+
+    if ingest_spool.append(ts_ms, device, data):
+        return "spool"
+
+    log_rate_limited(ingest_warning_limiter, log_spool, logging.WARNING, "Spool-filen er fuld, målingen er smidt væk", {"max_bytes": SPOOL_MAX_BYTES})
+    return "dropped"
+
+
+async def spool_replay_loop(delay=SPOOL_REPLAY_DELAY):
+    """Tømmer spool-filen ned i databasen i rækkefølge, når databasen er tilgængelig."""
+    while True:
+        try:
+            # Tøm så meget som muligt, men giv event loopet en chance mellem hver batch
+            while ingest_spool.replay():
+                await asyncio.sleep(0)
+        except Exception as ex:
+            log_spool.warning("Kunne ikke afspille spool-filen", extra={"retry_seconds": delay, "error": ex})
+
+        ingest_spool.flush() # Sørger for at skrivninger bliver fsync'et selvom der ikke kommer flere målinger
+        await asyncio.sleep(delay)
+
+
+
+####################################################################################################
+# Statistik
+
+# Statistikken opdateres løbende når data indsættes, så /api/stats kan svare uden at scanne hele historikken.
+# Tilstanden gemmes i SensorStats sammen med id'et på den sidst behandlede række. Ved opstart indlæses den
+# gemte tilstand, og kun rækker nyere end checkpointet bliver kørt igennem igen.
+
+# Metrics i samme rækkefølge som sensordata listen, med deres ideelle interval
+STATS_METRICS = {
+    "temperature": (MIN_TEMPERATURE, MAX_TEMPERATURE),
+    "humidity": (MIN_HUMIDITY, MAX_HUMIDITY),
+    "loudness": (MIN_LOUDNESS, MAX_LOUDNESS),
+    "light_level": (MIN_LIGHT_LEVEL, MAX_LIGHT_LEVEL),
+}
+
+
+class QuantileSketch:
+    """
+    Flettelig kvantil-sketch (DDSketch). Værdier lægges i logaritmiske spande,
+    så percentiler har en relativ fejl på højst `accuracy`, og to sketches kan lægges sammen.
+    """
+
+    MIN_VALUE = 1e-9 # Værdier tættere på 0 end dette tælles som 0
+
+    def __init__(self, accuracy=STATS_SKETCH_ACCURACY):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {} # spand-index -> antal
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _index(self, value):
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def _bucket_value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value):
+        if value > self.MIN_VALUE:
+            index = self._index(value)
+            self.positive[index] = self.positive.get(index, 0) + 1
+        elif value < -self.MIN_VALUE:
+            index = self._index(-value)
+            self.negative[index] = self.negative.get(index, 0) + 1
+        else:
+            self.zero_count += 1
+        self.count += 1
+
+    def merge(self, other):
+        """Lægger en anden sketch med samme `accuracy` til denne. Resultatet er det samme som at have tilføjet begges værdier."""
+        if other.accuracy != self.accuracy:
+            raise ValueError(f"Kan ikke flette sketches med forskellig accuracy: {self.accuracy} og {other.accuracy}")
+        for index, count in other.positive.items():
+            self.positive[index] = self.positive.get(index, 0) + count
+        for index, count in other.negative.items():
+            self.negative[index] = self.negative.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q):
+        """Returnerer den estimerede q-kvantil (0 <= q <= 1), eller None hvis sketchen er tom."""
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = 0
+
+        # Negative værdier først (største index er den mest negative værdi)
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._bucket_value(index)
+
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._bucket_value(index)
+
+        return self._bucket_value(max(self.positive))
+
+    def to_dict(self):
+        return {
+            "accuracy": self.accuracy,
+            "positive": self.positive,
+            "negative": self.negative,
+            "zero_count": self.zero_count,
+            "count": self.count,
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state["accuracy"])
+        # JSON gemmer dictionary-nøgler som strenge
+        sketch.positive = {int(k): v for k, v in state["positive"].items()}
+        sketch.negative = {int(k): v for k, v in state["negative"].items()}
+        sketch.zero_count = state["zero_count"]
+        sketch.count = state["count"]
+        return sketch
+
+
+class RunningStats:
+    """
+    Løbende aggregater for én metric i ét vindue: middelværdi og varians (Welford),
+    min/max, tid inden for det ideelle interval og en kvantil-sketch.
+    """
+
+    def __init__(self, lower, upper):
+        self.lower = lower
+        self.upper = upper
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.in_range_count = 0
+        self.in_range_seconds = 0.0
+        self.total_seconds = 0.0
+        self.last_timestamp = None
+        self.last_in_range = False
+        self.sketch = QuantileSketch()
+
+    def add(self, timestamp, value):
+        """Tilføj en måling. timestamp er i sekunder siden epoch."""
+        in_range = self.lower <= value <= self.upper
+
+        # Tiden siden forrige måling tilskrives den forrige målings tilstand
+        if self.last_timestamp is not None:
+            elapsed = min(max(timestamp - self.last_timestamp, 0.0), STATS_MAX_GAP)
+            self.total_seconds += elapsed
+            if self.last_in_range:
+                self.in_range_seconds += elapsed
+        self.last_timestamp = timestamp
+        self.last_in_range = in_range
+
+        # Welford
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if in_range:
+            self.in_range_count += 1
+        self.sketch.add(value)
+
+    def merge(self, other):
+        """Læg et andet (tidsmæssigt senere) vindue sammen med dette (Chan et al.)."""
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.mean, self.m2 = other.mean, other.m2
+        else:
+            count = self.count + other.count
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / count
+            self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count += other.count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.in_range_count += other.in_range_count
+        self.in_range_seconds += other.in_range_seconds
+        self.total_seconds += other.total_seconds
+        self.last_timestamp = other.last_timestamp
+        self.last_in_range = other.last_in_range
+        self.sketch.merge(other.sketch)
+
+    def summary(self):
+        variance = self.m2 / (self.count - 1) if self.count > 1 else 0.0
+        return {
+            "count": self.count,
+            "mean": self.mean if self.count else None,
+            "variance": variance,
+            "stddev": math.sqrt(variance),
+            "min": self.min,
+            "max": self.max,
+            "in_range_count": self.in_range_count,
+            "in_range_seconds": self.in_range_seconds,
+            "in_range_ratio": self.in_range_seconds / self.total_seconds if self.total_seconds else None,
+            "p05": self.sketch.quantile(0.05),
+            "p50": self.sketch.quantile(0.50),
+            "p95": self.sketch.quantile(0.95),
+        }
+
+    def to_dict(self):
+        return {
+            "lower": self.lower,
+            "upper": self.upper,
+            "count": self.count,
+            "mean": self.mean,
+            "m2": self.m2,
+            "min": self.min,
+            "max": self.max,
+            "in_range_count": self.in_range_count,
+            "in_range_seconds": self.in_range_seconds,
+            "total_seconds": self.total_seconds,
+            "last_timestamp": self.last_timestamp,
+            "last_in_range": self.last_in_range,
+            "sketch": self.sketch.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        stats = cls(state["lower"], state["upper"])
+        for key in ("count", "mean", "m2", "min", "max", "in_range_count", "in_range_seconds",
+                    "total_seconds", "last_timestamp", "last_in_range"):
+            setattr(stats, key, state[key])
+        stats.sketch = QuantileSketch.from_dict(state["sketch"])
+        return stats
+
+
+# Løbende statistik: {vindue: {metric: RunningStats}}. Vinduer er "total" og "night:<dato>".
+statistics = {}
+statistics_lock = Lock() # Bottle-tråden læser mens asyncio-tråden skriver
+statistics_state = {
+    "loaded": False,        # Opdateringer ignoreres indtil den gemte tilstand er indlæst
+    "last_id": 0,           # Id på den sidste række der er talt med
+    "dirty": set(),         # Vinduer der er ændret siden sidste gem
+    "last_persist": 0.0,    # time.monotonic() ved sidste gem (ikke målingens tid, som kommer fra sensorens ur)
+}
+
+
+def get_night_key(timestamp):
+    """Returnerer datoen for den nat et timestamp (sekunder siden epoch) hører til."""
+    moment = datetime.datetime.fromtimestamp(timestamp) - datetime.timedelta(hours=NIGHT_SPLIT_HOUR)
+    return moment.strftime('%Y-%m-%d')
+
+
+def _add_to_statistics(row_id, timestamp, data):
+    """Tilføjer en måling til alle vinduer den hører til. Kaldes med statistics_lock."""
+    for window in ("total", f"night:{get_night_key(timestamp)}"):
+        if window not in statistics:
+            statistics[window] = {metric: RunningStats(*limits) for metric, limits in STATS_METRICS.items()}
+        for metric, value in zip(STATS_METRICS, data):
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                continue # None (manglende måling) eller tekst fra en import tælles ikke med
+            if math.isfinite(value):
+                statistics[window][metric].add(timestamp, value)
+        statistics_state["dirty"].add(window)
+    statistics_state["last_id"] = max(statistics_state["last_id"], row_id)
+
+
+def save_statistics():
+    """Gemmer de ændrede vinduer og checkpointet i én transaktion."""
+    with statistics_lock:
+        rows = [
+            (window, metric, json.dumps(stats.to_dict()))
+            for window in statistics_state["dirty"]
+            for metric, stats in statistics[window].items()
+        ]
+        last_id = statistics_state["last_id"]
+        statistics_state["dirty"] = set()
+        statistics_state["last_persist"] = time.monotonic()
+
+    try:
+        db = sqlite3.connect(DATABASE_PATH)
+        with db:
+            db.executemany("INSERT OR REPLACE INTO SensorStats (window, metric, state) VALUES (?, ?, ?)", rows)
+            db.execute("INSERT OR REPLACE INTO SensorStatsCheckpoint (id, last_id) VALUES (1, ?)", (last_id,))
+    except Exception as ex:
+        log_statistics.error("Kunne ikke gemme statistik", extra={"error": ex})
+    finally:
+        if "db" in locals():
+            db.close()
+
+
+def load_statistics():
+    """
+    Indlæser den gemte statistik og indhenter de rækker der er kommet til siden sidste checkpoint.
+    Første gang (tomt checkpoint) gennemløbes alle målinger én gang.
+    """
+    try:
+        db = sqlite3.connect(DATABASE_PATH)
+        cursor = db.cursor()
+
+        with statistics_lock:
+            statistics.clear()
+            for window, metric, state in cursor.execute("SELECT window, metric, state FROM SensorStats"):
+                statistics.setdefault(window, {})[metric] = RunningStats.from_dict(json.loads(state))
+
+            row = cursor.execute("SELECT last_id FROM SensorStatsCheckpoint WHERE id = 1").fetchone()
+            statistics_state["last_id"] = row[0] if row else 0
+
+            # Indhent rækker nyere end checkpointet (fra de partitioner der har id'er efter det)
+            sql_get_new_rows: sourcetypes.sql = "SELECT id, ts_ms, temperature, humidity, loudness, light_level FROM {table}"
+            caught_up = 0
+            for rows in iter_reading_chunks(sql_get_new_rows, key="id", start=statistics_state["last_id"] + 1):
+                for row_id, ts_ms, *data in rows:
+                    _add_to_statistics(row_id, ts_ms / 1000, data)
+                caught_up += len(rows)
+
+            statistics_state["loaded"] = True
+
+        log_statistics.info("Statistik indlæst", extra={"caught_up_rows": caught_up})
+
+    except Exception as ex:
+        log_statistics.error("Der opstod en fejl under indlæsning", extra={"error": ex})
+        return
+
+    finally:
+        if "db" in locals():
+            db.close()
+
+    if caught_up:
+        save_statistics()
+
+
+def update_statistics(row_id, timestamp, data):
+    """Opdaterer statistikken med en netop indsat måling og gemmer den med jævne mellemrum."""
+    with statistics_lock:
+        if not statistics_state["loaded"]:
+            return
+        _add_to_statistics(row_id, timestamp, data)
+        persist_due = time.monotonic() - statistics_state["last_persist"] >= STATS_PERSIST_DELAY
+
+    if persist_due:
+        save_statistics()
+
+
+def get_statistics(window):
+    """Returnerer et resumé af statistikken for et vindue, eller None hvis vinduet ikke findes."""
+    with statistics_lock:
+        if window not in statistics:
+            return None
+        return {metric: stats.summary() for metric, stats in statistics[window].items()}
+
+
+####################################################################################################
+# Hot tier
+
+# Næsten alle sider viser kun de nyeste målinger, så de HOT_TIER_SIZE nyeste holdes i hukommelsen i en ringbuffer:
+# ét NumPy-array til tidspunkter, ét til række-id'er og ét pr. metric, med en fælles skriveposition.
+# Bufferen varmes op fra databasen ved opstart og udfyldes derefter af indsættelserne, efter de er gemt.
+# Målinger kan komme i forkert rækkefølge (fx fra spool-filen eller sensorer med eget ts_ms), så bufferen husker
+# det nyeste tidspunkt der findes i databasen uden at ligge i bufferen (`floor_ms`). Alle rækker med et nyere
+# tidspunkt ligger i bufferen, så en forespørgsel kan besvares fra hukommelsen hvis alle de rækker den skal bruge
+# er nyere end det. Ellers (og før opvarmningen) går den videre til SQLite.
+# Rækker der skrives af andre processer (fx import_data.py) kommer først med ved næste opstart.
+
+class HotTier:
+    """Ringbuffer med de nyeste målinger. Bottle-tråden læser mens asyncio-tråden skriver, så alt sker under `lock`."""
+
+    def __init__(self, size=HOT_TIER_SIZE):
+        self.size = size
+        self.lock = Lock()
+        self.ts_ms = np.zeros(size, dtype=np.int64)
+        self.row_ids = np.zeros(size, dtype=np.int64)
+        self.values = {metric: np.zeros(size) for metric in STATS_METRICS}
+        self.warmed = False # Indtil bufferen er varmet op, går alle forespørgsler til databasen
+        self.position = 0   # Næste plads der skrives i
+        self.count = 0
+        self.warmed_ids = set() # Id'er hentet ved opvarmningen; indsættelser der blev gemt imens springes over
+        self.floor_ms = -math.inf
+
+    def warm(self, db_path=None):
+        """Fylder bufferen med de nyeste målinger fra databasen. Kan kaldes igen for at starte forfra."""
+        try:
+            # Låsen holdes mens der hentes, så indsættelser der bliver gemt imens venter og kan sorteres fra bagefter
+            with self.lock:
+                rows = fetch_newest_readings(self.size, db_path)
+
+                self.position = self.count = 0
+                self.floor_ms = -math.inf
+                for row_id, ts_ms, *data in reversed(rows):
+                    self._append(row_id, ts_ms, data)
+                # Er der flere rækker end bufferen kan rumme, kan der ligge flere med det ældste tidspunkt udenfor
+                if len(rows) == self.size:
+                    self.floor_ms = rows[-1][1]
+                self.warmed_ids = {row[0] for row in rows}
+                self.warmed = True
+        except Exception as ex:
+            log_database.error("Kunne ikke hente de nyeste målinger ind i hukommelsen", extra={"error": ex})
+
+    def _append(self, row_id, ts_ms, data):
+        """Skriver en måling på næste plads. Kaldes med `lock`."""
+        index = self.position
+        if self.count == self.size:
+            self.floor_ms = max(self.floor_ms, int(self.ts_ms[index])) # Den ældste måling forsvinder ud af bufferen
+        else:
+            self.count += 1
+        self.ts_ms[index] = ts_ms
+        self.row_ids[index] = row_id
+        for column, value in zip(self.values.values(), data):
+            try:
+                column[index] = value # None bliver til NaN
+            except (TypeError, ValueError):
+                column[index] = math.nan # Tekst der ikke er et tal; SQLite gemmer den som den er
+        self.position = (index + 1) % self.size
+
+    def extend(self, records):
+        """Tilføjer en liste af (row_id, ts_ms, data) der netop er gemt i samme transaktion."""
+        with self.lock:
+            if self.warmed:
+                for row_id, ts_ms, data in records:
+                    if row_id not in self.warmed_ids:
+                        self._append(row_id, ts_ms, data)
+
+    def newest(self, limit):
+        """
+        Returnerer (tidspunkter, [værdier pr. metric]) for de `limit` nyeste målinger, nyeste først, som lister.
+        Returnerer None hvis svaret ikke kan gives fra hukommelsen.
+        """
+        with self.lock:
+            if not self.warmed:
+                return None
+            count, floor_ms = self.count, self.floor_ms
+            ts_ms = self.ts_ms[:count].copy()
+            row_ids = self.row_ids[:count].copy()
+            values = [column[:count].copy() for column in self.values.values()]
+
+        # Sorteres uden for låsen: nyeste tidspunkt først, og ved samme tidspunkt den sidst gemte først
+        order = np.lexsort((row_ids, ts_ms))[::-1][:limit]
+        if len(order) < limit and floor_ms != -math.inf:
+            return None # Der findes ældre rækker i databasen end dem i bufferen
+        if len(order) and ts_ms[order[-1]] <= floor_ms:
+            return None
+
+        columns = []
+        for column in values:
+            selected = column[order]
+            if np.isnan(selected).any(): # NULL i databasen
+                columns.append([None if math.isnan(value) else value for value in selected.tolist()])
+            else:
+                columns.append(selected.tolist())
+        return ts_ms[order].tolist(), columns
+
+
+hot_tier = HotTier()
+
+
+####################################################################################################
+# Søvnrapport
+
+# Rapporten for en nat beregnes med NumPy over nattens målinger. Færdige nætter ændrer sig ikke,
+# så deres rapport gemmes i NightlyReport, og kun den igangværende nat bliver beregnet igen.
+
+REPORT_DTYPE = np.dtype([
+    ("ts_ms", "i8"),
+    ("temperature", "f8"),
+    ("humidity", "f8"),
+    ("loudness", "f8"),
+    ("light_level", "f8"),
+])
+
+
+def get_night_bounds(night):
+    """Returnerer (start, slut) som datetime for en nat angivet som 'YYYY-MM-DD'."""
+    start = datetime.datetime.strptime(night, '%Y-%m-%d') + datetime.timedelta(hours=NIGHT_SPLIT_HOUR)
+    return start, start + datetime.timedelta(days=1)
+
+
+def fetch_night_readings(start, end):
+    """Henter målingerne i intervallet [start, end) som et NumPy struktureret array sorteret efter tid."""
+    started = time.perf_counter()
+    try:
+        sql_get_night: sourcetypes.sql = "SELECT ts_ms, temperature, humidity, loudness, light_level FROM {table}"
+        chunks = iter_reading_chunks(sql_get_night, start=int(start.timestamp() * 1000), end=int(end.timestamp() * 1000))
+
+        # Rækkerne læses direkte ind i arrayet uden at gå via en samlet Python liste
+        readings = np.fromiter(itertools.chain.from_iterable(chunks), dtype=REPORT_DTYPE)
+        record_timing(DB_QUERY_NIGHT_READINGS, "db", started)
+        return readings
+
+    except Exception as ex:
+        log_report.error("Kunne ikke hente målinger", extra={"error": ex})
+        raise
+
+
+def _format_seconds(seconds):
+    """Formaterer sekunder siden epoch som timestamp streng i lokal tid."""
+    return datetime.datetime.fromtimestamp(seconds).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _count_events(condition):
+    """Tæller hvor mange gange en betingelse bliver sand. En sammenhængende periode tæller som én hændelse."""
+    if len(condition) == 0:
+        return 0
+    return int(np.count_nonzero(condition[1:] & ~condition[:-1]) + condition[0])
+
+
+def _worst_intervals(seconds, durations, values, lower, upper):
+    """Finder de længste sammenhængende perioder uden for [lower, upper]."""
+    deviation = np.maximum(lower - values, values - upper) # Positiv uden for interval
+    outside = (deviation > 0).astype(np.int8)
+
+    # Start (inklusiv) og slut (eksklusiv) index for hver periode uden for interval
+    edges = np.diff(np.concatenate(([0], outside, [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if len(starts) == 0:
+        return []
+
+    elapsed = np.concatenate(([0], np.cumsum(durations)))
+    run_seconds = elapsed[ends] - elapsed[starts]
+    # reduceat går fra en start til den næste, men værdierne inden for interval har negativ afvigelse
+    run_deviation = np.maximum.reduceat(deviation, starts)
+
+    # Længste først, ved lighed den største afvigelse
+    worst = np.lexsort((-run_deviation, -run_seconds))[:REPORT_WORST_INTERVALS]
+
+    return [
+        {
+            "start": _format_seconds(seconds[starts[i]]),
+            "end": _format_seconds(seconds[ends[i] - 1] + durations[ends[i] - 1]),
+            "seconds": round(float(run_seconds[i])),
+            "max_deviation": round(float(run_deviation[i]), 2),
+        }
+        for i in worst
+    ]
+
+
+def compute_nightly_report(readings):
+    """Beregner søvnrapporten for et array af målinger (se REPORT_DTYPE)."""
+    report = {"readings": len(readings), "noise_events": 0, "light_events": 0, "metrics": {}}
+    if len(readings) == 0:
+        return report
+
+    seconds = readings["ts_ms"] / 1000
+
+    # Hver måling gælder indtil den næste, dog højst STATS_MAX_GAP sekunder
+    durations = np.clip(np.diff(seconds, append=seconds[-1]), 0, STATS_MAX_GAP)
+    total_seconds = round(float(durations.sum()))
+
+    for metric, (lower, upper) in STATS_METRICS.items():
+        values = readings[metric]
+        in_range_seconds = round(float(durations[(values >= lower) & (values <= upper)].sum()))
+
+        report["metrics"][metric] = {
+            "mean": round(float(values.mean()), 2),
+            "min": float(values.min()),
+            "max": float(values.max()),
+            "in_range_seconds": in_range_seconds,
+            "in_range_ratio": in_range_seconds / total_seconds if total_seconds else None,
+            "worst_intervals": _worst_intervals(seconds, durations, values, lower, upper),
+        }
+
+    report["noise_events"] = _count_events(readings["loudness"] > MAX_LOUDNESS)
+    report["light_events"] = _count_events(readings["light_level"] > MAX_LIGHT_LEVEL)
+
+    return report
+
+
+report_state = {
+    "night_start_ms": 0,    # Den igangværende nat, så hver indsættelse ikke skal regne den ud
+    "night_end_ms": 0,
+    "versions": {},         # nat -> tæller der går op hver gang nattens gemte rapport bliver slettet
+    "current": {},          # nat -> (udløber, rapport) for nætter der ikke er færdige (REPORT_CURRENT_NIGHT_TTL)
+}
+report_lock = Lock() # En rapport gemmes kun hvis nattens version ikke er ændret mens den blev beregnet
+
+
+def get_current_night_start_ms():
+    """Returnerer starten af den igangværende nat i millisekunder."""
+    now_ms = time.time() * 1000
+    if not report_state["night_start_ms"] <= now_ms < report_state["night_end_ms"]:
+        start, end = get_night_bounds(get_night_key(now_ms / 1000))
+        report_state.update(night_start_ms=int(start.timestamp() * 1000), night_end_ms=int(end.timestamp() * 1000))
+    return report_state["night_start_ms"]
+
+
+def invalidate_nightly_reports(inserted):
+    """
+    Sletter den gemte rapport for færdige nætter der har fået nye målinger (fx fra spool-filen eller en sensor
+    der sender sent), så den bliver beregnet igen næste gang den hentes.
+    """
+    night_start_ms = get_current_night_start_ms()
+    nights = set()
+    for _, ts_ms, _ in inserted:
+        if ts_ms < night_start_ms:
+            try:
+                nights.add(get_night_key(ts_ms / 1000))
+            except (OverflowError, OSError, ValueError):
+                continue # Et tidspunkt der ikke kan være en dato har ingen rapport
+    if not nights:
+        return
+
+    # Versionen tælles op før rækken slettes, så en rapport der er ved at blive beregnet ikke bliver gemt bagefter
+    with report_lock:
+        for night in nights:
+            report_state["versions"][night] = report_state["versions"].get(night, 0) + 1
+    try:
+        db = sqlite3.connect(DATABASE_PATH)
+        with db:
+            db.executemany("DELETE FROM NightlyReport WHERE night = ?", [(night,) for night in nights])
+    finally:
+        if "db" in locals():
+            db.close()
+
+
+def get_nightly_report(night):
+    """
+    Returnerer søvnrapporten for en nat ('YYYY-MM-DD').
+    Færdige nætter hentes fra NightlyReport hvis de er beregnet før, ellers beregnes og gemmes de. Den igangværende
+    nat genbruges i hukommelsen i REPORT_CURRENT_NIGHT_TTL sekunder, da den tager et par hundrede ms at beregne.
+    """
+    start, end = get_night_bounds(night)
+    # Under en migrering er nattens data måske ikke flyttet endnu, så rapporten gemmes ikke
+    finished = end <= datetime.datetime.now() and not schema_state["migrating"]
+
+    if not finished:
+        with report_lock:
+            expires, report = report_state["current"].get(night, (0.0, None))
+        if time.monotonic() < expires:
+            return report
+
+    try:
+        db = sqlite3.connect(DATABASE_PATH)
+
+        if finished:
+            row = db.execute("SELECT report FROM NightlyReport WHERE night = ?", (night,)).fetchone()
+            if row:
+                return json.loads(row[0])
+
+        with report_lock:
+            version = report_state["versions"].get(night, 0)
+        report = compute_nightly_report(fetch_night_readings(start, end))
+        report["night"] = night
+        report["start"] = start.strftime('%Y-%m-%d %H:%M:%S')
+        report["end"] = end.strftime('%Y-%m-%d %H:%M:%S')
+        report["finished"] = finished
+
+        if finished:
+            # Er der kommet målinger til natten mens rapporten blev beregnet, er den forældet og gemmes ikke
+            with report_lock:
+                if report_state["versions"].get(night, 0) == version:
+                    with db:
+                        db.execute("INSERT OR REPLACE INTO NightlyReport (night, report) VALUES (?, ?)", (night, json.dumps(report)))
+        else:
+            now = time.monotonic()
+            with report_lock:
+                # Udløbne rapporter ryger ud her, så der ikke samler sig nætter i hukommelsen
+                report_state["current"] = {cached: entry for cached, entry in report_state["current"].items() if entry[0] > now}
+                report_state["current"][night] = (now + REPORT_CURRENT_NIGHT_TTL, report)
+
+        return report
+
+    finally:
+        if "db" in locals():
+            db.close()
+
+
+
+####################################################################################################
+# Eksport
+
+# Data eksporteres som en strøm: rækkerne hentes EXPORT_CHUNK_SIZE ad gangen fra en åben cursor og sendes
+# videre med det samme, så hukommelsesforbruget er det samme uanset hvor stort et interval der eksporteres.
+# Forespørgslerne køres af iter_reading_chunks mod hver partition intervallet rører ({table}), så de har ingen WHERE.
+
+# Hver række formateres direkte i SQLite, så Python kun skal sætte linjerne sammen.
+# Tidspunktet eksporteres både som ISO 8601 i UTC og som millisekunder siden epoch.
+EXPORT_HEADERS = {
+    "csv": "timestamp,ts_ms,temperature,humidity,loudness,light_level\n",
+    "ndjson": "",
+}
+EXPORT_QUERIES: dict[str, sourcetypes.sql] = {
+    "csv": """
+        SELECT strftime('%Y-%m-%dT%H:%M:%SZ', ts_ms / 1000, 'unixepoch') || ',' || ts_ms || ','
+            || COALESCE(temperature, '') || ',' || COALESCE(humidity, '') || ','
+            || COALESCE(loudness, '') || ',' || COALESCE(light_level, '') AS line, ts_ms
+        FROM {table}
+    """,
+    "ndjson": """
+        SELECT json_object(
+            'timestamp', strftime('%Y-%m-%dT%H:%M:%SZ', ts_ms / 1000, 'unixepoch'), 'ts_ms', ts_ms,
+            'temperature', temperature, 'humidity', humidity, 'loudness', loudness, 'light_level', light_level
+        ) AS line, ts_ms
+        FROM {table}
+    """,
+}
+
+
+def parse_export_time(value, default):
+    """
+    Fortolker et tidspunkt fra en URL-parameter og returnerer det i millisekunder siden epoch.
+    Accepterer millisekunder, 'YYYY-MM-DD' eller 'YYYY-MM-DD HH:MM:SS' (lokal tid).
+    """
+    if not value:
+        return default
+    if value.isdigit():
+        return int(value)
+    for time_format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return int(datetime.datetime.strptime(value, time_format).timestamp() * 1000)
+        except ValueError:
+            pass
+    raise ValueError(f"Ugyldigt tidspunkt: {value}. Brug millisekunder, YYYY-MM-DD eller YYYY-MM-DD HH:MM:SS.")
+
+
+def export_rows(start_ms, end_ms, export_format="csv", compress=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Generator der returnerer målingerne i [start_ms, end_ms) som bytes, formateret som CSV eller NDJSON.
+    Med compress=True er strømmen gzip-komprimeret.
+    """
+    if export_format not in EXPORT_QUERIES:
+        raise ValueError(f"Ugyldigt format: {export_format}. Vælg mellem 'csv' og 'ndjson'.")
+
+    # wbits=31 giver gzip-format (header og checksum) i stedet for rå zlib. Laveste niveau, så komprimeringen kan følge med
+    compressor = zlib.compressobj(level=1, wbits=31) if compress else None
+
+    try:
+        # Lukkes også hvis klienten afbryder downloaden, så forbindelsen til partitionerne ikke bliver hængende
+        with contextlib.closing(iter_reading_chunks(EXPORT_QUERIES[export_format], start=start_ms, end=end_ms, chunk_size=chunk_size)) as chunks:
+            header = EXPORT_HEADERS[export_format]
+            # Den tomme liste til sidst sender headeren, hvis der ikke var nogen rækker
+            for rows in itertools.chain(chunks, [[]]):
+                if not rows:
+                    chunk = header.encode("utf-8")
+                else:
+                    chunk = (header + "\n".join([row[0] for row in rows]) + "\n").encode("utf-8")
+                header = ""
+
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+
+        if compressor:
+            yield compressor.flush()
+
+    except Exception as ex:
+        log_export.error("Der opstod en fejl under eksport", extra={"error": ex})
+        raise
+
+
 
 ####################################################################################################
 # Database Backup and FTP sending
@@ -276,7 +2388,8 @@ def create_database_backup(db_path, backup_dir):
     try:
         # Få dato og tidspunkt til backup-filnavnet
         current_date = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-        backup_filename = f"sensordata_backup_{current_date}.db"
+        base = os.path.splitext(os.path.basename(db_path))[0]
+        backup_filename = f"{base}_backup_{current_date}.db"
         backup_path = os.path.join(backup_dir, backup_filename)
 
         # Sørg for at backup-biblioteket eksisterer, ellers lav det
@@ -284,12 +2397,16 @@ def create_database_backup(db_path, backup_dir):
             os.makedirs(backup_dir)
 
         # Kopier databasen til backup-stien
+        started = time.perf_counter()
         shutil.copy(db_path, backup_path)
-        print(f"[Backup] Backup lavet: '{backup_path}'")
+        BACKUP_DURATION.observe(time.perf_counter() - started)
+        BACKUP_BYTES.set(os.path.getsize(backup_path))
+        log_backup.info("Backup lavet", extra={"path": backup_path})
 
         return backup_path
     except Exception as e:
-        print(f"[Backup] Der skete en fejl under backup: {e}")
+        BACKUP_FAILURES.inc()
+        log_backup.error("Der skete en fejl under backup", extra={"error": e})
         raise
 
 
@@ -304,11 +2421,12 @@ def upload_to_ftp(ftp_host, ftp_user, ftp_password, file_path, remote_dir):
         file_path (str): Stien til filen der skal uploades.
         remote_dir (str): Mappen på FTP-serveren hvor filen uploades.
     """
+    started = time.perf_counter()
     try:
         # Forbind til FTP-serveren
         ftp = FTP(ftp_host)
         ftp.login(user=ftp_user, passwd=ftp_password)
-        print(f"[FTP] Tilsluttet FTP-serveren: {ftp_host}")
+        log_ftp.debug("Tilsluttet FTP-serveren", extra={"host": ftp_host})
 
         # Skift til den fjernmappe, hvis den er angivet
         if remote_dir:
@@ -317,13 +2435,16 @@ def upload_to_ftp(ftp_host, ftp_user, ftp_password, file_path, remote_dir):
         # Åbn filen og upload den
         with open(file_path, 'rb') as file:
             ftp.storbinary(f'STOR {os.path.basename(file_path)}', file)
-            print(f"[FTP] Fil uploadet til '{remote_dir}/{os.path.basename(file_path)}'.")
+            log_ftp.info("Fil uploadet", extra={"remote_path": f"{remote_dir}/{os.path.basename(file_path)}"})
 
         # Luk forbindelsen
         ftp.quit()
-        print("[FTP] FTP-forbindelsen er lukket.")
+        log_ftp.debug("FTP-forbindelsen er lukket.")
+        FTP_UPLOAD_DURATION.observe(time.perf_counter() - started)
+        FTP_UPLOAD_BYTES.inc(os.path.getsize(file_path))
     except Exception as e:
-        print(f"[FTP] Der skete en fejl under upload: {e}")
+        FTP_UPLOAD_FAILURES.inc()
+        log_ftp.error("Der skete en fejl under upload", extra={"error": e})
         raise
 
 
@@ -346,6 +2467,7 @@ def plot(selected_metrics=None, title=None, lower_threshold=None, upper_threshol
 
     # Hent data fra databasen
     timestamps, temperatures, humidities, loudness, light_levels = fetch_sensor_data()
+    started = time.perf_counter()
 
     # Hvis der ikke er valgt nogle datapunkter, så vælges alle som standard
     if selected_metrics is None:
@@ -398,6 +2520,7 @@ def plot(selected_metrics=None, title=None, lower_threshold=None, upper_threshol
     # Konverter PNG-billedet til base64, så det kan bruges i HTML
     img_base64 = base64.b64encode(img_buf.getvalue()).decode('utf-8')
     img_buf.close()
+    record_timing(PLOT_RENDER_DURATION, "plot", started)
 
     # Returner billedet som en base64-streng
     return img_base64
@@ -442,7 +2565,8 @@ def encrypt_message(byte_string_message):
             label=None
             )
         )
-    print(f"[Crypto] Encrypted Message: {encrypted_message}")
+    if log_crypto.isEnabledFor(logging.DEBUG):
+        log_rate_limited(publish_log_limiter, log_crypto, logging.DEBUG, "Besked krypteret", {"bytes": len(encrypted_message)})
     return encrypted_message
     
     
@@ -483,19 +2607,103 @@ async def mqtt_publish_data(data: list, client: MQTTClient):
     if USE_CRYPTOGRAPHY:
         byte_string = encrypt_message(byte_string)
     
-    message = await client.publish(MQTT_TOPIC_SENSORDATA, byte_string)
+    await client.publish(MQTT_TOPIC_SENSORDATA, byte_string, qos=MQTT_QOS)
+
+    if log_mqtt_client.isEnabledFor(logging.DEBUG):
+        log_rate_limited(publish_log_limiter, log_mqtt_client, logging.DEBUG, "Besked sendt", {"topic": MQTT_TOPIC_SENSORDATA, "bytes": len(byte_string)})
+
 
-    print(message)
-    print("[MQTT Client] Message published")
+def parse_sensordata(message):
+    """
+    Læser en afkodet sensordata-besked og returnerer (data, device, ts_ms). Tre formater understøttes:
+      [temperature, humidity, loudness, light_level]                  (oprindeligt format, ingen enhed eller tid)
+      [temperature, humidity, loudness, light_level, ts_ms, device]   (ts_ms og device kan udelades bagfra)
+      {"device": ..., "ts_ms": ..., "temperature": ..., ...}          (device og ts_ms kan udelades)
+    ts_ms er tidspunktet sensoren sendte målingen (millisekunder siden epoch). Mangler den, bruges modtagetidspunktet.
+    Rejser ValueError hvis beskeden ikke har præcis fire endelige tal, ts_ms/device har forkert type,
+    eller ts_ms ligger uden for det gyldige interval (se validate_reading).
+    """
+    if isinstance(message, dict):
+        missing = [key for key in STATS_METRICS if key not in message]
+        if missing:
+            raise ValueError(f"Mangler {', '.join(missing)}")
+        data = [message[key] for key in STATS_METRICS]
+        ts_ms, device = message.get("ts_ms"), message.get("device")
+    elif isinstance(message, list) and 4 <= len(message) <= 6:
+        data = message[:4]
+        ts_ms = message[4] if len(message) > 4 else None
+        device = message[5] if len(message) > 5 else None
+    else:
+        raise ValueError("Forventede en liste med 4-6 elementer eller et objekt")
+
+    if device is not None and not isinstance(device, str):
+        raise ValueError(f"Ugyldig device: {device!r}")
+    return validate_reading(data, ts_ms), device or DEFAULT_DEVICE, ts_ms
+
+
+def validate_reading(data, ts_ms=None):
+    """
+    Tjekker at en måling kan gemmes: præcis fire endelige tal og et heltal som ts_ms (eller None) mellem
+    READING_MIN_TS_MS og et døgn ud i fremtiden. Et ts_ms uden for det kan ikke laves om til en dato, og en enkelt
+    sådan række stopper statistikken, hukommelsen og eksporten.
+    Returnerer værdierne som floats. Rejser ValueError ellers, så målingen aldrig når databasen eller spool-filen.
+    """
+    if not isinstance(data, (list, tuple)) or len(data) != len(STATS_METRICS):
+        raise ValueError(f"Forventede {len(STATS_METRICS)} værdier: {data!r}")
+    # bool er en underklasse af int i Python, men er ikke en måling
+    if any(isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) for value in data):
+        raise ValueError(f"Værdierne skal være endelige tal: {data!r}")
+    if ts_ms is not None and (isinstance(ts_ms, bool) or not isinstance(ts_ms, int)):
+        raise ValueError(f"ts_ms skal være et heltal: {ts_ms!r}")
+    if ts_ms is not None and not READING_MIN_TS_MS <= ts_ms <= time.time() * 1000 + READING_MAX_FUTURE_MS:
+        raise ValueError(f"ts_ms er uden for det gyldige interval: {ts_ms!r}")
+    return [float(value) for value in data]
+
+
+def handle_sensordata_payload(payload, source="MQTT Client"):
+    """Dekoder en sensordata-payload og gemmer målingen. Bruges både af MQTT-klienten og broker-plugin'et."""
+    log, received, decoded, failed = ingest_source_metrics(source)
+    received.inc()
+    try:
+        if USE_CRYPTOGRAPHY:
+            # Dekrypter payload
+            decrypted_payload = decrypt_message(payload)
+            payload_str = decrypted_payload.decode("utf-8")
+        else:
+            payload_str = bytes(payload).decode("utf-8")
+
+        # Konverter payload string tilbage til en liste (eller et objekt).
+        converted_list = json.loads(payload_str)
+        data, device, ts_ms = parse_sensordata(converted_list)
+        decoded.inc()
+
+        # Indsæt modtaget data i databasen (eller spool-filen hvis databasen er optaget).
+        destination = ingest_reading(data, device, ts_ms)
+        READINGS_INGESTED_BY_DESTINATION[destination].inc()
+
+        # Én debug-linje pr. besked (begrænset), så loggen ikke bremser indtaget
+        if log.isEnabledFor(logging.DEBUG):
+            log_rate_limited(message_log_limiter, log, logging.DEBUG, "Besked modtaget", {
+                "topic": MQTT_TOPIC_SENSORDATA, "device": device, "data": data, "destination": destination
+            })
+    except Exception as e:
+        failed.inc()
+        log_rate_limited(ingest_warning_limiter, log, logging.WARNING, "Fejl ved behandling af payload", {"error": e})
 
 
 # Callback: Håndterer modtagne beskeder
 async def on_message(client: MQTTClient):
  #   try:
-        print("[MQTT Client] Venter på beskeder...")  # Venter på beskeder fra broker
+        log_mqtt_client.info("Venter på beskeder...")  # Venter på beskeder fra broker
         while True:
-            # Hent næste besked
-            message = await client.deliver_message()
+            # Hent næste besked. amqtt giver ikke en ventende deliver_message() besked når forbindelsen mistes
+            # (den hænger for evigt), så der ventes højst MQTT_CONNECTION_CHECK_INTERVAL og forbindelsen tjekkes selv.
+            try:
+                message = await client.deliver_message(timeout=MQTT_CONNECTION_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                if not client.session.transitions.is_connected():
+                    raise ClientException("Forbindelsen til broker er mistet")
+                continue
             packet = message.publish_packet
 
             # Dekod beskedens indhold
@@ -504,51 +2712,55 @@ async def on_message(client: MQTTClient):
 
             # Filtrér beskeder for den rigtige topic
             if topic == MQTT_TOPIC_SENSORDATA:
-                try:
-                    if USE_CRYPTOGRAPHY:
-                        # Dekrypter payload
-                        decrypted_payload = decrypt_message(payload)
-                        payload_str = decrypted_payload.decode("utf-8")
-                    else:
-                        payload_str = payload.decode("utf-8")
-                    
-                    # Konverter payload string tilbage til en liste.
-                    converted_list = eval(payload_str)
-
-                    print(f"[MQTT Client] Modtaget besked på topic '{topic}': {converted_list}")
-
-                    # Indsæt modtaget data i databasen.
-                    insert_data_into_database(converted_list)
-                    print("[MQTT Client] Sensordata indsat i databasen.")
-                except Exception as e:
-                    print(f"[MQTT Client] Fejl ved behandling af payload: {e}")
+                handle_sensordata_payload(payload)
 
     # except Exception as e:
-    #     print(f"[MQTT Client] Fejl ved modtagelse af besked: {e}")
+    #     log_mqtt_client.error("Fejl ved modtagelse af besked", extra={"error": e})
 
 
-# Funktion: Starter MQTT-klienten og håndterer forbindelsen
-async def start_mqtt_client(client: MQTTClient):
-    try:
-        print("[MQTT Client] Forbinder til broker...")  # Forbinder til broker
-        await client.connect(MQTT_BROKER_CONNECT_ADDRESS)
-        print("[MQTT Client] Forbundet til broker.")
+def get_reconnect_delay(attempt):
+    """Eksponentiel backoff med jitter: tilfældig ventetid mellem 0 og MIN * 2^attempt (højst MAX) sekunder.
+    Jitter gør at mange klienter ikke forbinder igen på præcis samme tid når brokeren kommer tilbage."""
+    return random.uniform(0, min(MQTT_RECONNECT_MAX_DELAY, MQTT_RECONNECT_MIN_DELAY * 2 ** attempt))
 
-        # Abonner på den ønskede topic
-        await client.subscribe([(MQTT_TOPIC_SENSORDATA, 1)])  # QoS 0
-        print(f"[MQTT Client] Abonneret på topic: {MQTT_TOPIC_SENSORDATA}")
 
-        # Start med at lytte efter beskeder
-        await on_message(client)
+# Funktion: Starter MQTT-klienten og holder forbindelsen i live
+async def start_mqtt_client(client: MQTTClient):
+    """Forbinder, abonnerer og lytter efter beskeder. Mistes forbindelsen (eller kan den ikke oprettes),
+    ventes der med backoff og forbindes igen, for evigt. Med MQTT_CLEAN_SESSION = False husker brokeren
+    sessionen, så QoS 1/2 beskeder der kom mens klienten var væk bliver leveret når den er tilbage."""
+    attempt = 0
+    while True:
+        try:
+            log_mqtt_client.info("Forbinder til broker...", extra={"address": MQTT_BROKER_CONNECT_ADDRESS})  # Forbinder til broker
+            await client.connect(MQTT_BROKER_CONNECT_ADDRESS, cleansession=MQTT_CLEAN_SESSION)
+            log_mqtt_client.info("Forbundet til broker.")
+            attempt = 0
+
+            # Abonner på den ønskede topic. Gøres hver gang, da en genstartet broker ikke nødvendigvis kender sessionen.
+            await client.subscribe([(MQTT_TOPIC_SENSORDATA, MQTT_QOS)])
+            log_mqtt_client.info("Abonneret på topic", extra={"topic": MQTT_TOPIC_SENSORDATA, "qos": MQTT_QOS})
+
+            # Start med at lytte efter beskeder. Returnerer kun ved en fejl, fx når forbindelsen mistes.
+            await on_message(client)
+
+        except ConnectException as ce:
+            log_mqtt_client.warning("Kunne ikke forbinde til broker", extra={"error": ce})
+        except ClientException as e:
+            log_mqtt_client.warning("Forbindelsen til broker blev afbrudt", extra={"error": e})
+        except (OSError, asyncio.IncompleteReadError) as e:
+            log_mqtt_client.warning("Netværksfejl", extra={"error": e})
+
+        # Ryd op i den gamle forbindelse før der forbindes igen
+        try:
+            await client.disconnect()
+        except Exception:
+            pass
 
-    except ConnectException as ce:
-        print(f"[MQTT Client] Kunne ikke forbinde til broker: {ce}")
-    except ClientException as e:
-        print(f"[MQTT Client] Noget gik galt: {e}")
-    finally:
-        # Sørg for at disconnecte, når vi er færdige
-        await client.disconnect()
-        print("[MQTT Client] Forbindelsen lukket.")
+        delay = get_reconnect_delay(attempt)
+        attempt += 1
+        log_mqtt_client.info("Forbinder igen", extra={"delay_seconds": round(delay, 1), "attempt": attempt})
+        await asyncio.sleep(delay)
 
 
 
@@ -558,6 +2770,108 @@ async def start_mqtt_client(client: MQTTClient):
 
 app = Bottle()
 
+
+class RequestMetricsPlugin:
+    """Bottle plugin der måler hvor lang tid hver route tager og tæller svar pr. statuskode."""
+    name = "request_metrics"
+    api = 2
+
+    def apply(self, callback, route):
+        duration = HTTP_REQUEST_DURATION.labels(route.rule)
+        requests_by_status = {} # Serierne for routens statuskoder, så de kun slås op første gang
+
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            status = 500
+            try:
+                result = callback(*args, **kwargs)
+                status = result.status_code if isinstance(result, HTTPResponse) else response.status_code
+                return result
+            except HTTPResponse as ex:
+                status = ex.status_code
+                raise
+            finally:
+                # Ved streaming (fx /export) er det tiden til svaret starter, ikke til det er sendt færdigt
+                duration.observe(time.perf_counter() - started)
+                counter = requests_by_status.get(status)
+                if counter is None:
+                    counter = requests_by_status.setdefault(status, HTTP_REQUESTS.labels(route.rule, str(status)))
+                counter.inc()
+
+        return wrapper
+
+
+profiling_state = {"sample_rate": PROFILE_SAMPLE_RATE, "profiled": 0}
+
+
+class RequestTimingPlugin:
+    """
+    Bottle plugin der sender tiden for hver fase af en request (auth, db, plot, render og total) i
+    Server-Timing headeren, så den kan ses under Network i browserens udviklerværktøjer.
+    En andel af requests (profiling_state["sample_rate"]) bliver desuden profileret med cProfile og gemt i PROFILE_DIR.
+    """
+    name = "request_timing"
+    api = 2
+
+    def apply(self, callback, route):
+        route_name = route.rule.strip("/").replace("/", "_") or "index"
+
+        def wrapper(*args, **kwargs):
+            profiler = None
+            if profiling_state["sample_rate"] > 0 and random.random() < profiling_state["sample_rate"]:
+                profiler = cProfile.Profile()
+                profiler.enable()
+
+            request_timing.phases = {}
+            started = time.perf_counter()
+            result = None
+            try:
+                result = callback(*args, **kwargs)
+                return result
+            except HTTPResponse as ex:
+                result = ex
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                phases = request_timing.phases
+                request_timing.phases = None
+                if profiler is not None:
+                    profiler.disable()
+                    save_profile(profiler, route_name, elapsed)
+
+                header = format_server_timing(phases, elapsed)
+                if isinstance(result, HTTPResponse):
+                    result.set_header("Server-Timing", header)
+                else:
+                    response.set_header("Server-Timing", header)
+
+        return wrapper
+
+
+def format_server_timing(phases, total):
+    """Fx 'auth;dur=251.2, db;desc="5x";dur=1.4, total;dur=430.0' (millisekunder)."""
+    entries = []
+    for phase, (seconds, count) in phases.items():
+        description = f';desc="{count}x"' if count > 1 else ""
+        entries.append(f"{phase}{description};dur={seconds * 1000:.1f}")
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def save_profile(profiler, route_name, elapsed):
+    """Gemmer en profil som <tidspunkt>_<route>_<ms>ms.prof. Læs den med fx `python -m pstats` eller snakeviz."""
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        filename = f"{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S-%f')}_{route_name}_{elapsed * 1000:.0f}ms.prof"
+        profiler.dump_stats(os.path.join(PROFILE_DIR, filename))
+        profiling_state["profiled"] += 1
+    except Exception as ex:
+        log_profiling.error("Kunne ikke gemme profil", extra={"error": ex})
+
+
+app.install(RequestMetricsPlugin())
+app.install(RequestTimingPlugin())
+
 # Brugerliste med hashed adgangskoder
 users = {
     "admin": bcrypt.hashpw(b"password123", bcrypt.gensalt()),
@@ -569,7 +2883,12 @@ def check_credentials(username, password):
     """Tjek om brugernavn og adgangskode er gyldige."""
     if username in users:
         # Tjek adgangskode mod det hashed kodeord
-        return bcrypt.checkpw(password.encode('utf-8'), users[username])
+        started = time.perf_counter()
+        valid = bcrypt.checkpw(password.encode('utf-8'), users[username])
+        record_timing(AUTH_CHECK_DURATION, "auth", started)
+        (AUTH_CHECKS_OK if valid else AUTH_CHECKS_WRONG_PASSWORD).inc()
+        return valid
+    AUTH_CHECKS_UNKNOWN_USER.inc()
     return False
 
 
@@ -662,7 +2981,10 @@ base_template: sourcetypes.html = """
 # Function to "inherit" base template
 def render_page(content, title):
     """Combine the base template with page-specific content."""
-    return template(base_template, title=title, content=content, refresh_delay=REFRESH_DELAY)
+    started = time.perf_counter()
+    page = template(base_template, title=title, content=content, refresh_delay=REFRESH_DELAY)
+    record_phase("render", time.perf_counter() - started)
+    return page
 
 
 def determine_color_class(value, min, max):
@@ -670,16 +2992,12 @@ def determine_color_class(value, min, max):
     return "green" if min <= value <= max else "orange"
 
 def get_time_since_data():
-    # Hent data fra databasen
-    latest_timestamp = get_latest_datapoint("timestamp")
-    current_time = get_current_timestamp()
-
-    timestamp1 = datetime.datetime.strptime(latest_timestamp, '%Y-%m-%d %H:%M:%S')
-    timestamp2 = datetime.datetime.strptime(current_time, '%Y-%m-%d %H:%M:%S')
-
-    time_diff = timestamp2 - timestamp1
+    # Hent tidspunktet for den nyeste måling fra databasen
+    latest_ts_ms = get_latest_timestamp_ms()
+    if latest_ts_ms is None:
+        return None
 
-    minutes_diff = int(time_diff.total_seconds() / 60)
+    minutes_diff = int((time.time() * 1000 - latest_ts_ms) / 60000)
 
     return minutes_diff
 
@@ -860,6 +3178,107 @@ def loudness_page():
     return render_page(sensor_content_stitcher(key, label, color, title, lower_threshold, upper_threshold, loudness, latest_value, symbol), title)
 
 
+@app.route('/api/stats')
+@auth_basic(check_credentials)
+def stats_api():
+    """
+    Løbende statistik som JSON, kræver login.
+    Brug ?window=total eller ?window=night:<YYYY-MM-DD>. Uden window returneres total og den aktuelle nat.
+    """
+    window = request.query.get("window")
+    if window:
+        windows = [window]
+    else:
+        windows = ["total", f"night:{get_night_key(datetime.datetime.now().timestamp())}"]
+
+    result = {window: get_statistics(window) for window in windows}
+
+    if window and result[window] is None:
+        return HTTPResponse(status=404, body=json.dumps({"error": f"Ukendt vindue: {window}"}), headers={"Content-Type": "application/json"})
+    return result
+
+
+@app.route('/api/report')
+@auth_basic(check_credentials)
+def report_api():
+    """Søvnrapport for en nat som JSON, kræver login. Brug ?night=<YYYY-MM-DD> (standard: den aktuelle nat)."""
+    night = request.query.get("night") or get_night_key(datetime.datetime.now().timestamp())
+
+    try:
+        datetime.datetime.strptime(night, '%Y-%m-%d')
+    except ValueError:
+        return HTTPResponse(status=400, body=json.dumps({"error": f"Ugyldig dato: {night}. Brug formatet YYYY-MM-DD."}), headers={"Content-Type": "application/json"})
+
+    return get_nightly_report(night)
+
+
+@app.route('/export')
+@auth_basic(check_credentials)
+def export_page():
+    """
+    Eksporterer målinger som en strøm, kræver login.
+    Parametre: ?start=&end= (millisekunder, YYYY-MM-DD eller YYYY-MM-DD HH:MM:SS), ?format=csv|ndjson og ?gzip=1.
+    """
+    export_format = request.query.get("format", "csv")
+    compress = request.query.get("gzip") in ("1", "true")
+
+    try:
+        start_ms = parse_export_time(request.query.get("start"), 0)
+        end_ms = parse_export_time(request.query.get("end"), int(time.time() * 1000) + 1)
+        if export_format not in EXPORT_QUERIES:
+            raise ValueError(f"Ugyldigt format: {export_format}. Vælg mellem 'csv' og 'ndjson'.")
+    except ValueError as ex:
+        return HTTPResponse(status=400, body=json.dumps({"error": str(ex)}), headers={"Content-Type": "application/json"})
+
+    filename = f"sensordata.{export_format}"
+    if compress:
+        filename += ".gz"
+        response.content_type = "application/gzip"
+    elif export_format == "csv":
+        response.content_type = "text/csv; charset=utf-8"
+    else:
+        response.content_type = "application/x-ndjson; charset=utf-8"
+    response.set_header("Content-Disposition", f'attachment; filename="{filename}"')
+
+    return export_rows(start_ms, end_ms, export_format, compress)
+
+
+@app.route('/api/spool')
+@auth_basic(check_credentials)
+def spool_api():
+    """Status for spool-filen (målinger der venter på databasen) som JSON, kræver login."""
+    return ingest_spool.status()
+
+
+@app.route('/metrics')
+@auth_basic(check_credentials)
+def metrics_page():
+    """Metrics i Prometheus' tekstformat, kræver login (brug basic_auth i Prometheus' scrape config)."""
+    response.content_type = "text/plain; version=0.0.4; charset=utf-8"
+    return render_metrics()
+
+
+@app.route('/api/profiling', method=['GET', 'POST'])
+@auth_basic(check_credentials)
+def profiling_api():
+    """
+    Status for profilering som JSON, kræver login.
+    POST med ?sample_rate=<0-1> ændrer hvor stor en andel af requests der profileres, uden genstart (0 slår det fra).
+    """
+    if request.method == 'POST':
+        try:
+            sample_rate = float(request.params.get("sample_rate", ""))
+            if not 0 <= sample_rate <= 1:
+                raise ValueError
+        except ValueError:
+            return HTTPResponse(status=400, body=json.dumps({"error": "sample_rate skal være et tal mellem 0 og 1."}), headers={"Content-Type": "application/json"})
+
+        profiling_state["sample_rate"] = sample_rate
+        log_profiling.info("Profilering ændret", extra={"sample_rate": sample_rate, "directory": PROFILE_DIR})
+
+    return {**profiling_state, "directory": PROFILE_DIR}
+
+
 @app.route('/logout', method='POST')
 def logout():
     """Log brugeren ud ved at sende en HTTP 401, så browseren glemmer credentials."""
@@ -898,11 +3317,38 @@ broker_config = {
     }
 }
 
+class IngestBrokerPlugin:
+    """
+    amqtt broker plugin der sender beskeder på sensordata-topic'en direkte videre til ingest,
+    så de ikke skal en tur over TCP til vores egen MQTT-klient i samme proces.
+    """
+
+    def __init__(self, context):
+        self.context = context
+
+    async def on_broker_message_received(self, client_id, message):
+        if message.topic == MQTT_TOPIC_SENSORDATA:
+            handle_sensordata_payload(message.data, source="MQTT Broker")
+
+
+def create_broker(config=broker_config, ingest_plugin=MQTT_BROKER_INGEST_PLUGIN):
+    """Opretter brokeren, evt. med IngestBrokerPlugin."""
+    broker = Broker(config)
+
+    if ingest_plugin:
+        # amqtt finder normalt plugins via setuptools entry points, men projektet er ikke en pakke,
+        # så plugin'et lægges direkte i brokerens plugin manager.
+        context = copy.copy(broker.plugins_manager.app_context)
+        broker.plugins_manager._plugins.append(Plugin("sensordata_ingest", None, IngestBrokerPlugin(context)))
+
+    return broker
+
+
 async def mqtt_broker_coro():
-    broker = Broker(broker_config)
+    broker = create_broker()
     await broker.start()
 
-    print("[MQTT Broker] Running...")
+    log_mqtt_broker.info("Running...")
     await asyncio.Event().wait()
 
 
@@ -912,8 +3358,15 @@ async def mqtt_broker_coro():
 
 async def backup_and_upload_db(delay):
     while True:
-        backup_file = create_database_backup(DATABASE_PATH, BACKUP_DIR)
-        upload_to_ftp(FTP_HOST, FTP_USER, FTP_PASSWORD, backup_file, REMOTE_DIR)
+        # Hoveddatabasen og den aktive partition ændrer sig, så der tages en kopi af dem hver gang
+        for db_path in (DATABASE_PATH, get_active_partition()):
+            backup_file = create_database_backup(db_path, BACKUP_DIR)
+            upload_to_ftp(FTP_HOST, FTP_USER, FTP_PASSWORD, backup_file, REMOTE_DIR)
+
+        # Afsluttede partitioner ændres aldrig, så de sendes direkte og kun én gang
+        for month, partition_path in get_unuploaded_partitions():
+            upload_to_ftp(FTP_HOST, FTP_USER, FTP_PASSWORD, partition_path, REMOTE_DIR)
+            mark_partition_uploaded(month)
         await asyncio.sleep(delay)
 
 async def main():
@@ -922,33 +3375,55 @@ async def main():
 
     # Start MQTT-broker
     if START_MQTT_BROKER:
-        print("[System] Starter MQTT-broker...")
+        log_system.info("Starter MQTT-broker...")
         tasks.append(asyncio.create_task(mqtt_broker_coro()))
 
+    # Modtager brokeren selv sensordata (IngestBrokerPlugin), er der ingen grund til at abonnere med vores egen klient.
+    # Klienten bruges så kun til at sende testdata.
+    broker_ingest = START_MQTT_BROKER and MQTT_BROKER_INGEST_PLUGIN
+
     # Start MQTT-klient
-    if START_MQTT_CLIENT:
-        print("[System] Venter 4 sekunder med at starte MQTT-klient...")
+    if START_MQTT_CLIENT and not broker_ingest:
+        log_system.info("Venter 4 sekunder med at starte MQTT-klient...")
         await asyncio.sleep(4)  # Vent 4 sekunder før klienten starter
-        print("[System] Starter MQTT-klient...")
+        log_system.info("Starter MQTT-klient...")
         tasks.append(asyncio.create_task(start_mqtt_client(mqtt_client)))
+    elif broker_ingest:
+        log_system.info("MQTT-brokeren modtager sensordata direkte (IngestBrokerPlugin).")
 
     # Start datagenerator
     if GENERATE_TEST_DATA:
-        print("[System] Venter 4 sekunder med at generere testdata...")
+        log_system.info("Venter 4 sekunder med at generere testdata...")
         await asyncio.sleep(4)  # Vent 4 sekunder før testdata begynder at generere
-        print("[System] Starter test-datagenerator...")
+        if broker_ingest:
+            await mqtt_client.connect(MQTT_BROKER_CONNECT_ADDRESS)
+        log_system.info("Starter test-datagenerator...")
         tasks.append(asyncio.create_task(publish_testdata_loop(10, mqtt_client)))
         
     if DATABASE_BACKUP:
         tasks.append(asyncio.create_task(backup_and_upload_db(DATABASE_BACKUP_DELAY)))
 
+    # Tøm spool-filen når databasen har været optaget
+    tasks.append(asyncio.create_task(spool_replay_loop()))
+
+    # Skift partition når måneden skifter
+    tasks.append(asyncio.create_task(partition_rollover_loop()))
+
     # Afvent alle opgaver
-    print("[System] Alle opgaver er startet. Afventer...")
+    log_system.info("Alle opgaver er startet. Afventer...")
     await asyncio.gather(*tasks)
 
 if __name__ == '__main__':
     server_thread = None
     try:
+        # Indlæs den løbende statistik (og indhent rækker siden sidste checkpoint) og de nyeste målinger.
+        # Er databasen ved at blive migreret, sker det i baggrunden når migreringen er færdig.
+        if schema_state["migrating"]:
+            Thread(target=lambda: (migrate_database(), distribute_readings(), load_statistics(), hot_tier.warm()), daemon=True).start()
+        else:
+            load_statistics()
+            hot_tier.warm()
+
         # Start Bottle server på seperat thread.
         server_thread = Thread(target=run_bottle_server, daemon=True)
         server_thread.start()
@@ -958,4 +3433,4 @@ if __name__ == '__main__':
         asyncio.get_event_loop().run_forever()
     except KeyboardInterrupt:
         asyncio.get_event_loop().stop()
-        print("\nProgram terminated.")
\ No newline at end of file
+        log_system.info("Program terminated.")
\ No newline at end of file
@@ -0,0 +1,59 @@
+# Benchmark af /export.
+# Eksporterer alle rækker i en stor database gennem app.export_rows (samme generator som /export bruger)
+# og måler hastighed og hvor meget hukommelsesforbruget vokser undervejs.
+#
+# Kør: python bench_export.py [--rows 10000000] [--database bench_export.db]
+
+import argparse
+import os
+import time
+
+import app
+from bench_nightly_report import generate_database
+
+
+def current_rss_mb():
+    """Nuværende hukommelsesforbrug (RSS) i MB. Virker kun på Linux, ellers 0."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return 0.0
+
+
+def run_export(export_format, compress):
+    """Eksporterer hele databasen og returnerer (sekunder, bytes, største RSS-stigning i MB)."""
+    baseline = current_rss_mb()
+    peak = baseline
+    total_bytes = 0
+
+    started = time.perf_counter()
+    for i, chunk in enumerate(app.export_rows(0, int(time.time() * 1000) + 1, export_format, compress)):
+        total_bytes += len(chunk)
+        if i % 100 == 0:
+            peak = max(peak, current_rss_mb())
+
+    return time.perf_counter() - started, total_bytes, peak - baseline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark af streaming eksport")
+    parser.add_argument("--rows", type=int, default=10_000_000, help="Antal rækker (standard: 10.000.000)")
+    parser.add_argument("--database", default=os.path.join(app.script_dir, "bench_export.db"), help="Database der bruges til benchmark")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        generate_database(args.database, args.rows / 86400)
+    app.DATABASE_PATH = args.database
+
+    rows = sum(len(chunk) for chunk in app.iter_reading_chunks("SELECT ts_ms FROM {table}"))
+
+    print(f"{'Format':12}{'sekunder':>10}{'rækker/s':>12}{'MB':>10}{'RSS +MB':>10}")
+    for export_format, compress in (("csv", False), ("ndjson", False), ("csv", True)):
+        seconds, total_bytes, rss_growth = run_export(export_format, compress)
+        name = export_format + (" gzip" if compress else "")
+        print(f"{name:12}{seconds:10.1f}{rows / seconds:12,.0f}{total_bytes / 1024 / 1024:10.1f}{rss_growth:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Benchmark af de nyeste målinger fra hukommelsen (hot_tier) mod SQLite.
+# Genererer en database med syntetiske data, varmer hot_tier op og måler fetch_sensor_data, get_latest_datapoint
+# og get_time_since_data med og uden hot_tier. Undervejs tjekkes at svarene fra hukommelsen er de samme som fra
+# databasen, også efter målinger der kommer i forkert rækkefølge og efter bufferen er løbet rundt.
+#
+# Kør: python bench_hot_tier.py [--days 30] [--devices 3] [--database bench_hot_tier.db]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+import app
+from generate_history import generate_history
+
+
+def measure(function, repeats):
+    """Returnerer median tiden i mikrosekunder."""
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    return float(np.median(timings))
+
+
+def from_database(function, *args):
+    """Kalder `function` med en hot_tier der ikke er varmet op, så svaret kommer fra SQLite."""
+    hot_tier, app.hot_tier = app.hot_tier, app.HotTier()
+    try:
+        return function(*args)
+    finally:
+        app.hot_tier = hot_tier
+
+
+def check(label):
+    """Sammenligner svarene fra hukommelsen med databasen. Returnerer antal forskelle."""
+    errors = 0
+    for name, function, args in (
+        ("fetch_sensor_data", app.fetch_sensor_data, ()),
+        ("fetch_sensor_data(1)", app.fetch_sensor_data, (1,)),
+        ("get_latest_timestamp_ms", app.get_latest_timestamp_ms, ()),
+    ):
+        if function(*args) != from_database(function, *args):
+            print(f"  FEJL ({label}): {name} giver ikke det samme som databasen")
+            errors += 1
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark af hot_tier mod SQLite")
+    parser.add_argument("--days", type=float, default=30, help="Dage med 1 Hz data pr. sensor (standard: 30)")
+    parser.add_argument("--devices", type=int, default=3, help="Antal sensorer (standard: 3)")
+    parser.add_argument("--repeats", type=int, default=500, help="Gentagelser pr. måling (standard: 500)")
+    parser.add_argument("--database", default=os.path.join(app.script_dir, "bench_hot_tier.db"), help="Database der bruges til benchmark")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"Genererer {args.days:g} dages data for {args.devices} sensorer i {args.database}...")
+        generate_history(args.database, args.days, devices=args.devices)
+
+    app.DATABASE_PATH = args.database
+    app.init_database()
+    app.hot_tier.warm()
+
+    # Svarene skal være de samme som fra databasen: efter opvarmning, efter nye målinger (også nogle der er
+    # ældre end de nyeste, som fra spool-filen) og efter bufferen er løbet hele vejen rundt
+    errors = check("efter opvarmning")
+    rng = random.Random(42)
+    latest_ts_ms = app.get_latest_timestamp_ms()
+    for i in range(app.HOT_TIER_SIZE + 50):
+        ts_ms = latest_ts_ms + (i + 1) * 1000 - (rng.randint(0, 120_000) if i % 10 == 0 else 0)
+        app.insert_data_into_database(app.generate_test_data(), ts_ms, "bench")
+        if i in (10, app.HOT_TIER_SIZE // 2, app.HOT_TIER_SIZE + 49):
+            errors += check(f"efter {i + 1} nye målinger")
+    print("Svar fra hukommelsen er de samme som fra databasen" if not errors else f"{errors} forskelle fundet")
+
+    print(f"{'':28}{'SQLite µs':>12}{'hot_tier µs':>14}{'hurtigere':>11}")
+    for name, function in (
+        ("fetch_sensor_data()", app.fetch_sensor_data),
+        ("get_latest_datapoint()", lambda: app.get_latest_datapoint("temperature")),
+        ("get_time_since_data()", app.get_time_since_data),
+    ):
+        database = measure(lambda: from_database(function), args.repeats)
+        memory = measure(function, args.repeats)
+        print(f"{name:28}{database:12,.0f}{memory:14,.0f}{database / memory:10.0f}x")
+
+    # Velkomstsiden henter de nyeste målinger 10 gange (graf, 4 seneste værdier og 5 x tid siden data)
+    page = lambda: (app.fetch_sensor_data(), [app.get_latest_datapoint(m) for m in app.STATS_METRICS], [app.get_time_since_data() for _ in range(5)])
+    database = measure(lambda: from_database(page), args.repeats // 5)
+    memory = measure(page, args.repeats // 5)
+    print(f"{'forespørgsler for /':28}{database:12,.0f}{memory:14,.0f}{database / memory:10.0f}x")
+
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
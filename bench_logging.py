@@ -0,0 +1,115 @@
+# Benchmark af hvor meget logging koster for indtaget af sensordata.
+# Sender N beskeder gennem app.handle_sensordata_payload (samme vej som broker-plugin'et) mod en midlertidig database,
+# mens loggen skrives til en pipe, ligesom når app'en kører under en service-manager eller sender loggen til en
+# log-collector. Læseren i den anden ende af pipen kan gøres langsom med --sink-rate.
+# Kørslerne:
+#   print:       den gamle opførsel, to print-linjer pr. besked skrevet direkte fra den tråd der tager imod
+#   INFO:        standard; ingen logs pr. besked
+#   DEBUG:       én debug-linje pr. besked, højst LOG_DEBUG_RATE_LIMIT pr. sekund
+#   DEBUG alle:  én debug-linje for hver eneste besked (ingen rate limit)
+# Logging-kørslerne køres både gennem køen (baggrundstråd skriver) og direkte (tråden der tager imod skriver).
+#
+# Kør: python bench_logging.py [--messages 20000] [--sink-rate 0]
+
+import argparse
+import io
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import app
+
+# Læser stdin og smider det væk, højst `rate` bytes/s (0 = så hurtigt som muligt)
+SINK_SCRIPT = """
+import sys, time
+rate = float(sys.argv[1])
+while True:
+    chunk = sys.stdin.buffer.read1(4096)
+    if not chunk:
+        break
+    if rate:
+        time.sleep(len(chunk) / rate)
+"""
+
+
+def open_sink(rate):
+    sink = subprocess.Popen([sys.executable, "-c", SINK_SCRIPT, str(rate)], stdin=subprocess.PIPE)
+    return sink, io.TextIOWrapper(sink.stdin, encoding="utf-8")
+
+
+def print_every_message(stream):
+    """Pakker app.ingest_reading ind, så den skriver de samme to linjer pr. besked som før logging blev indført."""
+    ingest_reading = app.ingest_reading
+
+    def printing_ingest_reading(data, device=app.DEFAULT_DEVICE, ts_ms=None):
+        print(f"[MQTT Broker] Modtaget besked på topic '{app.MQTT_TOPIC_SENSORDATA}': {data}", file=stream)
+        result = ingest_reading(data, device, ts_ms)
+        print("[MQTT Broker] Sensordata indsat i databasen.", file=stream)
+        return result
+
+    app.ingest_reading = printing_ingest_reading
+    return ingest_reading
+
+
+def run(mode, level, use_queue, rate_limit, args, work_dir, step):
+    """Sender args.messages beskeder igennem og returnerer (beskeder/s, sekunder før loggen var skrevet færdig)."""
+    sink, stream = open_sink(args.sink_rate)
+    app.setup_logging(level, stream=stream, use_queue=use_queue)
+    app.message_log_limiter.per_second = rate_limit
+
+    app.DATABASE_PATH = os.path.join(work_dir, f"bench_logging_{step}.db")
+    app.init_database()
+    app.ingest_spool = app.IngestSpool(os.path.join(work_dir, f"bench_logging_{step}_spool.log"))
+    original_ingest_reading = print_every_message(stream) if mode == "print" else None
+
+    payloads = [app.make_byte_string(app.generate_test_data()) for _ in range(args.messages)]
+    started = time.perf_counter()
+    for payload in payloads:
+        app.handle_sensordata_payload(payload, "MQTT Broker")
+    seconds = time.perf_counter() - started
+
+    # Hvor længe der går før alt er skrevet (med køen ligger resten stadig i den, når indtaget er færdigt)
+    app.stop_logging()
+    stream.close()
+    sink.wait()
+    drained = time.perf_counter() - started
+
+    if original_ingest_reading:
+        app.ingest_reading = original_ingest_reading
+    return args.messages / seconds, drained
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark af indtaget med logging på INFO og DEBUG")
+    parser.add_argument("--messages", type=int, default=20000, help="Beskeder pr. kørsel (standard: 20000)")
+    parser.add_argument("--sink-rate", type=float, default=0, help="Bytes/s log-læseren kan følge med til (standard: 0 = ubegrænset)")
+    args = parser.parse_args()
+
+    runs = [
+        ("print", "print", logging.WARNING, False, app.LOG_DEBUG_RATE_LIMIT),
+        ("INFO", "log", logging.INFO, True, app.LOG_DEBUG_RATE_LIMIT),
+        ("INFO", "log", logging.INFO, False, app.LOG_DEBUG_RATE_LIMIT),
+        ("DEBUG", "log", logging.DEBUG, True, app.LOG_DEBUG_RATE_LIMIT),
+        ("DEBUG", "log", logging.DEBUG, False, app.LOG_DEBUG_RATE_LIMIT),
+        ("DEBUG alle", "log", logging.DEBUG, True, 0),
+        ("DEBUG alle", "log", logging.DEBUG, False, 0),
+    ]
+
+    sink = f"{args.sink_rate:,.0f} bytes/s" if args.sink_rate else "ubegrænset"
+    print(f"{args.messages:,} beskeder pr. kørsel, log-læser: {sink}")
+    print(f"{'Logging':12}{'skriver':>10}{'beskeder/s':>12}{'log færdig s':>14}")
+    with tempfile.TemporaryDirectory(prefix="bench_logging_") as work_dir:
+        for step, (name, mode, level, use_queue, rate_limit) in enumerate(runs):
+            throughput, drained = run(mode, level, use_queue, rate_limit, args, work_dir, step)
+            writer = "kø" if use_queue else "direkte"
+            print(f"{name:12}{writer:>10}{throughput:12,.0f}{drained:14.2f}")
+
+    app.message_log_limiter.per_second = app.LOG_DEBUG_RATE_LIMIT
+    app.setup_logging()
+
+
+if __name__ == "__main__":
+    main()
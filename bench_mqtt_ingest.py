@@ -0,0 +1,95 @@
+# Benchmark af de to veje sensordata kan tage ind i databasen, når brokeren kører i samme proces:
+#   plugin:   sensor -> Broker -> IngestBrokerPlugin -> ingest
+#   loopback: sensor -> Broker -> TCP -> vores egen MQTTClient -> on_message -> ingest
+# Måler beskeder/s og latenstid fra publish til målingen er gemt.
+#
+# Kør: python bench_mqtt_ingest.py [--messages 5000] [--port 18830]
+
+import argparse
+import asyncio
+import copy
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+from amqtt.client import MQTTClient
+
+import app
+
+
+async def run_path(path, messages, port):
+    """Sender `messages` beskeder gennem den valgte vej og returnerer (sekunder, latenstider i ms, modtaget)."""
+    config = copy.deepcopy(app.broker_config)
+    config["listeners"]["default"]["bind"] = f"127.0.0.1:{port}"
+    broker = app.create_broker(config, ingest_plugin=(path == "plugin"))
+    await broker.start()
+
+    # Tidsstempel for hver gemt måling. Beskederne kommer frem i rækkefølge, så nr. i hører til send nr. i.
+    ingested = []
+    ingest_reading = app.ingest_reading
+
+    def timed_ingest_reading(data, *args, **kwargs):
+        result = ingest_reading(data, *args, **kwargs)
+        ingested.append(time.perf_counter())
+        return result
+
+    app.ingest_reading = timed_ingest_reading
+
+    subscriber = None
+    listener = None
+    if path == "loopback":
+        subscriber = MQTTClient()
+        await subscriber.connect(f"mqtt://127.0.0.1:{port}")
+        await subscriber.subscribe([(app.MQTT_TOPIC_SENSORDATA, 1)])
+        listener = asyncio.create_task(app.on_message(subscriber))
+
+    publisher = MQTTClient()
+    await publisher.connect(f"mqtt://127.0.0.1:{port}")
+
+    sent = []
+    started = time.perf_counter()
+    for _ in range(messages):
+        sent.append(time.perf_counter())
+        await publisher.publish(app.MQTT_TOPIC_SENSORDATA, app.make_byte_string(app.generate_test_data()), qos=1)
+
+    # Vent på at alle beskeder er gemt (eller giv op efter 30 s uden fremgang)
+    last_count, last_progress = 0, time.perf_counter()
+    while len(ingested) < messages and time.perf_counter() - last_progress < 30:
+        await asyncio.sleep(0.01)
+        if len(ingested) != last_count:
+            last_count, last_progress = len(ingested), time.perf_counter()
+    seconds = (ingested[-1] if ingested else time.perf_counter()) - started
+
+    app.ingest_reading = ingest_reading
+    await publisher.disconnect()
+    if subscriber:
+        listener.cancel()
+        await subscriber.disconnect()
+    await broker.shutdown()
+
+    latencies = [(done - send) * 1000 for send, done in zip(sent, ingested)]
+    return seconds, latencies, len(ingested)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark af broker plugin vs. loopback MQTT-klient")
+    parser.add_argument("--messages", type=int, default=5000, help="Beskeder pr. vej (standard: 5000)")
+    parser.add_argument("--port", type=int, default=18830, help="Port til benchmark-brokeren")
+    args = parser.parse_args()
+
+    # Egen database, og kun advarsler i loggen, så det er ingest der måles og ikke terminalen
+    app.DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "bench_mqtt.db")
+    app.init_database()
+    app.setup_logging(logging.WARNING)
+
+    print(f"{'Vej':10}{'beskeder/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'tabt':>8}")
+    for path in ("plugin", "loopback"):
+        seconds, latencies, received = await run_path(path, args.messages, args.port)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (0, 0, 0)
+        print(f"{path:10}{received / seconds:12,.0f}{p50:10.2f}{p95:10.2f}{p99:10.2f}{args.messages - received:8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
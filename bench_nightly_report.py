@@ -0,0 +1,91 @@
+# Benchmark af søvnrapporten (/api/report).
+# Genererer et års data med 1 Hz i en separat database og måler hvor lang tid det tager at hente
+# rapporten for en færdig nat og for den igangværende nat (første gang og fra cache).
+# Til sidst tjekkes at en rapport der beregnes mens en sen måling for natten bliver gemt, ikke bliver gemt forældet.
+#
+# Kør: python bench_nightly_report.py [--days 365] [--database bench_sensordata.db]
+
+import argparse
+import datetime
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+import app
+from generate_history import generate_history
+
+
+def generate_database(db_path, days):
+    """Fylder databasen med `days` dages målinger fra én sensor, én pr. sekund, frem til nu."""
+    generate_history(db_path, days, devices=1, interval=1, seed=42)
+
+
+def measure(function, repeats):
+    """Returnerer median tiden i millisekunder."""
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark af søvnrapporten")
+    parser.add_argument("--days", type=int, default=365, help="Antal dage med 1 Hz data (standard: 365)")
+    parser.add_argument("--database", default=os.path.join(app.script_dir, "bench_sensordata.db"), help="Database der bruges til benchmark")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        generate_database(args.database, args.days)
+    app.DATABASE_PATH = args.database
+
+    now = datetime.datetime.now().timestamp()
+    current_night = app.get_night_key(now)
+    finished_night = app.get_night_key(now - 3 * 24 * 3600)
+
+    with sqlite3.connect(args.database) as db:
+        db.execute("DELETE FROM NightlyReport")
+
+    cold = measure(lambda: app.get_nightly_report(finished_night), 1)
+    cached = measure(lambda: app.get_nightly_report(finished_night), 100)
+    current_cold = measure(lambda: app.get_nightly_report(current_night), 1)
+    current_cached = measure(lambda: app.get_nightly_report(current_night), 100)
+
+    report = app.get_nightly_report(finished_night)
+    print(f"Færdig nat {finished_night} ({report['readings']} målinger), første gang: {cold:.1f} ms")
+    print(f"Færdig nat {finished_night} fra cache: {cached:.2f} ms")
+    print(f"Igangværende nat {current_night}, første gang: {current_cold:.1f} ms")
+    print(f"Igangværende nat {current_night} fra cache (højst {app.REPORT_CURRENT_NIGHT_TTL} s gammel): {current_cached:.2f} ms")
+
+    check_late_reading(args.database, finished_night, report["readings"])
+
+
+def check_late_reading(db_path, night, readings):
+    """En måling for natten gemmes efter rapporten har hentet sine rækker, men før den gemmes."""
+    with sqlite3.connect(db_path) as db:
+        db.execute("DELETE FROM NightlyReport WHERE night = ?", (night,))
+
+    start = app.get_night_bounds(night)[0]
+    fetch_night_readings = app.fetch_night_readings
+
+    def fetch_then_insert(*args):
+        rows = fetch_night_readings(*args)
+        app.insert_data_into_database([18, 50, 10, 1], int(start.timestamp() * 1000) + 1, "bench")
+        return rows
+
+    app.fetch_night_readings = fetch_then_insert
+    try:
+        app.get_nightly_report(night)
+    finally:
+        app.fetch_night_readings = fetch_night_readings
+
+    report = app.get_nightly_report(night)
+    if report["readings"] != readings + 1:
+        print(f"  FEJL: rapporten for {night} har {report['readings']} målinger, forventet {readings + 1} (forældet rapport gemt)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# Benchmark af månedspartitionerne mod én stor databasefil.
+# Genererer en partitioneret database med syntetiske data og kopierer alle rækkerne over i én fil med det gamle
+# layout (én SensorReadings tabel). Derefter måles:
+#   nat:       en nats målinger (fetch_night_readings / samme forespørgsel mod den store fil). Antallet tjekkes også
+#              mod SensorData viewet fra connect_compatibility_view
+#   backup:    hvor meget backup_and_upload_db skal kopiere og sende hver gang
+#   retention: at slette den ældste måned (DELETE + VACUUM i den store fil, en fil i partitionerne)
+#
+# Kør: python bench_partitions.py [--days 180] [--devices 3] [--interval 10]
+
+import argparse
+import datetime
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+
+import app
+from generate_history import generate_history
+
+
+def measure(function, repeats=5):
+    """Returnerer den bedste tid i millisekunder."""
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+
+def copy_to_single_file(db_path, single_path):
+    """Kopierer alle målinger fra partitionerne over i én fil med en enkelt SensorReadings tabel."""
+    with sqlite3.connect(single_path) as db:
+        app.create_readings_table(db.cursor())
+        for rows in app.iter_reading_chunks("SELECT id, ts_ms, device, temperature, humidity, loudness, light_level FROM {table}", key="id", db_path=db_path):
+            db.executemany("INSERT INTO SensorReadings (id, ts_ms, device, temperature, humidity, loudness, light_level) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    with sqlite3.connect(single_path) as db:
+        db.execute("VACUUM")
+
+
+def night_from_single_file(single_path, start, end):
+    with sqlite3.connect(single_path) as db:
+        return db.execute(
+            "SELECT ts_ms, temperature, humidity, loudness, light_level FROM SensorReadings WHERE ts_ms >= ? AND ts_ms < ? ORDER BY ts_ms",
+            (int(start.timestamp() * 1000), int(end.timestamp() * 1000))
+        ).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark af månedspartitioner mod én databasefil")
+    parser.add_argument("--days", type=float, default=180, help="Dage med data (standard: 180)")
+    parser.add_argument("--devices", type=int, default=3, help="Antal sensorer (standard: 3)")
+    parser.add_argument("--interval", type=int, default=10, help="Sekunder mellem målinger (standard: 10)")
+    args = parser.parse_args()
+
+    app.setup_logging(logging.WARNING)
+    app.DATABASE_BACKUP = False # Så retention ikke venter på upload
+
+    with tempfile.TemporaryDirectory(prefix="bench_partitions_") as work_dir:
+        db_path = os.path.join(work_dir, "partitioned.db")
+        single_path = os.path.join(work_dir, "single.db")
+        print(f"Genererer {args.days:g} dages data for {args.devices} sensorer...")
+        rows = generate_history(db_path, args.days, devices=args.devices, interval=args.interval)
+        copy_to_single_file(db_path, single_path)
+        app.DATABASE_PATH = db_path
+
+        with sqlite3.connect(db_path) as db:
+            months = db.execute("SELECT month, rows FROM Partitions WHERE sealed = 1 ORDER BY month").fetchall()
+        print(f"{rows:,} rækker, {len(months) + 1} partitioner")
+
+        # Nat midt i perioden
+        night = (datetime.datetime.now() - datetime.timedelta(days=args.days / 2)).strftime('%Y-%m-%d')
+        start, end = app.get_night_bounds(night)
+        if len(app.fetch_night_readings(start, end)) != len(night_from_single_file(single_path, start, end)):
+            print("  FEJL: partitionerne giver ikke det samme antal rækker som den store fil")
+        view = app.connect_compatibility_view(int(start.timestamp() * 1000), int(end.timestamp() * 1000))
+        view_rows = view.execute("SELECT COUNT(*) FROM SensorData").fetchone()[0]
+        view.close()
+        if view_rows != len(night_from_single_file(single_path, start, end)):
+            print("  FEJL: SensorData viewet giver ikke det samme antal rækker som den store fil")
+        print(f"{'':14}{'én fil':>14}{'partitioner':>14}")
+        single = measure(lambda: night_from_single_file(single_path, start, end))
+        partitioned = measure(lambda: app.fetch_night_readings(start, end))
+        print(f"{'nat ms':14}{single:14,.1f}{partitioned:14,.1f}")
+
+        # Backup kopierer hoveddatabasen og den aktive partition; afsluttede sendes én gang
+        backup_bytes = os.path.getsize(db_path) + os.path.getsize(app.get_active_partition())
+        print(f"{'backup MB':14}{os.path.getsize(single_path) / 1e6:14,.1f}{backup_bytes / 1e6:14,.1f}")
+
+        # Retention: fjern den ældste måned
+        oldest, oldest_rows = months[0]
+        oldest_end = app.get_month_bounds(oldest)[1]
+        started = time.perf_counter()
+        with sqlite3.connect(single_path) as db:
+            db.execute("DELETE FROM SensorReadings WHERE ts_ms < ?", (oldest_end,))
+        with sqlite3.connect(single_path) as db:
+            db.execute("VACUUM")
+        single = (time.perf_counter() - started) * 1000
+
+        months_to_keep = (datetime.datetime.now().year - int(oldest[:4])) * 12 + datetime.datetime.now().month - int(oldest[5:]) - 1
+        app.PARTITION_RETENTION_MONTHS = months_to_keep
+        started = time.perf_counter()
+        app.rollover_partitions()
+        partitioned = (time.perf_counter() - started) * 1000
+        print(f"{'retention ms':14}{single:14,.1f}{partitioned:14,.1f}   ({oldest}, {oldest_rows:,} rækker)")
+
+
+if __name__ == "__main__":
+    main()
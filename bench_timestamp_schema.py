@@ -0,0 +1,125 @@
+# Benchmark af timestamp-skemaet.
+# Opretter en database i det gamle skema (SensorData med tekst-timestamps), måler størrelse og hastighed
+# på opslag af tidsintervaller, migrerer den med app.migrate_database og måler det samme igen.
+#
+# Kør: python bench_timestamp_schema.py [--rows 5000000] [--database bench_legacy.db]
+
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import time
+
+import numpy as np
+
+import app
+
+
+def create_legacy_database(db_path, rows):
+    """Opretter en database i det gamle skema med `rows` målinger, én pr. sekund frem til nu."""
+    db = sqlite3.connect(db_path)
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute("""
+        CREATE TABLE SensorData (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            temperature REAL,
+            humidity REAL,
+            loudness REAL,
+            light_level REAL
+        )
+    """)
+
+    rng = np.random.default_rng(42)
+    start = np.datetime64(datetime.datetime.now().replace(microsecond=0), 's') - np.timedelta64(rows, 's')
+
+    for offset in range(0, rows, 86400):
+        count = min(86400, rows - offset)
+        seconds = start + np.arange(offset, offset + count)
+        timestamps = np.char.replace(np.datetime_as_string(seconds, unit='s'), "T", " ")
+        values = rng.uniform(0, 100, (4, count)).round(2)
+
+        with db:
+            db.executemany(
+                "INSERT INTO SensorData (timestamp, temperature, humidity, loudness, light_level) VALUES (?, ?, ?, ?, ?)",
+                zip(timestamps.tolist(), *(column.tolist() for column in values))
+            )
+
+    db.execute("CREATE INDEX idx_sensordata_timestamp ON SensorData (timestamp)")
+    db.close()
+
+
+def database_size(db_path):
+    """Størrelsen på databasefilen i MB efter VACUUM (så frigivne sider ikke tæller med)."""
+    db = sqlite3.connect(db_path)
+    db.execute("VACUUM")
+    db.close()
+    return os.path.getsize(db_path) / 1024 / 1024
+
+
+def measure_range_scans(db_path, query, ranges):
+    """Kører forespørgslen for hvert interval og returnerer (median ms, rækker pr. forespørgsel)."""
+    db = sqlite3.connect(db_path)
+    timings = []
+    for start, end in ranges:
+        started = time.perf_counter()
+        rows = db.execute(query, (start, end)).fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    db.close()
+    return float(np.median(timings)), len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark af tekst- vs. epoch-timestamps")
+    parser.add_argument("--rows", type=int, default=5_000_000, help="Antal rækker (standard: 5.000.000)")
+    parser.add_argument("--database", default=os.path.join(app.script_dir, "bench_legacy.db"), help="Database der bruges til benchmark (overskrives)")
+    parser.add_argument("--scans", type=int, default=20, help="Antal opslag af en times data")
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        os.remove(args.database)
+
+    print(f"Opretter database med {args.rows} rækker i det gamle skema...")
+    create_legacy_database(args.database, args.rows)
+
+    # Tilfældige timers intervaller, samme intervaller før og efter
+    db = sqlite3.connect(args.database)
+    first, last = db.execute("SELECT MIN(timestamp), MAX(timestamp) FROM SensorData").fetchone()
+    db.close()
+    first = datetime.datetime.strptime(first, '%Y-%m-%d %H:%M:%S')
+    span = int((datetime.datetime.strptime(last, '%Y-%m-%d %H:%M:%S') - first).total_seconds()) - 3600
+    random.seed(42)
+    ranges = [first + datetime.timedelta(seconds=random.randrange(max(span, 1))) for _ in range(args.scans)]
+    ranges = [(start, start + datetime.timedelta(hours=1)) for start in ranges]
+
+    size_before = database_size(args.database)
+    scan_before, rows_before = measure_range_scans(
+        args.database,
+        "SELECT timestamp, temperature, humidity, loudness, light_level FROM SensorData WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp",
+        [(start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S')) for start, end in ranges]
+    )
+
+    app.init_database(args.database)
+    started = time.perf_counter()
+    app.migrate_database(args.database, pause=0)
+    migration_seconds = time.perf_counter() - started
+
+    size_after = database_size(args.database)
+    scan_after, rows_after = measure_range_scans(
+        args.database,
+        "SELECT ts_ms, temperature, humidity, loudness, light_level FROM SensorReadings WHERE ts_ms >= ? AND ts_ms < ? ORDER BY ts_ms",
+        [(int(start.timestamp() * 1000), int(end.timestamp() * 1000)) for start, end in ranges]
+    )
+
+    print()
+    print(f"{'':24}{'tekst':>12}{'epoch ms':>12}")
+    print(f"{'Databasestørrelse (MB)':24}{size_before:12.1f}{size_after:12.1f}")
+    print(f"{'Opslag af 1 time (ms)':24}{scan_before:12.2f}{scan_after:12.2f}")
+    print(f"{'Rækker pr. opslag':24}{rows_before:12}{rows_after:12}")
+    print(f"Migrering: {migration_seconds:.1f} s ({args.rows / migration_seconds:,.0f} rækker/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# Tjek af spool-filen: at målinger ikke går tabt eller bliver dobbelte når databasen er låst, og at en måling
+# der aldrig kan indsættes ikke stopper indtaget.
+#   1. Databasen låses. Nummererede målinger går i spool-filen, og ugyldige beskeder (også et ts_ms der ikke kan
+#      være en dato) bliver afvist uden at komme i den. Afspilning mens databasen er låst må ikke flytte offset. Når låsen slippes, skal alt afspilles én gang.
+#   2. En spool-fil med linjer der ikke kan indsættes (ødelagt JSON, forkert antal værdier, ts_ms år 33658) blandet
+#      med gyldige.
+#      De gyldige skal indsættes, de andre flyttes til dead-letter filen, og nye målinger skal gå direkte i databasen.
+#   3. Fejler statistikken efter en måling er gemt, må målingen ikke også havne i spool-filen.
+#   4. Fejler statistikken for én række i en batch, skal de andre rækker stadig tælles med og ligge i hukommelsen.
+#
+# Kør: python check_ingest_spool.py [--messages 20]
+
+import argparse
+import collections
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+
+import app
+
+SOURCE = "Check"
+
+
+def stored_numbers():
+    """Hvor mange gange hvert nummer (temperaturen) står i databasen."""
+    chunks = app.iter_reading_chunks("SELECT ts_ms, temperature FROM {table}")
+    return collections.Counter(int(row[1]) for rows in chunks for row in rows)
+
+
+def send(number, ts_ms=None):
+    message = {"temperature": number, "humidity": 50, "loudness": 10, "light_level": 100, "device": "check"}
+    if ts_ms is not None:
+        message["ts_ms"] = ts_ms
+    app.handle_sensordata_payload(json.dumps(message).encode("utf-8"), SOURCE)
+
+
+def replay_all():
+    while app.ingest_spool.replay():
+        pass
+
+
+def check(errors, condition, message):
+    if not condition:
+        print(f"  FEJL: {message}")
+        errors.append(message)
+
+
+def check_locked_database(errors, work_dir, messages):
+    print("1. Låst database -> spool -> afspilning")
+    app.ingest_spool = app.IngestSpool(os.path.join(work_dir, "locked.log"))
+    failed = app.MQTT_MESSAGES_FAILED.labels(SOURCE)
+    failed_before = failed.value
+
+    # En anden forbindelse holder en skrivelås på den partition der skrives i
+    with contextlib.closing(sqlite3.connect(app.get_active_partition(), isolation_level=None)) as lock:
+        lock.execute("BEGIN EXCLUSIVE")
+        for number in range(messages):
+            send(number)
+        for payload in (b"[18, 50, 10]", b'{"temperature": 18, "humidity": 50, "loudness": 10}', b"[18, 50, 10, NaN]", b'[18, 50, "x", 1]'):
+            app.handle_sensordata_payload(payload, SOURCE)
+        for ts_ms in (10**15, 0, -1):
+            send(-1, ts_ms)
+
+        check(errors, app.ingest_spool.status()["depth"] == messages, f"{messages} målinger skulle ligge i spool-filen: {app.ingest_spool.status()}")
+        check(errors, failed.value - failed_before == 7, f"7 ugyldige beskeder skulle være afvist, ikke {failed.value - failed_before}")
+
+        try:
+            app.ingest_spool.replay()
+            check(errors, False, "afspilning skulle fejle mens databasen er låst")
+        except sqlite3.OperationalError:
+            pass
+        check(errors, app.ingest_spool.offset == 0, "offset flyttede sig selvom afspilningen fejlede")
+        lock.execute("ROLLBACK")
+
+    replay_all()
+    numbers = stored_numbers()
+    check(errors, all(numbers[n] == 1 for n in range(messages)), f"hver måling skulle stå præcis én gang: {dict(numbers)}")
+    check(errors, app.ingest_spool.is_empty(), "spool-filen blev ikke tømt")
+
+
+def check_dead_letter(errors, work_dir):
+    print("2. Linjer der aldrig kan indsættes -> dead-letter fil")
+    path = os.path.join(work_dir, "dead.log")
+    ts_ms = app.get_latest_timestamp_ms() + 1000
+    lines = [
+        json.dumps([ts_ms, "check", [1000, 50, 10, 100]]),
+        "{ødelagt json",
+        json.dumps([ts_ms + 1, "check", [18, 50, 10]]),
+        json.dumps([ts_ms + 2, "check", [18, 50, 10, None]]),
+        json.dumps(["check", [18, 50, 10, 100]]),
+        json.dumps([10**15, "check", [18, 50, 10, 100]]),
+        json.dumps([ts_ms + 3, "check", [1001, 50, 10, 100]]),
+    ]
+    with open(path, "w", encoding="utf-8") as spool_file:
+        spool_file.write("\n".join(lines) + "\n")
+
+    app.ingest_spool = app.IngestSpool(path)
+    replay_all()
+    numbers = stored_numbers()
+    check(errors, numbers[1000] == 1 and numbers[1001] == 1, "de gyldige linjer blev ikke indsat")
+    check(errors, app.ingest_spool.is_empty(), "spool-filen blev ikke tømt")
+    check(errors, app.ingest_spool.status()["dead_letter_total"] == 5, f"5 linjer skulle i dead-letter filen: {app.ingest_spool.status()}")
+    with open(app.ingest_spool.dead_letter_path, encoding="utf-8") as dead_letter_file:
+        check(errors, len(dead_letter_file.readlines()) == 5, "dead-letter filen skulle have 5 linjer")
+
+    send(1002)
+    check(errors, stored_numbers()[1002] == 1 and app.ingest_spool.is_empty(), "en ny måling gik ikke direkte i databasen")
+
+
+def check_failing_statistics(errors, work_dir):
+    print("3. Fejl i statistikken efter indsættelse")
+    app.ingest_spool = app.IngestSpool(os.path.join(work_dir, "statistics.log"))
+
+    def failing_update_statistics(row_id, timestamp, data):
+        raise RuntimeError("statistikken fejler")
+
+    update_statistics, app.update_statistics = app.update_statistics, failing_update_statistics
+    try:
+        send(2000)
+    finally:
+        app.update_statistics = update_statistics
+    replay_all()
+    check(errors, stored_numbers()[2000] == 1, "målingen skulle stå præcis én gang")
+    check(errors, app.ingest_spool.status()["spooled_total"] == 0, "målingen blev lagt i spool-filen selvom den var gemt")
+
+
+def check_one_bad_row(errors, batch=10, bad=3005):
+    print("4. Én række i en batch fejler efter indsættelse")
+    ts_ms = app.get_latest_timestamp_ms() + 1000
+    records = [(ts_ms + n, "check", [3000 + n, 50, 10, 100]) for n in range(batch)]
+    count_before = app.get_statistics("total")["temperature"]["count"]
+
+    def failing_for_one_row(row_id, timestamp, data):
+        if data[0] == bad:
+            raise RuntimeError("statistikken fejler for én række")
+        update_statistics(row_id, timestamp, data)
+
+    update_statistics, app.update_statistics = app.update_statistics, failing_for_one_row
+    try:
+        app.insert_batch_into_database(records)
+    finally:
+        app.update_statistics = update_statistics
+    counted = app.get_statistics("total")["temperature"]["count"] - count_before
+    check(errors, counted == batch - 1, f"{batch - 1} rækker skulle tælles med i statistikken, ikke {counted}")
+    newest = app.hot_tier.newest(batch)
+    check(errors, newest is not None and sorted(newest[1][0]) == [3000 + n for n in range(batch)], "alle rækkerne skulle ligge i hukommelsen")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tjek at spool-filen hverken mister, fordobler eller sidder fast på målinger")
+    parser.add_argument("--messages", type=int, default=20, help="Antal målinger mens databasen er låst (standard: 20)")
+    args = parser.parse_args()
+
+    app.setup_logging(logging.CRITICAL) # Fejlene er forventede; resultatet skrives nedenfor
+    errors = []
+    with tempfile.TemporaryDirectory(prefix="check_ingest_spool_") as work_dir:
+        app.DATABASE_PATH = os.path.join(work_dir, "check_ingest_spool.db")
+        app.init_database()
+        app.load_statistics()
+        app.hot_tier.warm()
+
+        check_locked_database(errors, work_dir, args.messages)
+        check_dead_letter(errors, work_dir)
+        check_failing_statistics(errors, work_dir)
+        check_one_bad_row(errors)
+
+    if errors:
+        print(f"FEJL: {len(errors)} tjek fejlede")
+        sys.exit(1)
+    print("OK: spool-filen mister, fordobler og sidder ikke fast på målinger")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# Tjek af at MQTT-klienten (start_mqtt_client) forbinder igen uden at miste målinger.
+# Starter en lokal broker, app'ens klient og en "sensor" der sender nummererede målinger med QoS 1. Midt i strømmen:
+#   1. Forbindelsen til klienten afbrydes, mens brokeren kører videre. Brokeren gemmer beskederne i den
+#      persistente session (MQTT_CLEAN_SESSION = False), og de skal leveres når klienten er tilbage.
+#   2. Brokeren lukkes ned og startes igen. Sensoren gemmer selv målinger den ikke kunne sende, og sender dem bagefter.
+# Til sidst tjekkes at hver eneste måling står i databasen.
+#
+# Kør: python check_mqtt_reconnect.py [--messages 300] [--port 18831]
+
+import argparse
+import asyncio
+import copy
+import os
+import sys
+import tempfile
+
+from amqtt.client import MQTTClient
+
+import app
+
+SENSOR_CLIENT_ID = "reconnect-check-sensor"
+
+
+def create_broker(port):
+    config = copy.deepcopy(app.broker_config)
+    config["listeners"]["default"]["bind"] = f"127.0.0.1:{port}"
+    return app.create_broker(config, ingest_plugin=False) # Data skal gennem klienten, det er den der testes
+
+
+def client_subscribed(broker):
+    """True når app'ens klient har abonneret på sensordata hos brokeren."""
+    subscriptions = broker._subscriptions.get(app.MQTT_TOPIC_SENSORDATA, [])
+    return any(session.client_id == app.MQTT_CLIENT_ID for session, qos in subscriptions)
+
+
+def drop_connection(handler):
+    """Lukker en TCP-forbindelse brat, som hvis netværket forsvandt."""
+    handler.writer._writer.transport.abort()
+
+
+async def kill_broker(broker):
+    """Stopper brokeren som hvis processen døde. broker.shutdown() lukker kun for nye forbindelser,
+    så de åbne forbindelser afbrydes først."""
+    for session, handler in list(broker._sessions.values()):
+        if handler.writer is not None:
+            drop_connection(handler)
+    await broker.shutdown()
+
+
+def stored_numbers():
+    chunks = app.iter_reading_chunks("SELECT ts_ms, temperature FROM {table}")
+    return {int(row[1]) for rows in chunks for row in rows}
+
+
+async def wait_for(condition, timeout=30):
+    for _ in range(int(timeout / 0.05)):
+        if condition():
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+class Sensor:
+    """Sender målinger med QoS 1. Kan en måling ikke sendes, forbinder sensoren igen og prøver samme måling igen."""
+
+    def __init__(self, address):
+        self.address = address
+        self.client = MQTTClient(client_id=SENSOR_CLIENT_ID, config={"auto_reconnect": False})
+        self.connected = False
+
+    async def send(self, number):
+        while True:
+            try:
+                if not self.connected:
+                    await self.client.connect(self.address, cleansession=False)
+                    self.connected = True
+                data = [float(number), 50.0, 10.0, 1.0]
+                await self.client.publish(app.MQTT_TOPIC_SENSORDATA, app.make_byte_string(data), qos=app.MQTT_QOS)
+                return
+            except Exception:
+                self.connected = False
+                await asyncio.sleep(0.1)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Tjek at MQTT-klienten ikke mister målinger når forbindelsen eller brokeren forsvinder")
+    parser.add_argument("--messages", type=int, default=300, help="Antal målinger der sendes (standard: 300)")
+    parser.add_argument("--port", type=int, default=18831, help="Port til test-brokeren")
+    args = parser.parse_args()
+
+    app.DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "check_mqtt_reconnect.db")
+    app.init_database()
+    app.MQTT_BROKER_CONNECT_ADDRESS = f"mqtt://127.0.0.1:{args.port}"
+    app.MQTT_RECONNECT_MAX_DELAY = 1
+    log = app.get_logger("Check").info # Samme log som klienten, så rækkefølgen af afbrydelser og genforbindelser kan følges
+
+    broker = create_broker(args.port)
+    await broker.start()
+
+    client = MQTTClient(client_id=app.MQTT_CLIENT_ID, config={"auto_reconnect": False})
+    client_task = asyncio.create_task(app.start_mqtt_client(client))
+    await wait_for(lambda: client_subscribed(broker))
+
+    sensor = Sensor(app.MQTT_BROKER_CONNECT_ADDRESS)
+    drop_at, restart_at = args.messages // 3, 2 * args.messages // 3
+
+    for number in range(args.messages):
+        if number == drop_at:
+            log(f"Afbryder klientens forbindelse efter {number} målinger")
+            drop_connection(client._handler)
+
+        if number == restart_at:
+            # Beskederne fra før skal være leveret fra den persistente session, inden brokeren (og dermed sessionen) forsvinder
+            if not await wait_for(lambda: len(stored_numbers()) >= number):
+                log("Beskederne sendt mens klienten var væk blev ikke leveret")
+            log(f"Genstarter brokeren efter {number} målinger")
+            await kill_broker(broker)
+            await asyncio.sleep(1)
+            broker = create_broker(args.port)
+            await broker.start()
+            # amqtt's broker gemmer sessioner i hukommelsen, så efter en genstart skal klienten abonnere igen
+            # før sensorens beskeder har nogen at gå til. En broker med persistens på disk husker abonnementet.
+            if not await wait_for(lambda: client_subscribed(broker)):
+                log("Klienten forbandt ikke igen til brokeren")
+
+        await sensor.send(number)
+        await asyncio.sleep(0.01)
+
+    # Vent på at alle målinger er gemt
+    await wait_for(lambda: len(stored_numbers()) >= args.messages, timeout=15)
+    missing = sorted(set(range(args.messages)) - stored_numbers())
+
+    client_task.cancel()
+    await sensor.client.disconnect()
+    await broker.shutdown()
+
+    if missing:
+        log(f"FEJL: {len(missing)} af {args.messages} målinger mangler: {missing[:20]}")
+        sys.exit(1)
+    log(f"OK: alle {args.messages} målinger er gemt")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,215 @@
+# Tjek af den løbende statistik mod NumPy.
+# Indsætter målinger (med enkelte manglende værdier) i en midlertidig database og sammenligner "total" vinduet
+# med det NumPy regner på de samme værdier: antal, middelværdi og varians (Welford), min/max, tid inden for det
+# ideelle interval og percentiler (sketchen skal ramme inden for STATS_SKETCH_ACCURACY relativ fejl).
+# Derefter "genstartes": statistikken gemmes og glemmes, der indsættes rækker mens den ikke er indlæst (som når
+# app'en er stoppet), og load_statistics skal indhente dem fra checkpointet. Til sidst regnes alt forfra uden
+# checkpoint, og resultatet skal være det samme. Undervejs tælles hvor ofte statistikken gemmes: målingerne har
+# gamle tidspunkter, men der skal stadig gemmes hver STATS_PERSIST_DELAY på uret (her sat ned), hverken oftere
+# eller aldrig.
+# Derudover tjekkes merge: to halvdele flettet skal give det samme som alle målinger i én, og alle nætterne flettet
+# sammen skal give "total" vinduet (percentilerne inden for sketchens relative fejl af NumPy).
+#
+# Kør: python check_statistics.py [--readings 5000] [--seed 42]
+
+import argparse
+import logging
+import math
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import app
+
+QUANTILES = {"p05": 0.05, "p50": 0.50, "p95": 0.95}
+
+
+def insert_readings(rng, count, start_ts_ms):
+    """Indsætter `count` målinger ca. hvert 10. sekund og returnerer dem som (ts_ms, [værdier]) i indsættelsesorden."""
+    readings = []
+    ts_ms = start_ts_ms
+    for _ in range(count):
+        ts_ms += int(rng.integers(5_000, 15_000)) if rng.random() > 0.01 else 3_600_000 # Enkelte lange huller
+        data = [
+            round(float(rng.normal(21, 2)), 2),
+            round(float(rng.normal(50, 10)), 2) if rng.random() > 0.05 else None, # Manglende måling
+            round(float(rng.gamma(4, 6)), 2),
+            round(float(rng.uniform(-5, 400)), 2), # Også negative og nul-nære værdier til sketchen
+        ]
+        app.insert_data_into_database(data, ts_ms, "check")
+        readings.append((ts_ms, data))
+    return readings
+
+
+def expected_summary(readings, metric_index, lower, upper):
+    """Det statistikken skal give for én metric, regnet med NumPy."""
+    pairs = [(ts_ms / 1000, data[metric_index]) for ts_ms, data in readings if data[metric_index] is not None]
+    timestamps = np.array([ts for ts, _ in pairs])
+    values = np.array([value for _, value in pairs])
+    in_range = (values >= lower) & (values <= upper)
+    elapsed = np.clip(np.diff(timestamps), 0, app.STATS_MAX_GAP)
+    return {
+        "count": len(values),
+        "mean": values.mean(),
+        "variance": values.var(ddof=1),
+        "min": values.min(),
+        "max": values.max(),
+        "in_range_count": int(in_range.sum()),
+        "in_range_seconds": float((elapsed * in_range[:-1]).sum()),
+        "in_range_ratio": float((elapsed * in_range[:-1]).sum() / elapsed.sum()),
+        "sorted": np.sort(values),
+    }
+
+
+def compare(label, readings):
+    """Sammenligner "total" vinduet med NumPy. Returnerer antal forskelle."""
+    errors = 0
+    summary = app.get_statistics("total")
+    for index, (metric, (lower, upper)) in enumerate(app.STATS_METRICS.items()):
+        expected = expected_summary(readings, index, lower, upper)
+        actual = summary[metric]
+        for key in ("count", "mean", "variance", "min", "max", "in_range_count", "in_range_seconds", "in_range_ratio"):
+            if not math.isclose(actual[key], expected[key], rel_tol=1e-9, abs_tol=1e-9):
+                print(f"  FEJL ({label}): {metric}.{key} = {actual[key]}, NumPy: {expected[key]}")
+                errors += 1
+
+        # Sketchen svarer med den spand værdien på plads floor(q * (n - 1)) ligger i
+        for key, q in QUANTILES.items():
+            true_value = expected["sorted"][math.floor(q * (expected["count"] - 1))]
+            if abs(actual[key] - true_value) > app.STATS_SKETCH_ACCURACY * abs(true_value) + 1e-9:
+                print(f"  FEJL ({label}): {metric}.{key} = {actual[key]}, NumPy: {true_value}")
+                errors += 1
+
+    # Nattevinduerne skal tilsammen indeholde de samme målinger som "total"
+    with app.statistics_lock:
+        night_count = sum(stats["temperature"].count for window, stats in app.statistics.items() if window.startswith("night:"))
+    if night_count != summary["temperature"]["count"]:
+        print(f"  FEJL ({label}): nætterne har {night_count} målinger, total har {summary['temperature']['count']}")
+        errors += 1
+    return errors
+
+
+def insert_counting_saves(rng, count, start_ts_ms):
+    """Som insert_readings, men tjekker at statistikken gemmes efter uret og ikke efter målingernes tidspunkter."""
+    saves = []
+    save_statistics, persist_delay = app.save_statistics, app.STATS_PERSIST_DELAY
+    app.save_statistics = lambda: (saves.append(time.monotonic()), save_statistics())
+    app.STATS_PERSIST_DELAY = 0.1
+    started = time.monotonic()
+    try:
+        readings = insert_readings(rng, count, start_ts_ms)
+    finally:
+        app.save_statistics, app.STATS_PERSIST_DELAY = save_statistics, persist_delay
+    elapsed = time.monotonic() - started
+    if not min(2, elapsed / 0.1) <= len(saves) <= elapsed / 0.1 + 1:
+        print(f"  FEJL: statistikken blev gemt {len(saves)} gange på {elapsed:.1f} s (forventet ca. hvert 0.1 s)")
+        return readings, 1
+    return readings, 0
+
+
+def build_stats(readings, metric_index, lower, upper):
+    stats = app.RunningStats(lower, upper)
+    for ts_ms, data in readings:
+        if data[metric_index] is not None:
+            stats.add(ts_ms / 1000, data[metric_index])
+    return stats
+
+
+def compare_merged(label, merged, expected, gap_seconds):
+    """Sammenligner et flettet RunningStats med NumPy. gap_seconds er tid mellem de flettede dele der ikke tælles med."""
+    errors = 0
+    summary = merged.summary()
+    for key in ("count", "mean", "variance", "min", "max", "in_range_count"):
+        if not math.isclose(summary[key], expected[key], rel_tol=1e-9, abs_tol=1e-9):
+            print(f"  FEJL ({label}): {key} = {summary[key]}, NumPy: {expected[key]}")
+            errors += 1
+    if abs(summary["in_range_seconds"] - expected["in_range_seconds"]) > gap_seconds + 1e-6:
+        print(f"  FEJL ({label}): in_range_seconds = {summary['in_range_seconds']}, NumPy: {expected['in_range_seconds']}")
+        errors += 1
+    for key, q in QUANTILES.items():
+        true_value = expected["sorted"][math.floor(q * (expected["count"] - 1))]
+        if abs(summary[key] - true_value) > app.STATS_SKETCH_ACCURACY * abs(true_value) + 1e-9:
+            print(f"  FEJL ({label}): {key} = {summary[key]}, NumPy: {true_value}")
+            errors += 1
+    return errors
+
+
+def check_merge(readings):
+    """Fletter to halvdele og alle nætterne, og sammenligner med NumPy og med "total"."""
+    errors = 0
+    half = len(readings) // 2
+    with app.statistics_lock:
+        nights = [stats for window, stats in sorted(app.statistics.items()) if window.startswith("night:")]
+    for index, (metric, (lower, upper)) in enumerate(app.STATS_METRICS.items()):
+        expected = expected_summary(readings, index, lower, upper)
+
+        merged = build_stats(readings[:half], index, lower, upper)
+        merged.merge(build_stats(readings[half:], index, lower, upper))
+        errors += compare_merged(f"merge af halvdele, {metric}", merged, expected, app.STATS_MAX_GAP)
+
+        # Flettet sketch skal have præcis de samme spande som en sketch bygget af alle målingerne
+        whole = build_stats(readings, index, lower, upper)
+        if merged.sketch.to_dict() != whole.sketch.to_dict():
+            print(f"  FEJL (merge af halvdele, {metric}): sketchen har andre spande end en bygget af alle målingerne")
+            errors += 1
+
+        merged = app.RunningStats(lower, upper)
+        for night in nights:
+            merged.merge(night[metric])
+        errors += compare_merged(f"merge af nætter, {metric}", merged, expected, len(nights) * app.STATS_MAX_GAP)
+    return errors
+
+
+def forget_statistics():
+    """Som når app'en stopper: statistikken i hukommelsen forsvinder, og nye rækker bliver ikke talt med."""
+    with app.statistics_lock:
+        app.statistics.clear()
+        app.statistics_state.update(loaded=False, last_id=0, dirty=set(), last_persist=0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tjek den løbende statistik mod NumPy, på tværs af en genstart og ved merge")
+    parser.add_argument("--readings", type=int, default=5000, help="Målinger før og efter genstarten (standard: 5000)")
+    parser.add_argument("--seed", type=int, default=42, help="Seed til målingerne (standard: 42)")
+    args = parser.parse_args()
+
+    app.setup_logging(logging.WARNING)
+    rng = np.random.default_rng(args.seed)
+    errors = 0
+
+    with tempfile.TemporaryDirectory(prefix="check_statistics_") as work_dir:
+        app.DATABASE_PATH = os.path.join(work_dir, "check_statistics.db")
+        app.init_database()
+        app.load_statistics()
+
+        start_ts_ms = int((time.time() - 120 * 86400) * 1000)
+        readings, save_errors = insert_counting_saves(rng, args.readings, start_ts_ms)
+        errors += save_errors + compare("løbende", readings)
+
+        app.save_statistics()
+        forget_statistics()
+        readings += insert_readings(rng, args.readings, readings[-1][0])
+        app.load_statistics()
+        errors += compare("efter genstart", readings)
+
+        # Forfra uden checkpoint skal give det samme
+        with sqlite3.connect(app.DATABASE_PATH) as db:
+            db.execute("DELETE FROM SensorStats")
+            db.execute("DELETE FROM SensorStatsCheckpoint")
+        forget_statistics()
+        app.load_statistics()
+        errors += compare("forfra", readings)
+        errors += check_merge(readings)
+
+    if errors:
+        print(f"FEJL: {errors} forskelle fundet")
+        sys.exit(1)
+    print(f"OK: statistikken for {len(readings)} målinger stemmer med NumPy, også efter genstart og merge")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+# Genererer en stor, realistisk sensordata-database til at teste forespørgsler, grafer og backup mod.
+# Alt regnes med NumPy for mange målinger ad gangen:
+#   temperatur: døgnkurve (koldere om natten) + årstid + langsom drift + støj
+#   luftfugtighed: langsom drift (random walk der trækkes mod sensorens gennemsnit) + støj
+#   lys: dagslys efter solens gang, lamper tændt om aftenen, næsten mørkt om natten
+#   lydniveau: baggrundsstøj + tilfældige støjudbrud (fx en dør eller en samtale) af varierende længde
+# Samme seed og --end giver samme database, så benchmark-kørsler kan sammenlignes.
+#
+# Kør: python generate_history.py --days 90 --devices 10 [--interval 1] [--seed 42] [--end 2024-12-01] [--database sensordata_synthetic.db]
+# Rækkerne skrives i hoveddatabasen og fordeles til sidst i månedspartitioner af app.init_database.
+# (--database sensordata.db fylder app'ens egen database; den skal være tom)
+
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+import app
+
+CHUNK_ROWS = 1_000_000 # Rækker der regnes og indsættes ad gangen
+BURSTS_PER_HOUR = 3 # Gennemsnitligt antal støjudbrud pr. sensor pr. time
+DRIFT_KNOT_SECONDS = 3600 # Afstand mellem punkterne i den langsomme drift (interpoleres imellem)
+
+
+class HistoryModel:
+    """De tilfældige egenskaber for hver sensor og hele perioden, trukket én gang ud fra seed'et."""
+
+    def __init__(self, rng, devices, start, end):
+        self.start = start
+        self.devices = devices
+
+        # Hver sensor står i sit eget rum
+        self.temperature_base = rng.uniform(17.5, 20.5, (devices, 1))
+        self.temperature_swing = rng.uniform(0.8, 2.0, (devices, 1))   # Forskel på dag og nat
+        self.humidity_base = rng.uniform(40, 60, (devices, 1))
+        self.daylight_peak = rng.uniform(80, 400, (devices, 1))        # Hvor meget dagslys rummet får
+        self.lamp_level = rng.uniform(5, 15, (devices, 1))
+        self.loudness_base = rng.uniform(8, 18, (devices, 1))
+        self.phase_ms = rng.integers(0, 1000, (devices, 1))             # Sensorerne måler ikke på præcis samme tid
+
+        # Langsom drift: random walk i punkter en time fra hinanden, der trækkes tilbage mod 0
+        knots = int((end - start) // DRIFT_KNOT_SECONDS) + 2
+        self.knot_times = start + np.arange(knots) * DRIFT_KNOT_SECONDS
+        self.temperature_drift = self._mean_reverting_walk(rng, devices, knots, step=0.15, pull=0.05)
+        self.humidity_drift = self._mean_reverting_walk(rng, devices, knots, step=1.5, pull=0.03)
+
+        # Støjudbrud for hele perioden: start, slut og styrke pr. sensor
+        count = rng.poisson(BURSTS_PER_HOUR * (end - start) / 3600 * devices)
+        self.burst_device = rng.integers(0, devices, count)
+        self.burst_start = rng.uniform(start, end, count)
+        self.burst_end = self.burst_start + rng.exponential(60, count) + 5
+        self.burst_level = rng.uniform(15, 35, count)
+
+    @staticmethod
+    def _mean_reverting_walk(rng, devices, knots, step, pull):
+        """Random walk hvor hvert skridt også trækker `pull` af afstanden tilbage mod 0 (AR(1))."""
+        walk = np.empty((devices, knots))
+        noise = rng.normal(0, step, (devices, knots))
+        walk[:, 0] = noise[:, 0]
+        for i in range(1, knots):
+            walk[:, i] = walk[:, i - 1] * (1 - pull) + noise[:, i]
+        return walk
+
+    def _drift(self, knots, seconds):
+        return np.vstack([np.interp(seconds[d], self.knot_times, knots[d]) for d in range(self.devices)])
+
+    def _bursts(self, seconds):
+        """Lydniveauet fra støjudbrud: en differens-array pr. sensor der summeres op."""
+        first, last = seconds[0, 0], seconds[0, -1] + 1
+        active = (self.burst_start < last) & (self.burst_end > first)
+        device = self.burst_device[active]
+        columns = seconds.shape[1]
+
+        step = seconds[0, 1] - seconds[0, 0] if columns > 1 else 1
+        begin = np.clip(np.ceil((self.burst_start[active] - first) / step), 0, columns).astype(np.int64)
+        finish = np.clip(np.ceil((self.burst_end[active] - first) / step), 0, columns).astype(np.int64)
+
+        levels = np.zeros((self.devices, columns + 1))
+        np.add.at(levels, (device, begin), self.burst_level[active])
+        np.add.at(levels, (device, finish), -self.burst_level[active])
+        return np.cumsum(levels, axis=1)[:, :columns]
+
+    def generate(self, seconds, rng, utc_offset):
+        """Regner alle fire målinger for tidspunkterne `seconds` (én række pr. sensor)."""
+        shape = seconds.shape
+        hour = ((seconds + utc_offset) % 86400) / 3600
+        day_of_year = ((seconds + utc_offset) % (365.25 * 86400)) / 86400
+
+        temperature = (
+            self.temperature_base
+            + self.temperature_swing * np.sin((hour - 9) / 24 * 2 * np.pi)   # Varmest om eftermiddagen
+            - 1.0 * np.cos((day_of_year - 15) / 365.25 * 2 * np.pi)           # Koldest i januar
+            + self._drift(self.temperature_drift, seconds)
+            + rng.normal(0, 0.05, shape)
+        )
+
+        humidity = np.clip(self.humidity_base + self._drift(self.humidity_drift, seconds) + rng.normal(0, 0.5, shape), 15, 95)
+
+        daylight = self.daylight_peak * np.clip(np.sin((hour - 6) / 14 * np.pi), 0, None)
+        lamps = np.where((hour >= 17) & (hour < 23), self.lamp_level, 0)
+        light_level = np.clip(daylight + lamps + rng.normal(0, 0.5, shape), 0, None)
+
+        loudness = self.loudness_base + np.abs(rng.normal(0, 1.5, shape)) + self._bursts(seconds)
+        quiet_night = (hour >= 23) | (hour < 6)
+        loudness = np.where(quiet_night, loudness - 5, loudness).clip(0, None)
+
+        return [column.round(2) for column in (temperature, humidity, loudness, light_level)]
+
+
+def generate_history(db_path, days, devices=1, interval=1, seed=42, end=None, device_prefix="sensor"):
+    """Skriver `days` dages målinger for `devices` sensorer (én pr. `interval` sekund) frem til `end` (unix-tid,
+    standard nu). Returnerer antal rækker."""
+    app.init_database(db_path)
+
+    db = sqlite3.connect(db_path)
+    if app.get_key_bounds(db, "id", db_path)[0] is not None:
+        db.close()
+        raise ValueError(f"{db_path} indeholder allerede målinger")
+
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute("DROP INDEX IF EXISTS idx_sensorreadings_ts") # Bygges igen til sidst, det er hurtigere
+
+    rng = np.random.default_rng(seed)
+    end = int(time.time() if end is None else end) // interval * interval
+    start = end - int(days * 86400) // interval * interval
+    utc_offset = datetime.datetime.now().astimezone().utcoffset().total_seconds()
+    model = HistoryModel(rng, devices, start, end)
+
+    names = [f"{device_prefix}-{i:02d}" for i in range(devices)] if devices > 1 else [app.DEFAULT_DEVICE]
+    samples_per_chunk = max(1, CHUNK_ROWS // devices)
+    total = (end - start) // interval * devices
+
+    started = time.perf_counter()
+    inserted = 0
+    for chunk_start in range(start, end, samples_per_chunk * interval):
+        chunk_end = min(chunk_start + samples_per_chunk * interval, end)
+        seconds = np.broadcast_to(np.arange(chunk_start, chunk_end, interval, dtype=np.int64), (devices, (chunk_end - chunk_start) // interval))
+        columns = model.generate(seconds, rng, utc_offset)
+        ts_ms = seconds * 1000 + model.phase_ms
+
+        # Rækkefølge efter tid (alle sensorer for ét tidspunkt, så det næste), som når data kommer ind live
+        rows = zip(
+            ts_ms.T.ravel().tolist(),
+            names * seconds.shape[1],
+            *(column.T.ravel().tolist() for column in columns)
+        )
+        with db:
+            db.executemany(
+                "INSERT INTO SensorReadings (ts_ms, device, temperature, humidity, loudness, light_level) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+        inserted += seconds.size
+        elapsed = time.perf_counter() - started
+        print(f"[Generator] {inserted:,} af {total:,} rækker ({inserted / elapsed:,.0f} rækker/s)", end="\r", flush=True)
+
+    print()
+    print("[Generator] Bygger index og fordeler rækkerne i partitioner...")
+    db.close()
+    app.init_database(db_path)
+
+    print(f"[Generator] Færdig: {inserted:,} rækker på {time.perf_counter() - started:.1f} s")
+    return inserted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generer en stor database med syntetiske sensordata")
+    parser.add_argument("--days", type=float, default=90, help="Antal dage bagud fra nu (standard: 90)")
+    parser.add_argument("--devices", type=int, default=10, help="Antal sensorer (standard: 10)")
+    parser.add_argument("--interval", type=int, default=1, help="Sekunder mellem målinger fra hver sensor (standard: 1)")
+    parser.add_argument("--seed", type=int, default=42, help="Seed, samme seed giver samme data (standard: 42)")
+    parser.add_argument("--end", help="Sidste tidspunkt (ISO 8601, lokal tid), standard nu")
+    parser.add_argument("--database", default=os.path.join(app.script_dir, "sensordata_synthetic.db"), help="Databasen der skrives til (skal være tom)")
+    args = parser.parse_args()
+
+    try:
+        end = datetime.datetime.fromisoformat(args.end).timestamp() if args.end else None
+        generate_history(args.database, args.days, args.devices, args.interval, args.seed, end)
+    except ValueError as e:
+        print(f"[Generator] {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
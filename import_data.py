@@ -0,0 +1,236 @@
+# Importerer sensordata fra backup-databaser (fx sensordata_backup_*.db fra create_database_backup) og CSV-filer.
+# Rækkerne læses først ind i en midlertidig tabel uden index i store transaktioner. Rækker der allerede findes
+# i en partition (samme ts_ms og device) sorteres fra, én måned ad gangen med de partitioner den måned rører ATTACHet.
+# Resten flyttes over i hoveddatabasens SensorReadings med én INSERT ... SELECT og fordeles derefter i partitionerne.
+# Stop app.py mens der importeres; statistikken bliver regnet forfra ved næste opstart.
+#
+# Kør: python import_data.py backups/sensordata_backup_2024-12-16_10-00-00.db eksport.csv [--device stue]
+
+import argparse
+import csv
+import datetime
+import os
+import sqlite3
+import time
+
+import app
+
+IMPORT_BATCH_SIZE = 500_000 # Rækker pr. transaktion når der læses ind i den midlertidige tabel
+VALUE_COLUMNS = ["temperature", "humidity", "loudness", "light_level"]
+
+
+class Progress:
+    """Skriver antal rækker og rækker/s ud undervejs."""
+
+    def __init__(self, label):
+        self.label = label
+        self.rows = 0
+        self.started = time.perf_counter()
+
+    def add(self, rows):
+        self.rows += rows
+        seconds = time.perf_counter() - self.started
+        print(f"[Import] {self.label}: {self.rows:,} rækker ({self.rows / max(seconds, 1e-9):,.0f} rækker/s)", flush=True)
+
+
+def create_staging_table(db):
+    # Ingen index mens der læses ind; sorteringen sker først når rækkerne flyttes over
+    db.execute("""
+        CREATE TEMP TABLE ImportStaging (
+            ts_ms INTEGER NOT NULL,
+            device TEXT NOT NULL,
+            temperature REAL,
+            humidity REAL,
+            loudness REAL,
+            light_level REAL
+        )
+    """)
+
+
+def stage_database(db, path, device):
+    """Læser en backup-database ind via ATTACH. Understøtter både det gamle (tekst) og det nye (ts_ms) skema."""
+    db.execute("ATTACH DATABASE ? AS source", (path,))
+    try:
+        tables = {name: kind for name, kind in db.execute("SELECT name, type FROM source.sqlite_master")}
+
+        if tables.get("SensorReadings") == "table":
+            columns = [row[1] for row in db.execute("PRAGMA source.table_info(SensorReadings)")]
+            table = "SensorReadings"
+            ts_expression = "ts_ms"
+            device_expression = "device" if "device" in columns else "?"
+        elif tables.get("SensorData") == "table":
+            # Det gamle skema gemte lokal tid som tekst
+            table = "SensorData"
+            ts_expression = "CAST(strftime('%s', timestamp, 'utc') AS INTEGER) * 1000"
+            device_expression = "?"
+        else:
+            print(f"[Import] {path} indeholder ingen sensordata, springes over.")
+            return
+
+        low, high = db.execute(f"SELECT MIN(rowid), MAX(rowid) FROM source.{table}").fetchone()
+        if low is None:
+            return
+
+        sql_stage = f"""
+            INSERT INTO ImportStaging (ts_ms, device, temperature, humidity, loudness, light_level)
+            SELECT {ts_expression}, {device_expression}, temperature, humidity, loudness, light_level
+            FROM source.{table} WHERE rowid >= ? AND rowid < ? AND {ts_expression} IS NOT NULL
+        """
+
+        progress = Progress(os.path.basename(path))
+        for batch_start in range(low, high + 1, IMPORT_BATCH_SIZE):
+            parameters = (batch_start, batch_start + IMPORT_BATCH_SIZE)
+            if device_expression == "?":
+                parameters = (device,) + parameters
+            with db:
+                copied = db.execute(sql_stage, parameters).rowcount
+            progress.add(copied)
+
+    finally:
+        db.execute("DETACH DATABASE source")
+
+
+def parse_csv_timestamp(value):
+    """Fortolker et timestamp fra CSV: ISO 8601 (med Z eller offset = UTC) eller 'YYYY-MM-DD HH:MM:SS' i lokal tid."""
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return int(datetime.datetime.fromisoformat(value).timestamp() * 1000)
+
+
+def stage_csv(db, path, device):
+    """Læser en CSV-fil ind. Kræver en header med ts_ms eller timestamp, og gerne device og sensorværdierne."""
+    with open(path, newline="", encoding="utf-8") as csv_file:
+        reader = csv.DictReader(csv_file)
+        if "ts_ms" not in reader.fieldnames and "timestamp" not in reader.fieldnames:
+            print(f"[Import] {path} mangler en ts_ms eller timestamp kolonne, springes over.")
+            return
+
+        def rows():
+            for line in reader:
+                if line.get("ts_ms"):
+                    ts_ms = int(line["ts_ms"])
+                else:
+                    ts_ms = parse_csv_timestamp(line["timestamp"])
+                yield (ts_ms, line.get("device") or device, *(float(line[c]) if line.get(c) else None for c in VALUE_COLUMNS))
+
+        progress = Progress(os.path.basename(path))
+        batch = []
+        for row in rows():
+            batch.append(row)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                with db:
+                    db.executemany("INSERT INTO ImportStaging VALUES (?, ?, ?, ?, ?, ?)", batch)
+                progress.add(len(batch))
+                batch = []
+        if batch:
+            with db:
+                db.executemany("INSERT INTO ImportStaging VALUES (?, ?, ?, ?, ?, ?)", batch)
+            progress.add(len(batch))
+
+
+def remove_existing_rows(db, db_path):
+    """Sletter rækkerne i den midlertidige tabel der allerede findes i en partition. Returnerer antal slettede."""
+    low, high = db.execute("SELECT MIN(ts_ms), MAX(ts_ms) FROM ImportStaging").fetchone()
+    if low is None:
+        return 0
+
+    removed = 0
+    start = low
+    while start <= high:
+        end = app.get_month_bounds(app.get_month(start))[1]
+        # Hoveddatabasens egen tabel (den første) klares af merge_staging
+        tables = app.attach_partitions(db, "ts_ms", start, end, db_path)[1:]
+        try:
+            for table in tables:
+                with db:
+                    removed += db.execute(f"""
+                        DELETE FROM ImportStaging
+                        WHERE ts_ms >= ? AND ts_ms < ?
+                            AND EXISTS (SELECT 1 FROM {table} r WHERE r.ts_ms = ImportStaging.ts_ms AND r.device = ImportStaging.device)
+                    """, (start, end)).rowcount
+        finally:
+            for table in tables:
+                db.execute(f"DETACH DATABASE {table.split('.')[0]}")
+        start = end
+    return removed
+
+
+def merge_staging(db):
+    """Flytter rækkerne fra den midlertidige tabel over i hoveddatabasens SensorReadings og returnerer antal nye rækker."""
+    # Er tabellen tom (fx ved gendannelse), bygges index først bagefter. Ellers bruges det til at finde dubletter.
+    empty_target = db.execute("SELECT NOT EXISTS (SELECT 1 FROM SensorReadings)").fetchone()[0]
+
+    started = time.perf_counter()
+    with db:
+        if empty_target:
+            db.execute("DROP INDEX IF EXISTS idx_sensorreadings_ts")
+
+        # GROUP BY fjerner dubletter i selve importen, NOT EXISTS dem der allerede findes i databasen
+        inserted = db.execute("""
+            INSERT INTO SensorReadings (ts_ms, device, temperature, humidity, loudness, light_level)
+            SELECT s.ts_ms, s.device, s.temperature, s.humidity, s.loudness, s.light_level
+            FROM ImportStaging s
+            WHERE NOT EXISTS (SELECT 1 FROM SensorReadings r WHERE r.ts_ms = s.ts_ms AND r.device = s.device)
+            GROUP BY s.ts_ms, s.device
+            ORDER BY s.ts_ms
+        """).rowcount
+
+        if empty_target:
+            db.execute("CREATE INDEX idx_sensorreadings_ts ON SensorReadings (ts_ms)")
+
+    seconds = time.perf_counter() - started
+    print(f"[Import] {inserted:,} nye rækker indsat på {seconds:.1f} s ({inserted / max(seconds, 1e-9):,.0f} rækker/s)")
+    return inserted
+
+
+def invalidate_derived_data(db):
+    """Importerede rækker kan høre til nætter der allerede har en gemt rapport, og statistikken skal tælle dem med."""
+    low, high = db.execute("SELECT MIN(ts_ms), MAX(ts_ms) FROM ImportStaging").fetchone()
+    if low is None:
+        return
+
+    first_night = app.get_night_key(low / 1000)
+    last_night = app.get_night_key(high / 1000)
+    with db:
+        db.execute("DELETE FROM NightlyReport WHERE night BETWEEN ? AND ?", (first_night, last_night))
+        db.execute("DELETE FROM SensorStats")
+        db.execute("DELETE FROM SensorStatsCheckpoint")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importer sensordata fra backup-databaser og CSV-filer")
+    parser.add_argument("sources", nargs="+", help="Backup-databaser (.db) og/eller CSV-filer (.csv)")
+    parser.add_argument("--database", default=app.DATABASE_PATH, help="Databasen der importeres til")
+    parser.add_argument("--device", default=app.DEFAULT_DEVICE, help="Enhed for rækker der ikke selv angiver en")
+    args = parser.parse_args()
+
+    app.init_database(args.database)
+    app.migrate_database(args.database, pause=0) # Importen skriver til det nye skema
+
+    db = sqlite3.connect(args.database)
+    db.execute("PRAGMA cache_size = -65536") # 64 MB cache til sortering og index
+    create_staging_table(db)
+
+    started = time.perf_counter()
+    for path in args.sources:
+        if path.lower().endswith(".csv"):
+            stage_csv(db, path, args.device)
+        else:
+            stage_database(db, path, args.device)
+
+    staged = db.execute("SELECT COUNT(*) FROM ImportStaging").fetchone()[0]
+    remove_existing_rows(db, args.database)
+    inserted = merge_staging(db)
+    invalidate_derived_data(db)
+    db.close()
+
+    # Fordel de nye rækker i partitionerne (afsluttede måneder ændres ikke, så de havner i den aktive)
+    app.distribute_readings(args.database)
+
+    seconds = time.perf_counter() - started
+    print(f"[Import] Færdig: {staged:,} rækker læst, {inserted:,} nye, {staged - inserted:,} dubletter. "
+          f"{seconds:.1f} s i alt ({staged / max(seconds, 1e-9):,.0f} rækker/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# Load-generator til MQTT-indtaget.
+# Starter den indbyggede broker (samme konfiguration som app.py) og simulerer N sensorer, hver med sin egen
+# MQTT-forbindelse, der sender målinger med en fast rate. Hver besked får sendetidspunktet med (ts_ms), så der
+# kan måles hvor lang tid der går fra publish til målingen er committed i databasen (eller afspillet fra spool).
+# Der kan angives flere rater, så man kan se hvor kurven knækker: hvor gemt/s holder op med at følge med den
+# tilbudte last, og latenstiden stikker af.
+#
+# Kør: python load_generator.py --devices 50 --rate 1,5,10,20 [--duration 20] [--format object] [--qos 1] [--ingest plugin]
+
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+from amqtt.client import MQTTClient
+
+import app
+
+PAYLOAD_FORMATS = ["object", "list", "legacy"]
+DRAIN_TIMEOUT = 10 # Sekunder uden fremgang før resterende beskeder regnes som tabt
+
+
+class IngestTracker:
+    """Holder styr på sendte og gemte målinger ved at pakke app.ingest_reading og app.insert_batch_into_database ind."""
+
+    def __init__(self):
+        self.pending = {} # (device, ts_ms) -> sendetidspunkter (perf_counter) for beskeder der ikke er gemt endnu
+        self.latencies = []
+        self.sent = 0
+        self.publish_errors = 0
+        self.committed = 0
+        self.spooled = 0
+        self.dropped = 0
+        self.first_send = None
+        self.last_commit = None
+
+        self.ingest_reading = app.ingest_reading
+        self.insert_batch_into_database = app.insert_batch_into_database
+
+    def install(self):
+        app.ingest_reading = self.timed_ingest_reading
+        app.insert_batch_into_database = self.timed_insert_batch
+
+    def uninstall(self):
+        app.ingest_reading = self.ingest_reading
+        app.insert_batch_into_database = self.insert_batch_into_database
+
+    def record_send(self, device, ts_ms):
+        now = time.perf_counter()
+        if self.first_send is None:
+            self.first_send = now
+        self.sent += 1
+        if ts_ms is not None:
+            self.pending.setdefault((device, ts_ms), []).append(now)
+
+    def record_commit(self, device, ts_ms):
+        now = time.perf_counter()
+        self.committed += 1
+        self.last_commit = now
+        sent_at = self.pending.get((device, ts_ms))
+        if sent_at:
+            self.latencies.append((now - sent_at.pop(0)) * 1000)
+            if not sent_at:
+                del self.pending[(device, ts_ms)]
+
+    def timed_ingest_reading(self, data, device=app.DEFAULT_DEVICE, ts_ms=None):
+        result = self.ingest_reading(data, device, ts_ms)
+        if result == "database":
+            self.record_commit(device, ts_ms)
+        elif result == "spool":
+            self.spooled += 1 # Bliver talt som gemt når spool-filen afspilles
+        else:
+            self.dropped += 1
+        return result
+
+    def timed_insert_batch(self, records):
+        self.insert_batch_into_database(records)
+        for ts_ms, device, data in records:
+            self.record_commit(device, ts_ms)
+
+
+def make_payload(payload_format, device, ts_ms, rng):
+    """Bygger en besked i et af de formater app.parse_sensordata forstår."""
+    values = [
+        round(rng.uniform(15.0, 25.0), 2),
+        round(rng.uniform(30.0, 90.0), 2),
+        round(rng.uniform(20.0, 50.0), 2),
+        round(rng.uniform(0.0, 200.0), 2),
+    ]
+    if payload_format == "object":
+        message = {"device": device, "ts_ms": ts_ms, **dict(zip(app.STATS_METRICS, values))}
+    elif payload_format == "list":
+        message = values + [ts_ms, device]
+    else:
+        message = values # Det oprindelige format har ingen enhed eller tid, så latenstid kan ikke måles
+    return json.dumps(message, separators=(",", ":")).encode("utf-8")
+
+
+async def run_device(client, device, rate, started, duration, args, tracker):
+    """Sender målinger med `rate` beskeder/s fra started til started + duration."""
+    rng = random.Random(f"{args.seed}-{device}")
+    interval = 1 / rate
+    next_send = started + rng.uniform(0, interval) # Sensorerne spredes ud, så de ikke sender samtidig
+
+    while next_send < started + duration:
+        await asyncio.sleep(max(0, next_send - time.perf_counter()))
+        ts_ms = int(time.time() * 1000)
+        tagged = args.format != "legacy"
+        payload = make_payload(args.format, device, ts_ms, rng)
+
+        tracker.record_send(device if tagged else app.DEFAULT_DEVICE, ts_ms if tagged else None)
+        try:
+            await client.publish(app.MQTT_TOPIC_SENSORDATA, payload, qos=args.qos)
+        except Exception:
+            tracker.publish_errors += 1
+
+        # Kan sensoren ikke følge med, sendes næste besked med det samme (i stedet for at prøve at indhente)
+        next_send = max(next_send + interval, time.perf_counter())
+
+
+async def wait_for_drain(tracker):
+    """Venter til alle sendte beskeder er gemt eller smidt væk, eller der ikke er sket noget i DRAIN_TIMEOUT sekunder."""
+    last_done, last_progress = -1, time.perf_counter()
+    while time.perf_counter() - last_progress < DRAIN_TIMEOUT:
+        done = tracker.committed + tracker.dropped
+        if done >= tracker.sent - tracker.publish_errors:
+            return
+        if done != last_done:
+            last_done, last_progress = done, time.perf_counter()
+        await asyncio.sleep(0.05)
+
+
+async def run_step(rate, args, address, work_dir, step):
+    """Kører én last (alle sensorer med `rate` beskeder/s) mod en frisk database og returnerer trackeren."""
+    app.DATABASE_PATH = os.path.join(work_dir, f"load_{step}.db")
+    app.init_database()
+    app.ingest_spool = app.IngestSpool(os.path.join(work_dir, f"load_{step}_spool.log"))
+
+    devices = [f"loadgen-{i:04d}" for i in range(args.devices)]
+    clients = [MQTTClient(client_id=device, config={"auto_reconnect": False}) for device in devices]
+    await asyncio.gather(*(client.connect(address) for client in clients))
+
+    subscriber = None
+    listener = None
+    if args.ingest == "client":
+        subscriber = MQTTClient(client_id=app.MQTT_CLIENT_ID, config={"auto_reconnect": False})
+        await subscriber.connect(address, cleansession=True)
+        await subscriber.subscribe([(app.MQTT_TOPIC_SENSORDATA, args.qos)])
+        listener = asyncio.create_task(app.on_message(subscriber))
+
+    tracker = IngestTracker()
+    tracker.install()
+    replay = asyncio.create_task(app.spool_replay_loop(0.2))
+
+    started = time.perf_counter() + 0.1
+    await asyncio.gather(*(
+        run_device(client, device, rate, started, args.duration, args, tracker) for client, device in zip(clients, devices)
+    ))
+    await wait_for_drain(tracker)
+
+    replay.cancel()
+    tracker.uninstall()
+    await asyncio.gather(*(client.disconnect() for client in clients))
+    if subscriber:
+        listener.cancel()
+        await subscriber.disconnect()
+    return tracker
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load-generator og ende-til-ende benchmark af MQTT-indtaget")
+    parser.add_argument("--devices", type=int, default=10, help="Antal simulerede sensorer (standard: 10)")
+    parser.add_argument("--rate", default="1,10,50", help="Beskeder/s pr. sensor, kommasepareret for flere kørsler (standard: 1,10,50)")
+    parser.add_argument("--duration", type=float, default=10, help="Sekunder hver kørsel sender i (standard: 10)")
+    parser.add_argument("--format", choices=PAYLOAD_FORMATS, default="object", help="Payload-format (standard: object)")
+    parser.add_argument("--qos", type=int, choices=[0, 1, 2], default=1, help="QoS for publish (standard: 1)")
+    parser.add_argument("--ingest", choices=["plugin", "client"], default="plugin",
+                        help="plugin: IngestBrokerPlugin i brokeren. client: app'ens egen MQTT-klient via TCP")
+    parser.add_argument("--port", type=int, default=18832, help="Port til load-brokeren")
+    parser.add_argument("--seed", type=int, default=42, help="Seed til sensorværdierne")
+    args = parser.parse_args()
+    rates = [float(rate) for rate in args.rate.split(",")]
+
+    # Kun advarsler i loggen, så det er indtaget der måles og ikke terminalen
+    app.setup_logging(logging.WARNING)
+
+    config = copy.deepcopy(app.broker_config)
+    config["listeners"]["default"]["bind"] = f"127.0.0.1:{args.port}"
+    broker = app.create_broker(config, ingest_plugin=(args.ingest == "plugin"))
+    await broker.start()
+    address = f"mqtt://127.0.0.1:{args.port}"
+
+    print(f"{args.devices} sensorer, {args.duration:g} s pr. kørsel, format={args.format}, QoS {args.qos}, ingest={args.ingest}")
+    print(f"{'tilbudt/s':>10}{'sendt/s':>10}{'gemt/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+          f"{'spool':>8}{'tabt':>8}{'fejl':>8}")
+
+    with tempfile.TemporaryDirectory(prefix="load_generator_") as work_dir:
+        for step, rate in enumerate(rates):
+            tracker = await run_step(rate, args, address, work_dir, step)
+
+            offered = args.devices * rate
+            send_rate = tracker.sent / args.duration
+            seconds = (tracker.last_commit or time.perf_counter()) - (tracker.first_send or time.perf_counter())
+            ingest_rate = tracker.committed / seconds if seconds > 0 else 0
+            lost = tracker.sent - tracker.publish_errors - tracker.committed - tracker.dropped
+            if tracker.latencies:
+                p50, p95, p99, worst = np.percentile(tracker.latencies, [50, 95, 99, 100])
+                latency = f"{p50:9.1f}{p95:9.1f}{p99:9.1f}{worst:9.1f}"
+            else:
+                latency = f"{'-':>9}" * 4
+
+            # Følger gemt/s ikke med den tilbudte last, er vi forbi knækket
+            marker = "  <- følger ikke med" if ingest_rate < 0.95 * offered else ""
+            print(f"{offered:10,.0f}{send_rate:10,.0f}{ingest_rate:10,.0f}{latency}"
+                  f"{tracker.spooled:8}{tracker.dropped + lost:8}{tracker.publish_errors:8}{marker}")
+
+    await broker.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
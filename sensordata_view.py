@@ -0,0 +1,46 @@
+# Kører en forespørgsel mod det gamle SensorData (id, tekst-timestamp, temperature, humidity, loudness, light_level)
+# for værktøjer der ikke selv kan ATTACHe partitionerne. SensorData oprettes som et TEMP view på forbindelsen af
+# app.connect_compatibility_view, og resultatet skrives som CSV. SQLite kan kun ATTACHe et begrænset antal
+# partitioner ad gangen, så ved lange perioder skal --start/--end angives (fx én måned ad gangen).
+#
+# Kør: python sensordata_view.py "SELECT * FROM SensorData ORDER BY timestamp" [--start 2024-12-01] [--end 2025-01-01]
+
+import argparse
+import csv
+import datetime
+import sys
+
+import app
+
+
+def to_ts_ms(date):
+    """'YYYY-MM-DD' (lokal tid) til millisekunder siden epoch."""
+    return int(datetime.datetime.strptime(date, '%Y-%m-%d').timestamp() * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kør en forespørgsel mod SensorData på tværs af partitionerne og skriv CSV")
+    parser.add_argument("query", help="SELECT mod SensorData")
+    parser.add_argument("--start", help="Første dag der tages med (YYYY-MM-DD)")
+    parser.add_argument("--end", help="Dagen efter den sidste der tages med (YYYY-MM-DD)")
+    parser.add_argument("--database", default=app.DATABASE_PATH, help="Hoveddatabasen")
+    args = parser.parse_args()
+
+    start = to_ts_ms(args.start) if args.start else None
+    end = to_ts_ms(args.end) if args.end else None
+    db = app.connect_compatibility_view(start, end, args.database)
+    try:
+        cursor = db.execute(args.query)
+        writer = csv.writer(sys.stdout)
+        writer.writerow([column[0] for column in cursor.description])
+        while True:
+            rows = cursor.fetchmany(app.EXPORT_CHUNK_SIZE)
+            if not rows:
+                break
+            writer.writerows(rows)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()